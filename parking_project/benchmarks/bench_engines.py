@@ -0,0 +1,61 @@
+"""
+Compare query latency of the rate lookup engines against a linear scan of
+every Rate, as get_rate_price originally worked.
+
+Run from parking_project/:
+    PYTHONPATH=. python benchmarks/bench_engines.py [rate count]
+"""
+
+import argparse
+from datetime import datetime
+import time
+
+from common import make_queries, make_rates
+from parking_app.lib.index import RateIndex
+from parking_app.lib.lookup import LookupTable
+from parking_app.lib.rates import Rate
+
+
+def linear_scan(rates: list[Rate], start: datetime, end: datetime) -> int:
+    for rate in rates:
+        if rate.time_span_in_rate(start, end):
+            return rate.price
+    return None
+
+
+def measure(find, queries) -> float:
+    began = time.perf_counter()
+    for start, end in queries:
+        find(start, end)
+    return (time.perf_counter() - began) / len(queries) * 1e6
+
+
+def main(rate_count: int) -> None:
+    rates = make_rates(rate_count)
+    records = [rate.to_record() for rate in rates]
+    queries = make_queries(2000)
+
+    began = time.perf_counter()
+    index = RateIndex(records)
+    index_compile = time.perf_counter() - began
+    began = time.perf_counter()
+    table = LookupTable(index, (1970, 2037))
+    table_compile = time.perf_counter() - began
+
+    for start, end in queries:
+        assert index.find(start, end) == table.find(start, end) == linear_scan(rates, start, end)
+
+    scan_us = measure(lambda start, end: linear_scan(rates, start, end), queries)
+    index_us = measure(index.find, queries)
+    table_us = measure(table.find, queries)
+
+    print(f"{rate_count} rates, {len(queries)} queries")
+    print(f"  linear scan   {scan_us:10.1f} us/query")
+    print(f"  index engine  {index_us:10.1f} us/query  {scan_us / index_us:6.1f}x  compile {index_compile * 1e3:.1f} ms")
+    print(f"  table engine  {table_us:10.1f} us/query  {scan_us / table_us:6.1f}x  compile {table_compile * 1e3:.1f} ms more")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("rate_count", type=int, nargs="?", default=1000, help="rates to generate")
+    main(parser.parse_args().rate_count)
@@ -0,0 +1,165 @@
+"""
+In-process HTTP load driver for the query endpoint.  Requests are passed
+straight to the WSGI handler or ASGI application, without a server or
+sockets, so the measurements cover Django and the views alone.
+
+Run from parking_project/:
+    PYTHONPATH=. python benchmarks/bench_http.py [--interface asgi] [--concurrency 16] [--output results.json]
+
+Pass --help for every option.  Saved results are compared with
+benchmarks/compare.py.
+"""
+
+import argparse
+import asyncio
+import os
+import time
+from urllib.parse import urlencode
+
+from common import make_queries, make_rates_document, percentiles, query_distributions, save_results
+
+
+interfaces = ["wsgi", "asgi"]
+
+
+def query_paths(queries, mode: str) -> list[str]:
+    return [
+        "/park/query?" + urlencode({"start": start.isoformat(), "end": end.isoformat(), "mode": mode})
+        for start, end in queries
+    ]
+
+
+def run_wsgi(paths: list[str]) -> tuple[list[float], dict]:
+    from django.core.wsgi import get_wsgi_application
+    from django.test import RequestFactory
+
+    handler = get_wsgi_application()
+    factory = RequestFactory()
+    environs = [factory.get(path).environ for path in paths]
+
+    samples = []
+    statuses = {}
+
+    def start_response(status, headers):
+        code = status.split(" ", 1)[0]
+        statuses[code] = statuses.get(code, 0) + 1
+
+    for environ in environs:
+        began = time.perf_counter_ns()
+        response = handler(dict(environ), start_response)
+        b"".join(response)
+        samples.append((time.perf_counter_ns() - began) / 1e3)
+    return (samples, statuses)
+
+
+async def run_asgi(paths: list[str], concurrency: int) -> tuple[list[float], dict]:
+    from parking_project.asgi import application
+
+    samples = []
+    statuses = {}
+    pending = iter(paths)
+
+    async def request(path: str) -> None:
+        url_path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": url_path,
+            "query_string": query.encode("ascii"),
+            "headers": [(b"host", b"localhost")],
+            "server": ("localhost", 8000),
+            "client": ("127.0.0.1", 50000),
+        }
+        messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                code = str(message["status"])
+                statuses[code] = statuses.get(code, 0) + 1
+
+        began = time.perf_counter_ns()
+        await application(scope, receive, send)
+        samples.append((time.perf_counter_ns() - began) / 1e3)
+
+    async def client() -> None:
+        for path in pending:
+            await request(path)
+
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return (samples, statuses)
+
+
+def main(args: argparse.Namespace) -> None:
+    # Settings are read when Django is first set up, by the run functions
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", args.settings)
+    os.environ["PARKING_ASYNC_VIEWS"] = "1" if args.interface == "asgi" else ""
+    os.environ["PARKING_RATES_STORE"] = ""
+    os.environ["PARKING_RATES_TABLE"] = ""
+    os.environ["PARKING_RATES_ENGINE"] = args.engine
+
+    import django
+    django.setup()
+    from parking_app.lib.rates import ParkingRates
+
+    ParkingRates.load_rates(make_rates_document(args.rates, timezone_count=args.timezones))
+    paths = query_paths(make_queries(args.requests, args.distribution), args.mode)
+
+    began = time.perf_counter()
+    if args.interface == "asgi":
+        samples, statuses = asyncio.run(run_asgi(paths, args.concurrency))
+    else:
+        samples, statuses = run_wsgi(paths)
+    elapsed = time.perf_counter() - began
+
+    latency = percentiles(samples)
+    metrics = {
+        "requests_per_second": len(samples) / elapsed,
+        **{f"{name}_us": value for name, value in latency.items()},
+    }
+    print(
+            f"{len(samples)} requests over {args.interface}, concurrency {args.concurrency if args.interface == 'asgi' else 1}"
+            f", {args.rates} rates, {args.engine} engine, {args.mode} mode, {args.distribution} queries"
+    )
+    print(f"  statuses  {', '.join(f'{code}: {count}' for code, count in sorted(statuses.items()))}")
+    print(f"  latency   p50 {latency['p50']:.1f} us  p95 {latency['p95']:.1f} us  p99 {latency['p99']:.1f} us")
+    print(f"  throughput {metrics['requests_per_second']:.0f} requests/s")
+
+    if args.output:
+        save_results(args.output, "http", [{
+            "params": {
+                "name": "query",
+                "interface": args.interface,
+                "concurrency": args.concurrency if args.interface == "asgi" else 1,
+                "settings": os.environ["DJANGO_SETTINGS_MODULE"],
+                "rates": args.rates,
+                "timezones": args.timezones,
+                "engine": args.engine,
+                "mode": args.mode,
+                "distribution": args.distribution,
+                "requests": len(samples),
+            },
+            "metrics": dict(metrics, statuses=statuses),
+        }])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--interface", choices=interfaces, default="wsgi")
+    parser.add_argument("--concurrency", type=int, default=8,
+            help="concurrent clients, for the asgi interface")
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--settings", default="parking_project.settings_lean",
+            help="settings module, unless DJANGO_SETTINGS_MODULE is set")
+    parser.add_argument("--rates", type=int, default=1000, help="synthetic rate set size")
+    parser.add_argument("--timezones", type=int, default=20)
+    parser.add_argument("--engine", default="index")
+    parser.add_argument("--mode", default="single")
+    parser.add_argument("--distribution", choices=query_distributions, default="uniform")
+    parser.add_argument("--output", help="file to save results to as JSON")
+    main(parser.parse_args())
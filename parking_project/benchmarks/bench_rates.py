@@ -0,0 +1,178 @@
+"""
+Micro-benchmarks of ParkingRates.load_rates, ParkingRates.patch_rates,
+ParkingRates.get_rate_price and ParkingRates.get_rate_price_range across
+synthetic rate sets, engines, query modes and query distributions.
+
+Run from parking_project/:
+    PYTHONPATH=. python benchmarks/bench_rates.py [--sizes 10,1000] [--output results.json]
+
+Pass --help for every option.  Saved results are compared with
+benchmarks/compare.py.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import time
+
+import pytz
+
+from common import make_queries, make_rates_document, percentiles, query_distributions, save_results
+from parking_app.lib.rates import ParkingRates, engines, query_modes
+
+
+def measure_load(document: dict) -> float:
+    began = time.perf_counter()
+    ParkingRates.load_rates(document)
+    return (time.perf_counter() - began) * 1e3
+
+
+def measure_patch(document: dict, repeats: int = 5) -> float:
+    # Update the price of one rate, the best of several runs
+    rate = document["rates"][len(document["rates"]) // 2]
+    best = None
+    for i in range(repeats):
+        changes = {"update": [dict(rate, price=rate["price"] + i + 1)]}
+        began = time.perf_counter()
+        ParkingRates.publish(ParkingRates.patch_rates(changes))
+        elapsed = (time.perf_counter() - began) * 1e3
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_queries(queries, mode: str) -> dict:
+    ParkingRates.cache.clear()
+    samples = []
+    began = time.perf_counter()
+    for start, end in queries:
+        query_began = time.perf_counter_ns()
+        ParkingRates.get_rate_price(start, end, mode)
+        samples.append((time.perf_counter_ns() - query_began) / 1e3)
+    elapsed = time.perf_counter() - began
+
+    latency = percentiles(samples)
+    return {
+        "queries_per_second": len(queries) / elapsed,
+        **{f"{name}_us": value for name, value in latency.items()},
+    }
+
+
+def measure_range(mode: str, days: int, slot_minutes: int, repeats: int = 3) -> dict:
+    # Price a grid of slots with one range query, and with a query per slot,
+    # the best of several runs each
+    start = pytz.utc.localize(datetime(2021, 7, 5))
+    end = start + timedelta(days=days)
+    slot = timedelta(minutes=slot_minutes)
+    slots = [(start + i * slot, start + (i + 1) * slot) for i in range(days * 24 * 60 // slot_minutes)]
+
+    range_ms = None
+    per_slot_ms = None
+    for _ in range(repeats):
+        began = time.perf_counter()
+        list(ParkingRates.get_rate_price_range(start, end, slot, mode))
+        elapsed = (time.perf_counter() - began) * 1e3
+        range_ms = elapsed if range_ms is None else min(range_ms, elapsed)
+
+        ParkingRates.cache.clear()
+        began = time.perf_counter()
+        for slot_start, slot_end in slots:
+            ParkingRates.get_rate_price(slot_start, slot_end, mode)
+        elapsed = (time.perf_counter() - began) * 1e3
+        per_slot_ms = elapsed if per_slot_ms is None else min(per_slot_ms, elapsed)
+    return {"slots": len(slots), "range_ms": range_ms, "per_slot_ms": per_slot_ms}
+
+
+def main(args: argparse.Namespace) -> None:
+    # Keep the benchmark from writing any files
+    ParkingRates.store = None
+    ParkingRates.table_file = None
+
+    query_sets = {
+        distribution: make_queries(args.queries, distribution)
+        for distribution in args.distributions
+    }
+
+    results = []
+    for size in args.sizes:
+        document = make_rates_document(size, timezone_count=args.timezones, ids=True)
+        for engine in args.engines:
+            ParkingRates.use_engine(engine)
+            load_ms = measure_load(document)
+            patch_ms = measure_patch(document)
+            print(f"{size} rates, {engine} engine: load_rates {load_ms:.1f} ms, patch_rates {patch_ms:.1f} ms")
+            results.append({
+                "params": {"name": "load_rates", "rates": size, "timezones": args.timezones, "engine": engine},
+                "metrics": {"load_ms": load_ms},
+            })
+            results.append({
+                "params": {"name": "patch_rates", "rates": size, "timezones": args.timezones, "engine": engine},
+                "metrics": {"patch_ms": patch_ms},
+            })
+
+            for mode in args.modes:
+                for distribution, queries in query_sets.items():
+                    metrics = measure_queries(queries, mode)
+                    print(
+                            f"  {mode:6} {distribution:8}"
+                            f"  p50 {metrics['p50_us']:8.1f} us"
+                            f"  p99 {metrics['p99_us']:8.1f} us"
+                            f"  {metrics['queries_per_second']:10.0f} queries/s"
+                    )
+                    results.append({
+                        "params": {
+                            "name": "get_rate_price",
+                            "rates": size,
+                            "timezones": args.timezones,
+                            "engine": engine,
+                            "mode": mode,
+                            "distribution": distribution,
+                            "queries": len(queries),
+                        },
+                        "metrics": metrics,
+                    })
+
+                metrics = measure_range(mode, args.range_days, args.range_slot)
+                print(
+                        f"  {mode:6} range     {metrics['slots']} slots"
+                        f"  {metrics['range_ms']:8.1f} ms, {metrics['per_slot_ms']:8.1f} ms querying each slot"
+                )
+                results.append({
+                    "params": {
+                        "name": "get_rate_price_range",
+                        "rates": size,
+                        "timezones": args.timezones,
+                        "engine": engine,
+                        "mode": mode,
+                        "days": args.range_days,
+                        "slot_minutes": args.range_slot,
+                    },
+                    "metrics": metrics,
+                })
+
+    if args.output:
+        save_results(args.output, "rates", results)
+
+
+def parse_list(value: str) -> list[str]:
+    return [item for item in value.split(",") if item]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=lambda value: [int(size) for size in parse_list(value)],
+            default=[10, 100, 1000, 10000, 100000], help="comma separated rate set sizes")
+    parser.add_argument("--timezones", type=int, default=20,
+            help="number of distinct timezones in each rate set")
+    parser.add_argument("--queries", type=int, default=2000,
+            help="queries per distribution")
+    parser.add_argument("--engines", type=parse_list, default=engines,
+            help=f"comma separated engines, from {','.join(engines)}")
+    parser.add_argument("--modes", type=parse_list, default=query_modes,
+            help=f"comma separated query modes, from {','.join(query_modes)}")
+    parser.add_argument("--distributions", type=parse_list, default=query_distributions,
+            help=f"comma separated query distributions, from {','.join(query_distributions)}")
+    parser.add_argument("--range-days", type=int, default=1,
+            help="days priced by each range query")
+    parser.add_argument("--range-slot", type=int, default=15,
+            help="slot duration of range queries in minutes")
+    parser.add_argument("--output", help="file to save results to as JSON")
+    main(parser.parse_args())
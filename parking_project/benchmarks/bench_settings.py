@@ -0,0 +1,92 @@
+"""
+Compare process startup time and per-request overhead of the default and lean
+Django settings.  Each settings module is measured in its own processes, since
+Django can only be set up once per process, keeping the best of several runs.
+
+Run from parking_project/:
+    PYTHONPATH=. python benchmarks/bench_settings.py [request count] [runs]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+settings_modules = ["parking_project.settings", "parking_project.settings_lean"]
+rates_file_path = "parking_app/data/rates.json"
+query_path = "/park/query?start=2015-07-01T07:00:00-05:00&end=2015-07-01T12:00:00-05:00"
+
+
+def measure_requests(handler, path: str, count: int) -> float:
+    from django.test import RequestFactory
+
+    environ = RequestFactory().get(path).environ
+    began = time.perf_counter()
+    for _ in range(count):
+        handler(dict(environ), lambda status, headers: None)
+    return (time.perf_counter() - began) / count * 1e6
+
+
+def child(request_count: int) -> None:
+    # Started by main with DJANGO_SETTINGS_MODULE set
+    began = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+    handler = get_wsgi_application()
+    startup = time.perf_counter() - began
+
+    from parking_app.lib.rates import ParkingRates
+    with open(rates_file_path) as f:
+        ParkingRates.load_rates(json.load(f))
+
+    print(json.dumps({
+        "startup_ms": startup * 1e3,
+        "query_us": measure_requests(handler, query_path, request_count),
+        "ready_us": measure_requests(handler, "/park/ready", request_count),
+    }))
+
+
+def main(request_count: int, runs: int) -> None:
+    results = {}
+    for settings_module in settings_modules:
+        environment = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE=settings_module,
+                PARKING_RATES_STORE="",
+                PARKING_RATES_TABLE=""
+        )
+        for _ in range(runs):
+            output = subprocess.run(
+                    [sys.executable, __file__, "--child", str(request_count)],
+                    env=environment,
+                    check=True,
+                    capture_output=True,
+                    text=True
+            ).stdout
+            result = json.loads(output.splitlines()[-1])
+            best = results.setdefault(settings_module, result)
+            for name, value in result.items():
+                best[name] = min(best[name], value)
+
+    print(f"{request_count} requests per endpoint, best of {runs} runs")
+    for settings_module, result in results.items():
+        print(
+                f"  {settings_module:32} startup {result['startup_ms']:7.1f} ms"
+                f"  /park/query {result['query_us']:7.1f} us"
+                f"  /park/ready {result['ready_us']:7.1f} us"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("request_count", type=int, nargs="?", default=5000, help="requests per endpoint")
+    parser.add_argument("runs", type=int, nargs="?", default=5, help="processes per settings module")
+    # Set when main starts a process measuring one settings module
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.request_count)
+    else:
+        main(args.request_count, args.runs)
@@ -0,0 +1,163 @@
+"""
+Synthetic workloads and result reporting shared by the benchmarks.
+"""
+
+from datetime import datetime, timedelta
+import json
+import platform
+import random
+import subprocess
+import time
+
+import pytz
+
+from parking_app.lib.rates import Rate, day_abbreviations
+
+
+timezones = ["America/Chicago", "America/New_York", "America/Los_Angeles", "Europe/London", "Asia/Kolkata"]
+
+# uniform: anywhere in a week, 15 minutes to 8 hours
+# short: anywhere in a week, 15 minutes to 1 hour
+# long: anywhere in a week, 1 to 14 days, only priced in span mode
+# repeated: 50 uniform queries asked over and over, as served from the cache
+query_distributions = ["uniform", "short", "long", "repeated"]
+
+
+def make_rates_document(count: int, seed: int = 1, timezone_count: int = None, ids: bool = False) -> dict:
+    """
+    Generate a rates document.
+
+    Args:
+        count: Number of rates
+        seed: Random seed, the same seed always gives the same rates
+        timezone_count: Number of distinct timezones the rates use, the five
+            in timezones if not given
+        ids: Give every rate an id, "rate-" followed by its position
+    """
+
+    generator = random.Random(seed)
+    zones = timezones
+    if timezone_count is not None:
+        zones = generator.sample(pytz.common_timezones, timezone_count)
+
+    rates = []
+    for _ in range(count):
+        days = ",".join(generator.sample(day_abbreviations, generator.randint(1, 3)))
+        start = generator.randrange(0, 20) * 60
+        end = start + generator.randrange(1, 24 - start // 60) * 60
+        times = f"{start // 60:02}00-{min(end // 60, 23):02}{59 if end // 60 > 23 else 0:02}"
+        rates.append({
+            "days": days,
+            "times": times,
+            "tz": generator.choice(zones),
+            "price": generator.randint(1, 50) * 100,
+        })
+        if ids:
+            rates[-1]["id"] = f"rate-{len(rates) - 1}"
+    return {"rates": rates}
+
+
+def make_rates(count: int, seed: int = 1, timezone_count: int = None) -> list[Rate]:
+    """
+    Generate Rates, as for make_rates_document.
+    """
+
+    return [
+        Rate(rate["days"], rate["times"], rate["tz"], rate["price"])
+        for rate in make_rates_document(count, seed, timezone_count)["rates"]
+    ]
+
+
+def make_queries(count: int, distribution: str = "uniform", seed: int = 2) -> list[tuple[datetime, datetime]]:
+    """
+    Generate query time ranges.
+
+    Args:
+        count: Number of queries
+        distribution: One of query_distributions
+        seed: Random seed
+
+    Raises:
+        ValueError if the distribution is invalid
+    """
+
+    if distribution not in query_distributions:
+        raise ValueError(f"Invalid distribution {distribution}, must be one of: {', '.join(query_distributions)}")
+
+    generator = random.Random(seed)
+    first = datetime.fromisoformat("2020-10-05T00:00:00-05:00")
+    durations = {
+        "uniform": (15, 8 * 60),
+        "short": (15, 60),
+        "long": (24 * 60, 14 * 24 * 60),
+        "repeated": (15, 8 * 60),
+    }[distribution]
+
+    queries = []
+    for _ in range(50 if distribution == "repeated" else count):
+        start = first + timedelta(minutes=generator.randrange(0, 7 * 24 * 60, 15))
+        queries.append((start, start + timedelta(minutes=generator.randrange(*durations, 15))))
+    if distribution == "repeated":
+        queries = [generator.choice(queries) for _ in range(count)]
+    return queries
+
+
+def percentiles(samples: list[float]) -> dict:
+    """
+    Summarize latency samples.
+
+    Returns:
+        The mean, 50th, 95th and 99th percentiles and maximum of the samples.
+    """
+
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+    return {
+        "mean": sum(ordered) / len(ordered),
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+        "max": ordered[-1],
+    }
+
+
+def current_commit() -> str:
+    """
+    The short hash of the checked out commit, None outside of a git checkout.
+    """
+
+    try:
+        return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                check=True,
+                text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(path: str, benchmark: str, results: list[dict]) -> None:
+    """
+    Save benchmark results as JSON along with what they were measured on, to
+    be compared with benchmarks/compare.py.
+
+    Args:
+        path: File to write
+        benchmark: Name of the benchmark
+        results: Dicts each holding the "params" a measurement was taken with
+            and the "metrics" measured
+    """
+
+    document = {
+        "benchmark": benchmark,
+        "commit": current_commit(),
+        "python": platform.python_version(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
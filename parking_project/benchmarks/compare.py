@@ -0,0 +1,51 @@
+"""
+Compare two benchmark result files saved with --output, e.g. from before and
+after a change.
+
+Run from parking_project/:
+    python benchmarks/compare.py baseline.json candidate.json
+"""
+
+import json
+import sys
+
+
+def load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def result_key(result: dict) -> tuple:
+    return tuple(sorted(result["params"].items()))
+
+
+def describe(params: dict) -> str:
+    name = params.get("name", "")
+    rest = " ".join(str(value) for key, value in params.items() if key != "name")
+    return f"{name} {rest}".strip()
+
+
+def main(baseline_path: str, candidate_path: str) -> None:
+    baseline = load(baseline_path)
+    candidate = load(candidate_path)
+    print(f"baseline  {baseline['benchmark']} at {baseline['commit']} ({baseline['created']})")
+    print(f"candidate {candidate['benchmark']} at {candidate['commit']} ({candidate['created']})")
+
+    baseline_results = {result_key(result): result for result in baseline["results"]}
+    for result in candidate["results"]:
+        before = baseline_results.get(result_key(result))
+        if before is None:
+            continue
+        print(describe(result["params"]))
+        for metric, value in result["metrics"].items():
+            previous = before["metrics"].get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(previous, (int, float)):
+                continue
+            change = f"{(value - previous) / previous * 100:+7.1f}%" if previous else ""
+            print(f"  {metric:20} {previous:12.1f} {value:12.1f} {change}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        sys.exit(__doc__.strip())
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,362 @@
+"""
+Replay traffic captured with PARKING_CAPTURE_FILE against this checkout, and
+compare the responses and latencies of two replays, e.g. before and after an
+engine change.  Requests are passed straight to the WSGI handler or ASGI
+application, as in bench_http.py, at a chosen rate and concurrency.
+
+Run from parking_project/:
+    PYTHONPATH=. python benchmarks/replay.py run capture.jsonl --output before.jsonl [--rates rates.json]
+    PYTHONPATH=. python benchmarks/replay.py diff before.jsonl after.jsonl
+
+A capture file can also be compared with a replay, to check a build answers
+as production did.  Pass --help for every option.
+"""
+
+import argparse
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+import sys
+import threading
+import time
+from typing import Iterable, Iterator
+
+from common import current_commit, percentiles
+from parking_app.lib.capture import body_digest, body_directory, changing_methods, decode_body, read_captures
+
+
+interfaces = ["wsgi", "asgi"]
+
+# Requests replayed between waits for every request in flight to finish
+max_segment = 10000
+
+# Characters of each response kept in a replay, shown when responses differ
+response_preview = 500
+
+# Facility paths are reported together by endpoint.  A facility may be named
+# e.g. rates-north, so only whole path segments are taken for the API's own.
+facility_path = re.compile(r"/park/(?!(?:query|availability|rates)(?:/|$))[-\w]+/")
+
+
+class Pacer:
+    """
+    Spaces the starts of requests sent by any number of clients to a rate
+    per second, or lets them run as fast as they are answered for a rate of 0.
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.began = time.perf_counter()
+        self.sent = 0
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        # Seconds until the next request is due
+        with self._lock:
+            sent = self.sent
+            self.sent += 1
+        if not self.rate:
+            return 0.0
+        return max(0.0, self.began + sent / self.rate - time.perf_counter())
+
+
+def segments(records: Iterable[tuple[int, dict]]) -> Iterator[list[tuple[int, dict]]]:
+    # Requests changing rates are replayed alone, after every earlier request
+    # has been answered and before any later one is sent, so queries are
+    # priced with the same rates in every replay
+    segment = []
+    for i, record in records:
+        if record["method"] in changing_methods:
+            if segment:
+                yield segment
+            yield [(i, record)]
+            segment = []
+            continue
+        segment.append((i, record))
+        if len(segment) == max_segment:
+            yield segment
+            segment = []
+    if segment:
+        yield segment
+
+
+def result(i: int, record: dict, status: int, body: bytes, began: int) -> dict:
+    return {
+        "i": i,
+        "method": record["method"],
+        "path": record["path"],
+        "query": record.get("query", ""),
+        "status": status,
+        "response_digest": body_digest(body),
+        "response": body[:response_preview].decode("utf-8", "replace"),
+        "duration_us": round((time.perf_counter_ns() - began) / 1e3, 1),
+    }
+
+
+def run_wsgi(records: Iterable[tuple[int, dict]], concurrency: int, pacer: Pacer, bodies: str) -> Iterator[dict]:
+    from django.core.wsgi import get_wsgi_application
+    from django.test import RequestFactory
+
+    handler = get_wsgi_application()
+    factory = RequestFactory()
+
+    def replay(item: tuple[int, dict]) -> dict:
+        i, record = item
+        headers = record.get("headers", {})
+        extra = {
+            "HTTP_" + name.upper().replace("-", "_"): value
+            for name, value in headers.items()
+            if name != "Content-Type"
+        }
+        request = factory.generic(
+                record["method"],
+                record["path"] + ("?" + record["query"] if record.get("query") else ""),
+                decode_body(record, "body", bodies) or b"",
+                headers.get("Content-Type", "application/octet-stream"),
+                **extra
+        )
+        statuses = []
+
+        def start_response(status, response_headers):
+            statuses.append(int(status.split(" ", 1)[0]))
+
+        time.sleep(pacer.delay())
+        began = time.perf_counter_ns()
+        response = handler(request.environ, start_response)
+        body = b"".join(response)
+        response.close()
+        return result(i, record, statuses[0], body, began)
+
+    with ThreadPoolExecutor(concurrency) as pool:
+        for segment in segments(records):
+            yield from pool.map(replay, segment)
+
+
+async def run_asgi(records: Iterable[tuple[int, dict]], concurrency: int, pacer: Pacer, bodies: str, write) -> None:
+    from parking_project.asgi import application
+
+    async def replay(i: int, record: dict) -> dict:
+        body = decode_body(record, "body", bodies) or b""
+        headers = [(b"host", b"localhost"), (b"content-length", str(len(body)).encode("ascii"))]
+        headers += [
+            (name.lower().encode("ascii"), value.encode("latin-1"))
+            for name, value in record.get("headers", {}).items()
+        ]
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": record["method"],
+            "scheme": "http",
+            "path": record["path"],
+            "query_string": record.get("query", "").encode("latin-1"),
+            "headers": headers,
+            "server": ("localhost", 8000),
+            "client": ("127.0.0.1", 50000),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        status = None
+        chunks = []
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await asyncio.sleep(pacer.delay())
+        began = time.perf_counter_ns()
+        await application(scope, receive, send)
+        return result(i, record, status, b"".join(chunks), began)
+
+    for segment in segments(records):
+        results = [None] * len(segment)
+        pending = iter(enumerate(segment))
+
+        async def client() -> None:
+            for position, (i, record) in pending:
+                results[position] = await replay(i, record)
+
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+        for replayed in results:
+            write(replayed)
+
+
+def run(args: argparse.Namespace) -> None:
+    # Settings are read when Django is first set up.  Replays neither store
+    # rates nor capture their own traffic.
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", args.settings)
+    os.environ["PARKING_ASYNC_VIEWS"] = "1" if args.interface == "asgi" else ""
+    os.environ["PARKING_RATES_STORE"] = ""
+    os.environ["PARKING_RATES_TABLE"] = ""
+    os.environ["PARKING_FACILITIES_STORE"] = ""
+    os.environ["PARKING_CAPTURE_FILE"] = ""
+    os.environ["PARKING_RATES_ENGINE"] = args.engine
+
+    import django
+    django.setup()
+    from parking_app.lib.rates import ParkingRates
+
+    # Queries after a rates change that can't be replayed would be priced
+    # with other rates, as in captures made before rates changes were
+    # always captured whole
+    with open(args.capture) as capture:
+        lost = [
+            i for i, record in enumerate(read_captures(capture))
+            if record["method"] in changing_methods and record.get("body_omitted")
+        ]
+    if lost:
+        sys.exit(
+                f"{len(lost)} rates changes of the capture have no body, the first request #{lost[0]}, "
+                "so the queries after them can't be replayed with the same rates"
+        )
+
+    if args.rates:
+        with open(args.rates) as f:
+            ParkingRates.load_rates(json.load(f))
+
+    skipped = []
+
+    def replayable(records: Iterable[dict]) -> Iterator[tuple[int, dict]]:
+        # Requests keep their position in the capture, so replays can be
+        # compared with it, but batch queries whose body was too large to
+        # capture can't be replayed
+        for i, record in enumerate(records):
+            if record.get("body_omitted"):
+                skipped.append(i)
+                continue
+            yield (i, record)
+
+    samples = []
+    with open(args.capture) as capture, open(args.output, "w") as output:
+        output.write(json.dumps({"replay": {
+            "capture": args.capture,
+            "commit": current_commit(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "interface": args.interface,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "engine": args.engine,
+            "settings": os.environ["DJANGO_SETTINGS_MODULE"],
+        }}) + "\n")
+
+        def write(replayed: dict) -> None:
+            samples.append(replayed["duration_us"])
+            output.write(json.dumps(replayed) + "\n")
+
+        records = replayable(read_captures(capture))
+        bodies = body_directory(args.capture)
+        pacer = Pacer(args.rate)
+        began = time.perf_counter()
+        if args.interface == "asgi":
+            asyncio.run(run_asgi(records, args.concurrency, pacer, bodies, write))
+        else:
+            for replayed in run_wsgi(records, args.concurrency, pacer, bodies):
+                write(replayed)
+        elapsed = time.perf_counter() - began
+
+    print(f"{len(samples)} requests replayed over {args.interface}, concurrency {args.concurrency}, {args.engine} engine")
+    if skipped:
+        print(f"  {len(skipped)} queries with bodies too large to capture were skipped")
+    if samples:
+        latency = percentiles(samples)
+        print(f"  latency   p50 {latency['p50']:.1f} us  p95 {latency['p95']:.1f} us  p99 {latency['p99']:.1f} us")
+        print(f"  throughput {len(samples) / elapsed:.0f} requests/s")
+
+
+def load_responses(path: str) -> tuple[dict, dict[int, dict]]:
+    # The replay header and responses by the position of their request in the
+    # capture.  Records of a capture file are in capture order.
+    header = {"capture": path}
+    responses = {}
+    with open(path) as f:
+        for position, record in enumerate(read_captures(f)):
+            if "replay" in record:
+                header = record["replay"]
+                continue
+            responses[record.get("i", position)] = record
+    return header, responses
+
+
+def endpoint(record: dict) -> str:
+    return f"{record['method']} {facility_path.sub('/park/<facility>/', record['path'])}"
+
+
+def describe(header: dict) -> str:
+    if "commit" not in header:
+        return f"capture {header['capture']}"
+    return (
+        f"replay of {header['capture']} at {header['commit']} ({header['created']}), "
+        f"{header['interface']}, concurrency {header['concurrency']}, {header['engine']} engine"
+    )
+
+
+def diff(args: argparse.Namespace) -> int:
+    baseline_header, baseline = load_responses(args.baseline)
+    candidate_header, candidate = load_responses(args.candidate)
+    print(f"baseline  {describe(baseline_header)}")
+    print(f"candidate {describe(candidate_header)}")
+
+    compared = [i for i in sorted(candidate) if i in baseline]
+    differences = [
+        i for i in compared
+        if baseline[i].get("status") != candidate[i]["status"]
+        or baseline[i].get("response_digest") != candidate[i]["response_digest"]
+    ]
+    print(f"{len(compared)} requests compared, {len(differences)} responses differ")
+    for i in differences[:args.show]:
+        before = baseline[i]
+        after = candidate[i]
+        query = f"?{after['query']}" if after.get("query") else ""
+        print(f"  #{i} {after['method']} {after['path']}{query}")
+        print(f"    baseline  {before.get('status')} {before.get('response', '')[:response_preview]}")
+        print(f"    candidate {after['status']} {after.get('response', '')}")
+
+    # Latency of each endpoint, over the requests both answered
+    samples = {}
+    for i in compared:
+        before, after = samples.setdefault(endpoint(candidate[i]), ([], []))
+        before.append(baseline[i]["duration_us"])
+        after.append(candidate[i]["duration_us"])
+    print(f"{'latency (us)':32} {'baseline':>12} {'candidate':>12}")
+    for name, (before, after) in sorted(samples.items()):
+        before = percentiles(before)
+        after = percentiles(after)
+        for metric in ("p50", "p95", "p99"):
+            change = (after[metric] - before[metric]) / before[metric] * 100 if before[metric] else 0
+            print(f"  {name:26} {metric} {before[metric]:12.1f} {after[metric]:12.1f} {change:+7.1f}%")
+    return 1 if differences else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="replay a capture file against this checkout")
+    run_parser.add_argument("capture", help="capture file written with PARKING_CAPTURE_FILE")
+    run_parser.add_argument("--output", required=True, help="file to save the responses and latencies to")
+    run_parser.add_argument("--interface", choices=interfaces, default="wsgi")
+    run_parser.add_argument("--concurrency", type=int, default=1, help="requests in flight at once")
+    run_parser.add_argument("--rate", type=float, default=0,
+            help="requests started per second, 0 to send each as soon as a client is free")
+    run_parser.add_argument("--rates", help="rates document to load before replaying, e.g. production's rates")
+    run_parser.add_argument("--settings", default="parking_project.settings_lean",
+            help="settings module, unless DJANGO_SETTINGS_MODULE is set")
+    run_parser.add_argument("--engine", default="index")
+
+    diff_parser = commands.add_parser("diff", help="compare the responses and latencies of two replays")
+    diff_parser.add_argument("baseline", help="replay or capture file")
+    diff_parser.add_argument("candidate", help="replay or capture file")
+    diff_parser.add_argument("--show", type=int, default=20, help="differing responses to print")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(diff(args))
@@ -1,5 +1,34 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, reset_queries
 
 
 class ParkingAppConfig(AppConfig):
     name = 'parking_app'
+
+    def ready(self):
+        from parking_app.lib.facilities import facilities
+        from parking_app.lib.rates import ParkingRates
+
+        # Without a database there are no connections to reset or close at the
+        # start and end of every request
+        if not settings.DATABASES:
+            request_started.disconnect(reset_queries)
+            request_started.disconnect(close_old_connections)
+            request_finished.disconnect(close_old_connections)
+
+        ParkingRates.use_engine(settings.PARKING_RATES_ENGINE, settings.PARKING_RATES_TABLE_HORIZON)
+
+        # Prefer the precompiled table shared by running workers, falling back
+        # to the stored rates document
+        if settings.PARKING_RATES_TABLE:
+            ParkingRates.use_table_file(settings.PARKING_RATES_TABLE)
+        if settings.PARKING_RATES_STORE:
+            ParkingRates.use_store(settings.PARKING_RATES_STORE)
+
+        # Facility rates are read from the store when each facility is first
+        # requested
+        facilities.use_memory_budget(settings.PARKING_FACILITIES_MEMORY)
+        if settings.PARKING_FACILITIES_STORE:
+            facilities.use_store(settings.PARKING_FACILITIES_STORE)
@@ -0,0 +1,123 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, update_wrapper
+
+from django.http import HttpRequest, HttpResponse
+
+from parking_app import views
+from parking_app.lib.facilities import facilities
+from parking_app.lib.rates import ParkingRates
+
+
+# Validating, compiling and storing rates updates runs here rather than on the
+# event loop.  A single thread also keeps concurrent rates updates in order of
+# arrival.
+rates_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="parking-rates")
+
+# Compiling rates for queries runs here, apart from rates updates, so a query
+# never waits for a large rates update to compile first, and with a few threads
+# so the rates of one facility don't wait for those of another.
+sync_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="parking-sync")
+
+
+async def sync_rates(facility: str = None) -> None:
+    # Rates published by another worker are compiled when first picked up, as
+    # are facility rates read from the store or with their index dropped,
+    # which is kept off the event loop as for rates updates
+    loop = asyncio.get_running_loop()
+    if facility is None:
+        if ParkingRates.sync_pending():
+            await loop.run_in_executor(sync_executor, ParkingRates.sync)
+        return
+    rates = facilities.rate_sets.get(facility)
+    if rates is None or rates.compile_pending():
+        await loop.run_in_executor(sync_executor, partial(load_facility, facility))
+
+
+def load_facility(facility: str) -> None:
+    rates = views.get_rates(facility)
+    if rates is not None:
+        rates.compile()
+
+
+class AsyncView:
+    """
+    Mixin serving a View's async def handlers natively under ASGI.
+
+    Django 3.1 only recognizes a view as async if the function returned by
+    as_view is a coroutine function, which View.as_view never is.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            # Handlers Django supplies itself, such as options, are not async
+            if asyncio.iscoroutine(response):
+                response = await response
+            return response
+
+        update_wrapper(async_view, view)
+        return async_view
+
+
+class ParkingQueryView(AsyncView, views.ParkingQueryView):
+    # Queries are answered from memory in microseconds, so they run on the
+    # event loop without a thread hop
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        await sync_rates(kwargs.get("facility"))
+        return super().get(request, *args, **kwargs)
+
+
+class ParkingBatchQueryView(AsyncView, views.ParkingBatchQueryView):
+
+    async def post(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        await sync_rates(kwargs.get("facility"))
+        return super().post(request, *args, **kwargs)
+
+
+class ParkingRangeQueryView(AsyncView, views.ParkingRangeQueryView):
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        await sync_rates(kwargs.get("facility"))
+        return super().get(request, *args, **kwargs)
+
+
+class ParkingAvailabilityView(AsyncView, views.ParkingAvailabilityView):
+
+    async def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        await sync_rates(kwargs.get("facility"))
+        return super().get(request, *args, **kwargs)
+
+
+class ParkingRatesView(AsyncView, views.ParkingRatesView):
+
+    async def put(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+                rates_executor,
+                partial(super().put, request, *args, **kwargs)
+        )
+
+    async def patch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+                rates_executor,
+                partial(super().patch, request, *args, **kwargs)
+        )
+
+
+async def ready(request: HttpRequest) -> HttpResponse:
+    return views.ready(request)
+
+
+async def health(request: HttpRequest) -> HttpResponse:
+    await sync_rates()
+    return views.health(request)
+
+
+async def metrics(request: HttpRequest) -> HttpResponse:
+    return views.metrics(request)
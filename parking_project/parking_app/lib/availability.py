@@ -0,0 +1,135 @@
+from bisect import bisect_right
+from heapq import nsmallest
+from typing import Iterable, Iterator, NamedTuple
+
+from parking_app.lib.index import MINUTES_PER_DAY, RateIndex
+from parking_app.lib.timezones import EPOCH_DAY_NUMBER, MICROSECONDS_PER_MINUTE
+
+
+class Window(NamedTuple):
+    """
+    Consecutive start times of a stay, every one of which is priced the same.
+
+    Attributes:
+        first: Earliest start, in UTC epoch minutes
+        last: Latest start, in UTC epoch minutes
+        price: Price of a stay starting at any of them
+    """
+
+    first: int
+    last: int
+    price: int
+
+
+def find_windows(index: RateIndex, start: int, end: int, duration: int, mode: str = "single") -> Iterator[Window]:
+    """
+    Find when a stay of a given duration can start within a time range, as
+    windows of start times priced the same.  Stays start on whole minutes and
+    must end by the end of the range.
+
+    A stay's price can only change where its start or end crosses the start
+    or end of a rate on some day, in the UTC offset in effect, or where the
+    offset at its start or end changes.  Those start times are found by
+    sweeping the rates of each day in the range once, and the stay is priced
+    with the index only at each of them, rather than at every minute, so
+    windows are priced exactly as index.find prices any stay within them.
+
+    Args:
+        index: RateIndex of the rates
+        start: The start of the time range, UTC epoch microseconds
+        end: The end of the time range, UTC epoch microseconds
+        duration: Duration of the stay in minutes
+        mode: As for RateIndex.find
+
+    Returns:
+        An iterator of the Windows in time order, leaving out start times no
+        price is available at.
+    """
+
+    first = -(-start // MICROSECONDS_PER_MINUTE)
+    last = end // MICROSECONDS_PER_MINUTE - duration
+    if last < first:
+        return
+
+    points = sorted(point for point in change_points(index, first, last, duration) if first < point <= last)
+    window = None
+    for point, following in zip([first] + points, points + [last + 1]):
+        price = index.find_microseconds(
+                point * MICROSECONDS_PER_MINUTE,
+                (point + duration) * MICROSECONDS_PER_MINUTE,
+                mode
+        )
+        if window is not None and window.price == price:
+            window = window._replace(last=following - 1)
+            continue
+        if window is not None:
+            yield window
+        window = Window(point, following - 1, price) if price is not None else None
+    if window is not None:
+        yield window
+
+
+def change_points(index: RateIndex, first: int, last: int, duration: int) -> set[int]:
+    """
+    Find the start times, in UTC epoch minutes, at which the price of a stay
+    of a given duration may change, for stays starting from first to last.
+    Times outside of first to last may be included.
+    """
+
+    points = set()
+    for table in index.tables:
+        offsets = table.offsets
+        i = bisect_right(offsets.times, first * 60) - 1
+        j = bisect_right(offsets.times, (last + duration) * 60)
+
+        # Where the offset at the start or the end of the stay changes
+        for transition in offsets.times[i + 1:j]:
+            minute = -(-transition // 60)
+            points.add(minute)
+            points.add(minute - duration)
+
+        # Where the local start, rounded down, or the local end, rounded up,
+        # reaches or passes the start or end of a rate or midnight, in each
+        # offset in effect over the range
+        for offset in set(offsets.offsets[i:j]):
+            start_offset = offset // 60
+            end_offset = -(-offset // 60)
+            first_day = (first + start_offset) // MINUTES_PER_DAY
+            last_day = (last + duration + end_offset) // MINUTES_PER_DAY
+            for day in range(first_day, last_day + 1):
+                day_table = table.days[(day + EPOCH_DAY_NUMBER) % 7]
+                base = day * MINUTES_PER_DAY
+                for minute in (0, *(day_table.breaks if day_table is not None else ())):
+                    local = base + minute
+                    points.add(local - start_offset)
+                    points.add(local - duration - start_offset)
+                    points.add(local - duration - end_offset)
+                    points.add(local + 1 - duration - end_offset)
+    return points
+
+
+def rank_windows(windows: Iterable[Window], offset: int, limit: int) -> tuple[list[Window], int]:
+    """
+    Rank windows by price, then by start, keeping only a page of them so the
+    windows needn't all be held and sorted.
+
+    Args:
+        windows: Windows to rank, e.g. as found by find_windows
+        offset: Windows to skip from the cheapest
+        limit: Most windows to return
+
+    Returns:
+        A 2-tuple of the windows of the page, cheapest first, and the number
+        of windows ranked.
+    """
+
+    count = 0
+
+    def counted() -> Iterator[Window]:
+        nonlocal count
+        for window in windows:
+            count += 1
+            yield window
+
+    ranked = nsmallest(offset + limit, counted(), key=lambda window: (window.price, window.first))
+    return (ranked[offset:], count)
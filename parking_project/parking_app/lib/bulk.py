@@ -0,0 +1,291 @@
+from collections import deque
+import csv
+import io
+from itertools import islice
+import json
+import multiprocessing
+import os
+import tempfile
+from time import perf_counter
+from typing import Callable, Iterable, Iterator, NamedTuple, TextIO
+
+from parking_app.lib.rates import ParkingRates, query_modes
+from parking_app.lib.ratetable import RateTableFile
+from parking_app.lib.records import RateArrays
+from parking_app.lib.validator import validate_get_parking_timestamps
+
+
+# csv: comma separated start and end columns, under a header naming them or
+#   as the first two columns
+# ndjson: one object per line with start and end
+stay_formats = ["csv", "ndjson"]
+
+# Columns written for each stay in the csv format
+csv_columns = ["start", "end", "rate", "error"]
+
+# Stays sent to a worker process at a time
+chunk_stays = 2000
+
+# Chunks sent to the pool but not yet written, per worker process, which
+# bounds the stays held in memory however long the input is
+chunks_per_process = 4
+
+# Set in each worker process by _init_worker
+_worker = None
+
+
+class PricedChunk(NamedTuple):
+    """
+    Output of one chunk of stays priced by a worker process.
+
+    Attributes:
+        text: The priced stays, formatted for the output
+        stays: Stays in the chunk
+        unavailable: Stays without an available rate
+        invalid: Stays that couldn't be read or whose times are invalid
+    """
+
+    text: str
+    stays: int
+    unavailable: int
+    invalid: int
+
+
+class PricingSummary(NamedTuple):
+    """
+    Progress of price_stays, so far or in total.
+
+    Attributes:
+        stays: Stays priced and written, including unavailable and invalid
+            ones
+        unavailable: Stays without an available rate
+        invalid: Stays that couldn't be read or whose times are invalid
+        seconds: Time spent pricing
+    """
+
+    stays: int
+    unavailable: int
+    invalid: int
+    seconds: float
+
+    @property
+    def stays_per_second(self) -> float:
+        return self.stays / self.seconds if self.seconds else 0.0
+
+
+def price_stays(
+        lines: Iterable[str],
+        output: TextIO,
+        rates: RateArrays,
+        format: str = "csv",
+        mode: str = "single",
+        processes: int = None,
+        progress: Callable[[PricingSummary], None] = None,
+        progress_seconds: float = 5.0
+) -> PricingSummary:
+    """
+    Price a stream of stays, each a start and end time, across a pool of
+    worker processes, writing the prices in input order as each chunk is
+    priced.
+
+    The rates are written once to a RateTableFile which every worker maps and
+    compiles, as server workers share rates, with the engine in use by
+    ParkingRates.  Only chunks_per_process chunks per worker are read ahead of
+    the output, so memory use doesn't grow with the input.  Stays are priced
+    as /park/query prices them, and invalid stays are written with their error
+    rather than stopping the run.
+
+    Args:
+        lines: Lines of the input, e.g. a text file
+        output: Text stream the priced stays are written to
+        rates: Rates to price with
+        format: One of stay_formats, of both the input and output
+        mode: One of query_modes, as for ParkingRates.get_rate_price
+        processes: Worker processes, by default one per CPU
+        progress: Called with the PricingSummary so far every progress_seconds
+            while pricing
+        progress_seconds: Interval between calls to progress
+
+    Returns:
+        The PricingSummary of all the stays.
+
+    Raises:
+        ValueError if format or mode is invalid
+        RuntimeError if a worker process can't load the rates
+    """
+
+    if format not in stay_formats:
+        raise ValueError(f"Invalid format {format}, must be one of: {', '.join(stay_formats)}")
+    if mode not in query_modes:
+        raise ValueError(f"Invalid mode {mode}, must be one of: {', '.join(query_modes)}")
+    processes = processes or os.cpu_count() or 1
+
+    lines = (line for line in lines if line.strip())
+    columns = None
+    if format == "csv":
+        columns, lines = _csv_columns(lines)
+        output.write(",".join(csv_columns) + "\n")
+
+    began = perf_counter()
+    reported = began
+    stays = unavailable = invalid = 0
+    with tempfile.TemporaryDirectory(prefix="price-stays-") as directory:
+        table_path = os.path.join(directory, "rates.table")
+        RateTableFile(table_path).write(rates)
+        initargs = (
+                table_path,
+                rates.digest(),
+                ParkingRates.engine,
+                ParkingRates.table_horizon,
+                format,
+                columns,
+                mode
+        )
+        with multiprocessing.Pool(processes, _init_worker, initargs) as pool:
+            pending = deque()
+            chunks = _chunks(lines)
+            while True:
+                # Keep the pool busy while writing chunks in the order they
+                # were read
+                for chunk in islice(chunks, processes * chunks_per_process - len(pending)):
+                    pending.append(pool.apply_async(_price_chunk, (chunk,)))
+                if not pending:
+                    break
+                priced = pending.popleft().get()
+                output.write(priced.text)
+                stays += priced.stays
+                unavailable += priced.unavailable
+                invalid += priced.invalid
+
+                now = perf_counter()
+                if progress is not None and now - reported >= progress_seconds:
+                    reported = now
+                    progress(PricingSummary(stays, unavailable, invalid, now - began))
+
+    output.flush()
+    return PricingSummary(stays, unavailable, invalid, perf_counter() - began)
+
+
+def _csv_columns(lines: Iterator[str]) -> tuple[tuple[int, int], Iterator[str]]:
+    # Positions of the start and end columns, from the header if the first
+    # line names them, and the lines of stays
+    first = next(lines, None)
+    if first is None:
+        return ((0, 1), iter(()))
+    header = [name.strip().lower() for name in next(csv.reader([first]))]
+    if "start" in header and "end" in header:
+        return ((header.index("start"), header.index("end")), lines)
+    return ((0, 1), _prepend(first, lines))
+
+
+def _prepend(first: str, lines: Iterator[str]) -> Iterator[str]:
+    yield first
+    yield from lines
+
+
+def _chunks(lines: Iterator[str]) -> Iterator[list[str]]:
+    while True:
+        chunk = list(islice(lines, chunk_stays))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _Worker(NamedTuple):
+    format: str
+    columns: tuple[int, int]
+    mode: str
+    error: str
+
+
+def _init_worker(
+        table_path: str,
+        version: str,
+        engine: str,
+        horizon: tuple[int, int],
+        format: str,
+        columns: tuple[int, int],
+        mode: str
+) -> None:
+    # An initializer raising would have the pool start workers forever, so
+    # failures are raised by the first chunk priced instead
+    global _worker
+    error = None
+    try:
+        # Forked workers don't write to or follow the parent's store and
+        # table file
+        ParkingRates.store = None
+        ParkingRates.snapshot = None
+        ParkingRates.use_engine(engine, horizon)
+        ParkingRates.use_table_file(table_path)
+        if ParkingRates.snapshot is None or ParkingRates.snapshot.version != version:
+            error = f"Failed to load rates from {table_path}"
+    except Exception as e:
+        error = f"Failed to load rates from {table_path}: {e}"
+    _worker = _Worker(format, columns, mode, error)
+
+
+def _price_chunk(lines: list[str]) -> PricedChunk:
+    worker = _worker
+    if worker.error is not None:
+        raise RuntimeError(worker.error)
+
+    if worker.format == "csv":
+        start_column, end_column = worker.columns
+        stays = [
+            (
+                row[start_column] if start_column < len(row) else None,
+                row[end_column] if end_column < len(row) else None
+            )
+            for row in csv.reader(lines)
+        ]
+    else:
+        stays = [_read_ndjson(line) for line in lines]
+
+    # Prices of the valid stays, errors of the rest
+    spans = []
+    errors = [None] * len(stays)
+    for i, (start, end) in enumerate(stays):
+        if start is None or end is None:
+            errors[i] = "Stay must have a start and end"
+            continue
+        try:
+            spans.append(validate_get_parking_timestamps(start, end))
+        except ValueError as e:
+            errors[i] = f"Invalid start/end dates: {e}"
+    prices = iter(ParkingRates.get_rate_prices(spans, worker.mode))
+
+    text = io.StringIO()
+    writer = csv.writer(text, lineterminator="\n")
+    unavailable = 0
+    for (start, end), error in zip(stays, errors):
+        if error is None:
+            price = next(prices)
+            if price is None:
+                unavailable += 1
+                price = "unavailable"
+        else:
+            price = None
+        if worker.format == "csv":
+            writer.writerow((start, end, price, error))
+        elif error is None:
+            text.write(json.dumps({"start": start, "end": end, "rate": price}) + "\n")
+        else:
+            text.write(json.dumps({"start": start, "end": end, "error": error}) + "\n")
+    invalid = len(stays) - len(spans)
+    return PricedChunk(text.getvalue(), len(stays), unavailable, invalid)
+
+
+def _read_ndjson(line: str) -> tuple[str, str]:
+    try:
+        stay = json.loads(line)
+    except ValueError:
+        return (None, None)
+    if not isinstance(stay, dict):
+        return (None, None)
+    start = stay.get("start")
+    end = stay.get("end")
+    return (
+        start if isinstance(start, str) else None,
+        end if isinstance(end, str) else None
+    )
@@ -0,0 +1,82 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """
+    Size bounded least recently used cache.
+
+    Every entry is stored with the generation it was computed under.  An entry
+    looked up under a different generation is treated as a miss and dropped, so
+    bumping the generation invalidates the whole cache without having to clear
+    it under the lock.
+
+    Args:
+        maxsize: Maximum number of entries held before the least recently used
+            entry is evicted
+    """
+
+    def __init__(self, maxsize: int):
+        if maxsize < 1:
+            raise ValueError(f"Invalid cache size {maxsize}, must be at least 1")
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, generation: int):
+        """
+        Get a cached value.
+
+        Args:
+            key: The key the value was stored under
+            generation: The current generation
+
+        Returns:
+            A 2-tuple of whether the key was found and the cached value.  A
+            cached value may itself be None so found must be checked.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != generation:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return (False, None)
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return (True, entry[1])
+
+    def put(self, key, generation: int, value) -> None:
+        """
+        Store a value, evicting the least recently used entry if the cache is
+        full.
+
+        Args:
+            key: The key to store the value under
+            generation: The generation the value was computed under
+            value: The value to store
+        """
+
+        with self._lock:
+            self._entries[key] = (generation, value)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
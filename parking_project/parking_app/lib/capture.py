@@ -0,0 +1,223 @@
+import base64
+import hashlib
+import json
+import random
+import re
+import os
+import threading
+from typing import BinaryIO, Iterator
+import uuid
+
+
+# Paths of the requests captured, queries, availability searches and rates of
+# the rates outside of any facility and of every facility
+captured_paths = re.compile(r"/park/(?:[-\w]+/)?(?:query(?:/batch|/range)?|availability|rates)")
+
+# Methods changing rates, always captured rather than sampled so a replay
+# prices queries with the same rates
+changing_methods = ["PUT", "PATCH"]
+
+# Bytes copied at a time from what is left of a request body
+copy_chunk_size = 64 * 1024
+
+# Request headers kept in captures, as they change responses
+captured_headers = ["Content-Type", "Content-Encoding", "Accept", "If-None-Match"]
+
+
+class CaptureFile:
+    """
+    Sampled requests and their responses, appended to a JSON lines file as
+    they are answered, to be replayed with benchmarks/replay.py.
+
+    Each line is an object of the request's time in UTC epoch seconds, method,
+    path, query string, captured_headers sent and body, and of the response's
+    status, digest, body, and duration in microseconds.  Bodies are stored as
+    text, or base64 under body_base64 and response_base64 if they aren't UTF-8,
+    and are left out, with the digest still recorded for responses, if larger
+    than max_body.  The bodies of rates changes are never left out: those
+    larger than max_body are copied to a file of the body_directory, named by
+    body_file.
+
+    Args:
+        path: Location of the capture file, appended to if it exists
+        sample: Fraction of queries captured, 0 to 1
+        max_body: Largest request or response body stored, in bytes
+    """
+
+    def __init__(self, path: str, sample: float, max_body: int):
+        if not 0 <= sample <= 1:
+            raise ValueError(f"Invalid sample {sample}, must be between 0 and 1")
+        self.path = str(path)
+        self.sample = sample
+        self.max_body = max_body
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def wants(self, method: str, path: str) -> bool:
+        """
+        Check whether a request is captured, sampling queries.
+
+        Args:
+            method: HTTP method of the request
+            path: Path of the request, without the query string
+        """
+
+        if not captured_paths.fullmatch(path):
+            return False
+        if method in changing_methods:
+            return True
+        return random.random() < self.sample
+
+    def write(self, record: dict) -> None:
+        """
+        Append a captured request to the file, as one line written at once so
+        lines from concurrent requests don't interleave.
+        """
+
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def body_file(self) -> tuple[str, BinaryIO]:
+        """
+        Create a file in the body_directory of the capture for a request body
+        too large to store in its record.
+
+        Returns:
+            A 2-tuple of the name of the file, to store as body_file, and the
+            file open for writing.
+        """
+
+        directory = body_directory(self.path)
+        os.makedirs(directory, exist_ok=True)
+        name = f"{uuid.uuid4().hex}.body"
+        return (name, open(os.path.join(directory, name), "wb"))
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class BodyCopy:
+    """
+    Stream of a request body copying what is read from it to a file, so a
+    body read as it streams in is captured without holding it in memory.
+
+    Args:
+        stream: The request body stream, read from with read or readline
+        file: Binary file the body is copied to
+    """
+
+    def __init__(self, stream, file: BinaryIO):
+        self.stream = stream
+        self.file = file
+
+    def read(self, *args, **kwargs) -> bytes:
+        data = self.stream.read(*args, **kwargs)
+        self.file.write(data)
+        return data
+
+    def readline(self, *args, **kwargs) -> bytes:
+        data = self.stream.readline(*args, **kwargs)
+        self.file.write(data)
+        return data
+
+    def close(self) -> None:
+        """
+        Copy whatever of the body wasn't read, e.g. by a request rejected
+        part way through, and close the file.
+        """
+
+        while self.read(copy_chunk_size):
+            pass
+        self.file.close()
+
+
+def body_directory(path: str) -> str:
+    """
+    Directory holding the request bodies of a capture file stored in files
+    of their own.
+    """
+
+    return f"{path}.bodies"
+
+
+def body_hash():
+    """
+    Hash of a response body, for bodies digested a chunk at a time.  Its
+    hexdigest is the body_digest of the body.
+    """
+
+    return hashlib.blake2b(digest_size=16)
+
+
+def body_digest(body: bytes) -> str:
+    """
+    Digest of a response body, compared between captures and replays.
+    """
+
+    digest = body_hash()
+    digest.update(body)
+    return digest.hexdigest()
+
+
+def encode_body(record: dict, key: str, body: bytes) -> None:
+    """
+    Store a body in a capture record under key, or key_base64 if it isn't
+    UTF-8, e.g. gzip compressed rates.
+    """
+
+    try:
+        record[key] = body.decode("utf-8")
+    except UnicodeDecodeError:
+        record[f"{key}_base64"] = base64.b64encode(body).decode("ascii")
+
+
+def decode_body(record: dict, key: str, directory: str = None) -> bytes:
+    """
+    Read a body stored with encode_body, or copied to a file of directory.
+
+    Args:
+        record: The capture record
+        key: "body" or "response"
+        directory: The body_directory of the capture, None to not read
+            bodies stored in files
+
+    Returns:
+        The body, None if it wasn't stored.
+    """
+
+    if key in record:
+        return record[key].encode("utf-8")
+    if f"{key}_base64" in record:
+        return base64.b64decode(record[f"{key}_base64"])
+    if f"{key}_file" in record and directory is not None:
+        with open(os.path.join(directory, record[f"{key}_file"]), "rb") as f:
+            return f.read()
+    return None
+
+
+def read_captures(stream) -> Iterator[dict]:
+    """
+    Read the records of a capture file.
+
+    Args:
+        stream: Text file-like object of a capture file
+
+    Returns:
+        An iterator of the records in the file, in the order captured.
+
+    Raises:
+        ValueError, while iterating, if a line isn't a JSON object
+    """
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Line {line_number}: {e}") from None
+        if not isinstance(record, dict):
+            raise ValueError(f"Line {line_number}: must be an object")
+        yield record
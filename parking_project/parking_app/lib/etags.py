@@ -0,0 +1,43 @@
+import hashlib
+
+
+def query_etag(version: str, *window) -> str:
+    """
+    Strong entity tag of a query response, which only changes when the rates
+    queried change.
+
+    Args:
+        version: Version of the rates queried, of the RateSnapshot returned
+            by ParkingRates.get_snapshot
+        window: Everything else the response depends on, normalized so
+            equivalent queries share a tag, e.g. the start and end in UTC epoch
+            microseconds rather than as sent, and the query mode
+
+    Returns:
+        The quoted entity tag.
+    """
+
+    digest = hashlib.blake2b(version.encode(), digest_size=16)
+    for value in window:
+        digest.update(b"\0" + str(value).encode())
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    Check whether an If-None-Match header matches an entity tag, comparing
+    weakly as RFC 7232 specifies for If-None-Match.
+
+    Args:
+        if_none_match: Value of the header, a comma separated list of entity
+            tags or *
+        etag: The quoted entity tag of the current response
+    """
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == etag or tag == "*":
+            return True
+    return False
@@ -0,0 +1,316 @@
+from collections import OrderedDict
+import logging
+import os
+import re
+import threading
+
+from parking_app.lib.cache import LRUCache
+from parking_app.lib.ingest import iter_rates
+from parking_app.lib.metrics import Counter, Gauge, registry
+from parking_app.lib.rates import ParkingRates, RateSnapshot
+from parking_app.lib.store import RateStore
+
+
+logger = logging.getLogger(__name__)
+
+# Facility names are used in URLs and store file names
+facility_pattern = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Approximate memory taken by a compiled index, measured with tracemalloc: per
+# rate, and per timezone for each engine
+index_bytes_per_rate = 400
+timezone_bytes = {"index": 2 * 1024, "table": 48 * 1024}
+
+# Query results cached for each facility
+facility_cache_size = 1024
+
+
+class FacilityRates(ParkingRates):
+    """
+    Rates of one facility: a ParkingRates with its own rates, query cache and
+    store.  Get one with FacilityRegistry.get.
+
+    The index of a facility's rates is compiled when the rates are first
+    queried or changed rather than when they are read from the store, and may
+    be dropped by the registry to stay within its memory budget, to be compiled
+    again on the next query.  The rates themselves stay loaded, taking a few
+    bytes each.
+
+    Worker processes share a facility's rates through its store rather than a
+    table file: each query stats the store file, and rates stored by another
+    process are read again, to be compiled when next queried.
+    """
+
+    facility = None
+    facilities = None
+    # Held while the snapshot is replaced
+    lock = None
+
+    @classmethod
+    def publish(cls, snapshot: RateSnapshot, persist: bool = True) -> None:
+        try:
+            with cls.lock:
+                super().publish(snapshot, persist)
+        finally:
+            cls.facilities._compiled(cls)
+
+    @classmethod
+    def sync(cls) -> None:
+        """
+        Read the rates from the store if another process has stored new
+        rates, leaving their index to be compiled when next queried.
+        """
+
+        store = cls.store
+        if store is None or not store.changed():
+            return
+        with cls.lock:
+            # Rates may have been read, or published, meanwhile
+            if not store.changed():
+                return
+            try:
+                stored_rates = store.open()
+                if stored_rates is None:
+                    return
+                with stored_rates:
+                    snapshot = cls.compile_rate_stream(iter_rates(stored_rates), compile_index=False)
+            except Exception as e:
+                logger.error(f"Failed to load stored rates of facility {cls.facility}: {e}")
+                return
+            cls.snapshot = snapshot
+        cls.facilities._compiled(cls)
+        logger.info(f"Updated rates of facility {cls.facility} from the store")
+
+    @classmethod
+    def compile_pending(cls) -> bool:
+        """
+        Check whether the next query will compile the index, or read rates
+        stored by another process, as for ParkingRates.sync_pending.
+        """
+
+        snapshot = cls.snapshot
+        store = cls.store
+        return (snapshot is not None and snapshot.index is None) or (store is not None and store.changed())
+
+    @classmethod
+    def compile(cls) -> None:
+        """Compile the index now if it is not compiled."""
+        if cls.compile_pending():
+            cls._get_snapshot()
+
+    @classmethod
+    def index_size(cls) -> int:
+        """
+        Estimate the memory taken by the compiled index, 0 if it is not
+        compiled.
+        """
+
+        snapshot = cls.snapshot
+        if snapshot is None or snapshot.index is None:
+            return 0
+        timezone_count = len(snapshot.rates.timezones)
+        return len(snapshot.rates) * index_bytes_per_rate + timezone_count * timezone_bytes[cls.engine]
+
+    @classmethod
+    def _get_snapshot(cls, snapshot: RateSnapshot = None) -> RateSnapshot:
+        snapshot = super()._get_snapshot(snapshot)
+        if snapshot.index is not None:
+            cls.facilities._used(cls)
+            return snapshot
+
+        # The snapshot in use is compiled and kept.  One replaced since it was
+        # taken is compiled just for the query, as its rates are still the
+        # rates the query is answered from.
+        with cls.lock:
+            current = cls.snapshot
+            if current.generation != snapshot.generation:
+                return snapshot._replace(index=cls._compile_index(snapshot.rates))
+            if current.index is None:
+                current = cls.snapshot = current._replace(index=cls._compile_index(current.rates))
+            snapshot = current
+        cls.facilities._compiled(cls)
+        return snapshot
+
+    @classmethod
+    def _drop_index(cls) -> bool:
+        # Rates being compiled or published are left alone, they are counted
+        # again by the registry once done
+        if not cls.lock.acquire(blocking=False):
+            return False
+        try:
+            snapshot = cls.snapshot
+            if snapshot is None or snapshot.index is None:
+                return False
+            # A recompiled index orders rates by position, as do the ids.  The
+            # generation is kept since the prices are the same, so cached
+            # results stay valid.
+            ids = snapshot.rates.ids or ()
+            cls.snapshot = snapshot._replace(
+                    index=None,
+                    ids={rate_id: order for order, rate_id in enumerate(ids) if rate_id is not None}
+            )
+            return True
+        finally:
+            cls.lock.release()
+
+
+class FacilityRegistry:
+    """
+    Named rate sets, one per facility, each a FacilityRates.
+
+    Facilities are created when rates are first loaded for them, or read from
+    the store when first requested.  Compiled indexes are tracked least
+    recently used first, and once their estimated memory exceeds the budget
+    the indexes of the coldest facilities are dropped until it no longer does.
+
+    Args:
+        memory_budget: Estimated bytes, see FacilityRates.index_size, the
+            compiled indexes of every facility may take together, None for no
+            limit.  The most recently used index is always kept.
+        store_dir: Directory the rates of each facility are stored in, None to
+            keep rates in memory only
+    """
+
+    def __init__(self, memory_budget: int = None, store_dir: str = None):
+        self.memory_budget = memory_budget
+        self.store_dir = None
+        if store_dir:
+            self.use_store(store_dir)
+        self.rate_sets = {}
+        # Estimated size of each compiled index by facility, least recently
+        # used first
+        self.compiled = OrderedDict()
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def use_store(self, store_dir: str) -> None:
+        """
+        Store the rates of each facility in a directory, as <facility>.json,
+        to be loaded when the facility is first requested.  The directory is
+        created if needed.
+
+        Args:
+            store_dir: Location of the directory
+        """
+
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = str(store_dir)
+
+    def use_memory_budget(self, memory_budget: int) -> None:
+        """
+        Set the memory budget of compiled indexes, dropping indexes already
+        over it the next time an index is compiled.
+
+        Raises:
+            ValueError if memory_budget is not a positive integer or None
+        """
+
+        if memory_budget is not None and (type(memory_budget) != int or memory_budget < 1):
+            raise ValueError(f"Invalid memory budget {memory_budget}, must be a positive number of bytes")
+        self.memory_budget = memory_budget
+
+    def get(self, facility: str, create: bool = False) -> type:
+        """
+        Get the rates of a facility.
+
+        Args:
+            facility: Name of the facility, letters, digits, - and _
+            create: Create the facility, without rates, if it has none, so
+                rates can be loaded for it
+
+        Returns:
+            The FacilityRates of the facility, None if it has no rates and
+            create is false.
+
+        Raises:
+            ValueError if facility is not a valid facility name
+        """
+
+        rates = self.rate_sets.get(facility)
+        if rates is not None:
+            return rates
+        if type(facility) != str or not facility_pattern.fullmatch(facility):
+            raise ValueError(f"Invalid facility {facility!r}, must be 1 to 64 letters, digits, - or _")
+
+        store = None
+        stored_rates = None
+        if self.store_dir is not None:
+            store = RateStore(os.path.join(self.store_dir, f"{facility}.json"))
+            stored_rates = store.open()
+        if stored_rates is None and not create:
+            return None
+
+        rates = type(f"FacilityRates[{facility}]", (FacilityRates,), {
+            "facility": facility,
+            "facilities": self,
+            "lock": threading.Lock(),
+            "changes_lock": threading.Lock(),
+            "snapshot": None,
+            "cache": LRUCache(maxsize=facility_cache_size),
+            "store": store,
+            "table_file": None,
+        })
+        if stored_rates is not None:
+            try:
+                with stored_rates:
+                    rates.snapshot = rates.compile_rate_stream(iter_rates(stored_rates), compile_index=False)
+            except Exception as e:
+                logger.error(f"Failed to load stored rates of facility {facility}: {e}")
+
+        # Another request may have created the facility meanwhile
+        with self._lock:
+            return self.rate_sets.setdefault(facility, rates)
+
+    def memory(self) -> int:
+        """Get the estimated memory taken by compiled indexes."""
+        with self._lock:
+            return sum(self.compiled.values())
+
+    def _used(self, rates: type) -> None:
+        with self._lock:
+            if rates.facility in self.compiled:
+                self.compiled.move_to_end(rates.facility)
+
+    def _compiled(self, rates: type) -> None:
+        size = rates.index_size()
+        with self._lock:
+            # Rates read again from the store are not compiled yet
+            if not size:
+                self.compiled.pop(rates.facility, None)
+                return
+            self.compiled[rates.facility] = size
+            self.compiled.move_to_end(rates.facility)
+            if self.memory_budget is None:
+                return
+            total = sum(self.compiled.values())
+            while total > self.memory_budget and len(self.compiled) > 1:
+                facility, size = self.compiled.popitem(last=False)
+                total -= size
+                if not self.rate_sets[facility]._drop_index():
+                    continue
+                self.evictions += 1
+                logger.info(f"Dropped the rate index of facility {facility} to stay within the memory budget")
+
+
+facilities = FacilityRegistry()
+
+registry.register(Gauge(
+        "parking_facilities",
+        "Number of facilities with rates loaded.",
+        lambda: len(facilities.rate_sets)
+))
+registry.register(Gauge(
+        "parking_facilities_compiled",
+        "Number of facilities with a compiled rate index.",
+        lambda: len(facilities.compiled)
+))
+registry.register(Gauge(
+        "parking_facilities_index_bytes",
+        "Estimated memory taken by the compiled rate indexes of facilities.",
+        facilities.memory
+))
+registry.register(Counter(
+        "parking_facilities_evictions_total",
+        "Facility rate indexes dropped to stay within the memory budget.",
+        lambda: facilities.evictions
+))
@@ -0,0 +1,644 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from typing import Iterator
+
+import pytz
+
+from parking_app.lib.records import RateArrays
+from parking_app.lib.timestamp import Instant, epoch_microseconds
+from parking_app.lib.timezones import timezone_offsets
+
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# Slots of a time range priced together by find_range, bounding the memory a
+# long range takes
+range_chunk_size = 1024
+
+
+def start_minute(local: datetime) -> int:
+    """
+    Minute of the day a local start time falls in, rounded down.  Rate
+    boundaries are whole minutes so rounding down does not change the result of
+    comparing against a rate start time.
+    """
+
+    return local.hour * 60 + local.minute
+
+
+def end_minute(local: datetime) -> int:
+    """
+    Minute of the day a local end time falls in, rounded up so that an end
+    time with seconds is never treated as inside a rate that ends on the
+    preceding minute.
+    """
+
+    minute = local.hour * 60 + local.minute
+    if local.second or local.microsecond:
+        minute += 1
+    return minute
+
+
+def day_number(local: datetime) -> int:
+    """
+    Days from the start of the proleptic Gregorian calendar to the date of a
+    local time.  The calendar began on a Monday, so the weekday is the day
+    number modulo 7.
+    """
+
+    return local.toordinal() - 1
+
+
+def slot_boundaries(start, end, slot) -> Iterator[list]:
+    """
+    Boundaries of the slots of a time range: start, start + slot and so on,
+    with the last slot ending at end even if shorter.
+
+    Args:
+        start: The start of the time range, e.g. a datetime or epoch time
+        end: The end of the time range, of the same type as start
+        slot: The slot duration, which added to start gives the same type
+
+    Returns:
+        An iterator of lists of the boundaries of up to range_chunk_size
+        slots, each list starting with the last boundary of the one before.
+    """
+
+    boundary = start
+    chunk = [boundary]
+    while boundary < end:
+        boundary = min(boundary + slot, end)
+        chunk.append(boundary)
+        if len(chunk) > range_chunk_size:
+            yield chunk
+            chunk = [boundary]
+    if len(chunk) > 1:
+        yield chunk
+
+
+def changed_days(rate) -> int:
+    """
+    Bitmask of the weekdays whose DayTables a rate is part of: its days, and
+    for an overnight rate the following days.
+    """
+
+    mask = rate.days_mask
+    if rate.end <= rate.start and rate.end > 0:
+        mask |= ((mask << 1) | (mask >> 6)) & 0b1111111
+    return mask
+
+
+class DayTable:
+    """
+    Rates applying to a single weekday in a single timezone.
+
+    The day is split into elementary segments at every rate start and end
+    time.  Each segment holds the rates covering it, ordered by their position
+    in the rates document, so a lookup is a bisect to find the segment followed
+    by a scan of the few rates covering the start time.
+
+    Args:
+        intervals: (order, start minute, end minute, price, part) for every
+            rate applying to this day.  Part is 1 for the morning part of an
+            overnight rate that started the previous day, 0 otherwise.
+    """
+
+    def __init__(self, intervals: list[tuple[int, int, int, int, int]]):
+        self.breaks = sorted({b for _, start, end, _, _ in intervals for b in (start, end)})
+        positions = {b: i for i, b in enumerate(self.breaks)}
+
+        # Intervals are sorted by order so every segment ends up ordered too.
+        # Each rate is a single tuple shared by every segment it covers.
+        segments = [[] for _ in range(len(self.breaks) - 1)]
+        for order, start, end, price, part in sorted(intervals):
+            entry = (order, end, price, part)
+            for i in range(positions[start], positions[end]):
+                segments[i].append(entry)
+        self.segments = [tuple(segment) for segment in segments]
+
+    def find(self, start: int, end: int) -> tuple[int, int]:
+        """
+        Find the first rate containing the minute range start to end.
+
+        Args:
+            start: Start minute of the day, rounded down
+            end: End minute of the day, rounded up
+
+        Returns:
+            A 2-tuple of the rate's order and price, None if no rate contains
+            the range.
+        """
+
+        i = bisect_right(self.breaks, start) - 1
+        if i < 0 or i >= len(self.segments):
+            return None
+        for order, rate_end, price, _ in self.segments[i]:
+            if rate_end >= end:
+                return (order, price)
+        return None
+
+    def sweep(self, spans: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        """
+        Find the first rate containing each of several minute ranges, as for
+        find.  Ranges given in order of their start are found in a single
+        pass over the segments.
+
+        Args:
+            spans: (start, end) minute ranges, as for find
+
+        Returns:
+            A 2-tuple of order and price, or None, for each range.
+        """
+
+        breaks = self.breaks
+        segments = self.segments
+        matches = []
+        i = -1
+        for start, end in spans:
+            if i < 0 or start < breaks[i]:
+                i = bisect_right(breaks, start) - 1
+            else:
+                while i + 1 < len(breaks) and breaks[i + 1] <= start:
+                    i += 1
+
+            match = None
+            if 0 <= i < len(segments):
+                for order, rate_end, price, _ in segments[i]:
+                    if rate_end >= end:
+                        match = (order, price)
+                        break
+            matches.append(match)
+        return matches
+
+    def find_sum(self, start: int, end: int) -> int:
+        """
+        Sum the prices of the rates covering the minute range start to end.
+        The segments from start to end are walked in order, taking the first
+        rate covering each segment and counting the rate each time the range
+        passes into it.
+
+        Args:
+            start: Start minute of the day, rounded down
+            end: End minute of the day, rounded up
+
+        Returns:
+            The summed price, None if any part of the range is not covered by
+            a rate.
+        """
+
+        i = bisect_right(self.breaks, start) - 1
+        if i < 0:
+            return None
+
+        total = 0
+        previous = None
+        while self.breaks[i] < end:
+            if i == len(self.segments) or not self.segments[i]:
+                return None
+            order, _, price, part = self.segments[i][0]
+            if (order, part) != previous:
+                previous = (order, part)
+                total += price
+            i += 1
+        return total
+
+
+class WeeklyTimeline:
+    """
+    The rates of a single timezone laid out over a week, used to price time
+    ranges of any length.
+
+    The week is split into runs, each either a gap or a single occurrence of
+    a rate on one of its days, taking the first rate where rates overlap.  As
+    with DayTable.find_sum, a range is charged for every run it passes into.
+    Prefix sums of run prices and gap counts over the week let the price of a
+    range spanning any number of weeks be found with two bisects and a few
+    arithmetic operations.
+
+    Args:
+        occurrences: (order, weekday, start minute, end minute, price) for
+            every day of every rate.
+    """
+
+    def __init__(self, occurrences: list[tuple[int, int, int, int, int]]):
+        pieces = []
+        for order, day, start, end, price in occurrences:
+            begin = day * MINUTES_PER_DAY + start
+            finish = day * MINUTES_PER_DAY + end
+            if end <= start:
+                finish += MINUTES_PER_DAY
+            # Overnight rates starting on Sunday carry over to Monday
+            if finish > MINUTES_PER_WEEK:
+                pieces.append((order, begin, MINUTES_PER_WEEK, day, price))
+                pieces.append((order, 0, finish - MINUTES_PER_WEEK, day, price))
+            else:
+                pieces.append((order, begin, finish, day, price))
+
+        breaks = sorted({0, MINUTES_PER_WEEK} | {b for _, begin, finish, _, _ in pieces for b in (begin, finish)})
+        positions = {b: i for i, b in enumerate(breaks)}
+        chosen = [None] * (len(breaks) - 1)
+        for order, begin, finish, day, price in sorted(pieces):
+            for i in range(positions[begin], positions[finish]):
+                if chosen[i] is None:
+                    chosen[i] = (order, day, price)
+
+        runs = []
+        for start, occurrence in zip(breaks, chosen):
+            if not runs or runs[-1][1] != occurrence:
+                runs.append((start, occurrence))
+
+        # Start the week at a run boundary so no occurrence is split in two
+        # across the end of the week and counted twice
+        self.origin = 0
+        if len(runs) > 1 and runs[0][1] == runs[-1][1]:
+            self.origin = runs[1][0]
+            runs = [(start - self.origin, occurrence) for start, occurrence in runs[1:]]
+
+        self.starts = [start for start, _ in runs]
+        self.prices = [0]
+        self.gaps = [0]
+        for _, occurrence in runs:
+            self.prices.append(self.prices[-1] + (0 if occurrence is None else occurrence[2]))
+            self.gaps.append(self.gaps[-1] + (1 if occurrence is None else 0))
+
+    def price(self, start_day: int, start: int, end_day: int, end: int) -> int:
+        """
+        Sum the prices of the rate occurrences covering a local time range.
+
+        Args:
+            start_day: Day number of the start of the time range
+            start: Start minute of the day, rounded down
+            end_day: Day number of the end of the time range
+            end: End minute of the day, rounded up
+
+        Returns:
+            The summed price, None if any part of the range is not covered by
+            a rate.
+        """
+
+        first = start_day * MINUTES_PER_DAY + start - self.origin
+        last = end_day * MINUTES_PER_DAY + end - self.origin - 1
+        if last < first:
+            return None
+
+        first_run = self._run(first)
+        last_run = self._run(last) + 1
+        if self._total(self.gaps, last_run) != self._total(self.gaps, first_run):
+            return None
+        return self._total(self.prices, last_run) - self._total(self.prices, first_run)
+
+    def _run(self, position: int) -> int:
+        # Index of the run holding a position, counting runs from the origin
+        week, minute = divmod(position, MINUTES_PER_WEEK)
+        return week * len(self.starts) + bisect_right(self.starts, minute) - 1
+
+    def _total(self, prefix: list[int], run: int) -> int:
+        # Sum of a prefix sum over all runs before run
+        week, i = divmod(run, len(self.starts))
+        return week * prefix[-1] + prefix[i]
+
+
+class TimezoneTable:
+    """
+    Rates sharing a single timezone, with a DayTable per weekday, the
+    overnight rates starting on each weekday and a WeeklyTimeline.
+
+    Args:
+        timezone: The pytz timezone shared by the rates
+    """
+
+    def __init__(self, timezone):
+        self.timezone = timezone
+        self.offsets = timezone_offsets(timezone)
+        self.occurrences = []
+        self.days = [None] * 7
+        self.overnight = [()] * 7
+        self.timeline = None
+
+    def add(self, order: int, days_mask: int, start: int, end: int, price: int) -> None:
+        for day in range(7):
+            if days_mask & (1 << day):
+                self.occurrences.append((order, day, start, end, price))
+
+    def compile(self, previous: "TimezoneTable" = None, days_mask: int = 0b1111111) -> None:
+        """
+        Compile the rates added to the table.
+
+        Args:
+            previous: Table of the same timezone whose DayTables are reused for
+                the days not in days_mask
+            days_mask: With previous, bitmask of the weekdays whose rates may
+                differ from previous, as returned by changed_days
+        """
+
+        intervals = [[] for _ in range(7)]
+        overnight = [[] for _ in range(7)]
+        for order, day, start, end, price in self.occurrences:
+            if start < end:
+                intervals[day].append((order, start, end, price, 0))
+                continue
+
+            # Overnight rates are split at midnight for queries within a day
+            intervals[day].append((order, start, MINUTES_PER_DAY, price, 0))
+            if end > 0:
+                intervals[(day + 1) % 7].append((order, 0, end, price, 1))
+            overnight[day].append((order, start, end, price))
+
+        self.days = [
+            previous.days[day] if previous is not None and not days_mask & (1 << day)
+            else DayTable(intervals[day]) if intervals[day] else None
+            for day in range(7)
+        ]
+        self.overnight = [tuple(sorted(day)) for day in overnight]
+        self.timeline = WeeklyTimeline(self.occurrences)
+        self.occurrences = None
+
+    def find(self, start_day: int, start: int, end_day: int, end: int) -> tuple[int, int]:
+        """
+        Find the first rate containing a local time range, given as for
+        WeeklyTimeline.price.
+
+        Returns:
+            A 2-tuple of the rate's order and price, None if no rate matches.
+        """
+
+        if start_day == end_day:
+            table = self.days[start_day % 7]
+            if table is None:
+                return None
+            return table.find(start, end)
+
+        # Only an overnight rate can contain a range crossing midnight
+        if end_day - start_day == 1:
+            for order, rate_start, rate_end, price in self.overnight[start_day % 7]:
+                if rate_start <= start and end <= rate_end:
+                    return (order, price)
+        return None
+
+    def find_slots(self, boundaries: list[tuple[int, int, int, int]]) -> list[tuple[int, int]]:
+        """
+        Find the first rate containing each slot between consecutive local
+        boundaries, as for find.  The slots within each day are found with a
+        single sweep of the day's DayTable.
+
+        Args:
+            boundaries: Start day number, start minute rounded down, end day
+                number and end minute rounded up of each boundary in time
+                order, the start fields used where a slot starts and the end
+                fields where one ends
+
+        Returns:
+            A 2-tuple of order and price, or None, for each slot.
+        """
+
+        matches = []
+        count = len(boundaries) - 1
+        i = 0
+        while i < count:
+            day = boundaries[i][0]
+            spans = []
+            while i < count and boundaries[i][0] == day and boundaries[i + 1][2] == day:
+                spans.append((boundaries[i][1], boundaries[i + 1][3]))
+                i += 1
+            if spans:
+                table = self.days[day % 7]
+                matches.extend([None] * len(spans) if table is None else table.sweep(spans))
+            else:
+                matches.append(self.find(boundaries[i][0], boundaries[i][1], boundaries[i + 1][2], boundaries[i + 1][3]))
+                i += 1
+        return matches
+
+    def find_sum(self, start_day: int, start: int, end_day: int, end: int) -> int:
+        """
+        Sum the prices of the adjacent rates covering a local time range
+        within a single day, given as for WeeklyTimeline.price.
+
+        Returns:
+            The summed price, None if the range crosses midnight or is not
+            fully covered.
+        """
+
+        if start_day != end_day:
+            return None
+        table = self.days[start_day % 7]
+        if table is None:
+            return None
+        return table.find_sum(start, end)
+
+    def find_mode(self, start_day: int, start: int, end_day: int, end: int, mode: str) -> int:
+        """
+        Price a local time range not contained in a single rate.
+
+        Returns:
+            The summed price for the "sum" and "span" modes, None if the range
+            is not fully covered or for the "single" mode.
+        """
+
+        if mode == "sum":
+            return self.find_sum(start_day, start, end_day, end)
+        if mode == "span":
+            return self.timeline.price(start_day, start, end_day, end)
+        return None
+
+
+def price_slots(tables: list[TimezoneTable], localized: list[list], count: int, mode: str) -> list[int]:
+    """
+    Price the slots between consecutive boundaries given in the local time of
+    each timezone, as the engines price a single time range.
+
+    Args:
+        tables: TimezoneTable of each timezone
+        localized: For each table, its local boundaries as for
+            TimezoneTable.find_slots
+        count: Number of slots, one less than the number of boundaries
+        mode: As for RateIndex.find
+
+    Returns:
+        The price of each slot, None where no price is available.
+    """
+
+    if not tables:
+        return [None] * count
+
+    prices = []
+    slot_matches = zip(*(table.find_slots(local) for table, local in zip(tables, localized)))
+    for i, matches in enumerate(slot_matches):
+        best = min((match for match in matches if match is not None), default=None)
+        if best is not None:
+            prices.append(best[1])
+            continue
+
+        price = None
+        if mode != "single":
+            for table, local in zip(tables, localized):
+                price = table.find_mode(local[i][0], local[i][1], local[i + 1][2], local[i + 1][3], mode)
+                if price is not None:
+                    break
+        prices.append(price)
+    return prices
+
+
+class RateIndex:
+    """
+    Compiled index of parking rates grouped by timezone.
+
+    A query converts the time range once per distinct timezone rather than once
+    per rate, with a bisect of the timezone's shared TimezoneOffsets, and each
+    conversion is followed by a logarithmic lookup.  Where
+    several rates match, the one appearing first in the rates document wins,
+    as with a linear scan.
+
+    Args:
+        rates: RateArrays, or RateRecords, in the order they were supplied
+        orders: Increasing number of each rate deciding which rate wins where
+            several match, by default its position in rates
+        previous: Index whose tables are reused, see patch
+        changed: With previous, bitmask of the weekdays compiled again for
+            each timezone by name, see changed_days.  The tables of every other
+            timezone are reused as they are.
+    """
+
+    def __init__(self, rates, orders=None, previous: "RateIndex" = None, changed: dict = None):
+        if not isinstance(rates, RateArrays):
+            rates = RateArrays(rates)
+        self.orders = range(len(rates)) if orders is None else orders
+        reuse = {}
+        if previous is not None:
+            reuse = {tz: table for tz, table in previous.timezones.items() if tz not in changed}
+
+        # Rates are read straight from the arrays, and tables are kept in the
+        # order their timezones first appear in rates, which decides the
+        # timezone a summed price is taken from
+        names = rates.timezones
+        reused = [tz in reuse for tz in names]
+        tables = [None] * len(names)
+        ordered = []
+        for order, timezone_id, days_mask, start, end, price in zip(
+                self.orders, rates.timezone_ids, rates.days_masks, rates.starts, rates.ends, rates.prices):
+            table = tables[timezone_id]
+            if table is None:
+                tz = names[timezone_id]
+                table = tables[timezone_id] = reuse.get(tz) or TimezoneTable(pytz.timezone(tz))
+                ordered.append(timezone_id)
+            if not reused[timezone_id]:
+                table.add(order, days_mask, start, end, price)
+
+        self.timezones = {}
+        for timezone_id in ordered:
+            tz = names[timezone_id]
+            table = self.timezones[tz] = tables[timezone_id]
+            if reused[timezone_id]:
+                continue
+            if previous is not None and tz in previous.timezones:
+                table.compile(previous.timezones[tz], changed[tz])
+            else:
+                table.compile()
+        self.tables = tuple(self.timezones.values())
+
+    def patch(self, rates: tuple, orders, changed_rates: list) -> "RateIndex":
+        """
+        Compile an index of rates differing from the rates of this index only
+        by the given rates, reusing the tables of every timezone and weekday
+        they don't apply to.
+
+        Args:
+            rates: As for RateIndex
+            orders: As for RateIndex, the orders of unchanged rates must be
+                the same as in this index
+            changed_rates: RateRecords added, deleted, and both the old and
+                new records of those updated
+
+        Returns:
+            The new index.  This index is unchanged.
+        """
+
+        changed = {}
+        for rate in changed_rates:
+            changed[rate.tz] = changed.get(rate.tz, 0) | changed_days(rate)
+        return RateIndex(rates, orders, self, changed)
+
+    def find(self, start: Instant, end: Instant, mode: str = "single") -> int:
+        """
+        Get the price of the first rate containing the time range.
+
+        Args:
+            start: The start of the time range, a datetime or Timestamp
+            end: The end of the time range, a datetime or Timestamp
+            mode: If no single rate contains the time range, "sum" sums the
+                prices of adjacent rates covering it within a day and "span"
+                sums the prices of the rates covering it over any number of
+                days
+
+        Returns:
+            The applicable price, None if no rate contains the time range or,
+            when summing, the time range is not fully covered.
+        """
+
+        return self.find_microseconds(epoch_microseconds(start), epoch_microseconds(end), mode)
+
+    def find_microseconds(self, start: int, end: int, mode: str = "single") -> int:
+        """
+        Get the price for a time range given in UTC epoch microseconds, as for
+        find.
+        """
+
+        best = None
+        localized = []
+        for table in self.tables:
+            local = table.offsets.localize(start, end)
+            match = table.find(*local)
+            if match is not None and (best is None or match < best):
+                best = match
+            if mode != "single":
+                localized.append((table, local))
+
+        if best is not None:
+            return best[1]
+        for table, local in localized:
+            total = table.find_mode(*local, mode)
+            if total is not None:
+                return total
+        return None
+
+    def find_range(self, start: Instant, end: Instant, slot: timedelta, mode: str = "single") -> Iterator[int]:
+        """
+        Get the price of every slot of a time range, the same as find would
+        give for each slot.  Every boundary between slots is converted to the
+        local time of each timezone once, and the rates of each day are swept
+        once in time order, rather than looking up each slot on its own.
+
+        Args:
+            start: The start of the time range, a datetime or Timestamp
+            end: The end of the time range, a datetime or Timestamp
+            slot: Duration of each slot, the last slot ends at end even if
+                shorter
+            mode: As for find
+
+        Returns:
+            An iterator of the price of each slot in time order, None where
+            no price is available.  Slots are priced range_chunk_size at a
+            time as the iterator is consumed.
+        """
+
+        step = slot // timedelta(microseconds=1)
+        for boundaries in slot_boundaries(epoch_microseconds(start), epoch_microseconds(end), step):
+            localized = [table.offsets.localize_boundaries(boundaries) for table in self.tables]
+            yield from price_slots(self.tables, localized, len(boundaries) - 1, mode)
+
+    def find_many(self, spans: list[tuple[Instant, Instant]], mode: str = "single") -> list[int]:
+        """
+        Get the price for each of several time ranges, looking up duplicate
+        ranges only once.
+
+        Args:
+            spans: (start, end) pairs
+            mode: As for find
+
+        Returns:
+            The applicable prices in the same order as spans, None where no
+            price is available.
+        """
+
+        prices = {span: self.find(*span, mode) for span in dict.fromkeys(spans)}
+        return [prices[span] for span in spans]
@@ -0,0 +1,212 @@
+import codecs
+import gzip
+import json
+from typing import Iterator
+import zlib
+
+
+# json: a rates document, {"rates": [...]}, or a bare JSON array of rates
+# ndjson: one rate object per line
+formats = ["json", "ndjson"]
+
+# Request content types read as ndjson, anything else is read as json
+ndjson_content_types = ["application/x-ndjson", "application/ndjson", "application/jsonl"]
+
+# Bytes read from the stream at a time
+chunk_size = 64 * 1024
+
+# Largest single rate accepted, so a malformed document can't grow the buffer
+# without bound
+max_rate_size = 64 * 1024
+
+whitespace = " \t\n\r"
+
+# Errors reading a stream, including a corrupt gzip stream
+read_errors = (OSError, EOFError, zlib.error)
+
+
+def stream_format(content_type: str) -> str:
+    """
+    Get the format of a rates request body from its content type.
+
+    Args:
+        content_type: Content type of the request, without parameters
+
+    Returns:
+        One of formats.
+    """
+
+    return "ndjson" if content_type in ndjson_content_types else "json"
+
+
+def iter_rates(stream, format: str = "json", encoding: str = None) -> Iterator[dict]:
+    """
+    Read rates one at a time from a binary stream, holding at most about one
+    chunk of the stream in memory.  Rates are yielded as parsed, not
+    validated.
+
+    Args:
+        stream: Binary file-like object with a read method, e.g. an HttpRequest
+        format: One of formats
+        encoding: Content encoding of the stream, None or identity for plain
+            bytes or gzip
+
+    Returns:
+        An iterator of the rates in the stream, in document order.
+
+    Raises:
+        ValueError, while iterating, if the stream is not a valid document in
+        the given format.  Rates already yielded are not affected.
+    """
+
+    if format not in formats:
+        raise ValueError(f"Invalid format {format}, must be one of: {', '.join(formats)}")
+    if encoding == "gzip":
+        stream = gzip.GzipFile(fileobj=stream, mode="rb")
+    elif encoding not in (None, "", "identity"):
+        raise ValueError(f"Unsupported content encoding {encoding}")
+
+    if format == "ndjson":
+        return _iter_ndjson(stream)
+    return _iter_json(_Reader(stream))
+
+
+def _iter_ndjson(stream) -> Iterator[dict]:
+    line_number = 0
+    while True:
+        try:
+            line = stream.readline(max_rate_size + 1)
+        except read_errors as e:
+            raise ValueError(f"Failed to read rates: {e}") from e
+        if not line:
+            return
+        line_number += 1
+        if len(line) > max_rate_size:
+            raise ValueError(f"Line {line_number} is longer than {max_rate_size} bytes")
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON on line {line_number}: {e}") from e
+
+
+def _iter_json(reader: "_Reader") -> Iterator[dict]:
+    char = reader.peek()
+    if char == "[":
+        yield from _iter_array(reader)
+    elif char == "{":
+        reader.expect("{")
+        found = False
+        if reader.peek() != "}":
+            while True:
+                key = reader.value()
+                if type(key) != str:
+                    raise reader.error("Expected an object key")
+                reader.expect(":")
+                if key == "rates" and reader.peek() == "[":
+                    found = True
+                    yield from _iter_array(reader)
+                else:
+                    # Other members are parsed and discarded
+                    reader.value()
+                if reader.peek() != ",":
+                    break
+                reader.expect(",")
+        reader.expect("}")
+        if not found:
+            raise ValueError("Rates document must contain a rates array")
+    else:
+        raise reader.error("Expected a rates document or array")
+
+    if reader.peek() != "":
+        raise reader.error("Extra data after the rates document")
+
+
+def _iter_array(reader: "_Reader") -> Iterator[dict]:
+    reader.expect("[")
+    if reader.peek() == "]":
+        reader.expect("]")
+        return
+    while True:
+        yield reader.value()
+        if reader.peek() != ",":
+            break
+        reader.expect(",")
+    reader.expect("]")
+
+
+class _Reader:
+    """
+    Incremental JSON tokenizer over a binary stream.  Values are decoded
+    whole with the standard decoder, reading more of the stream whenever a
+    value runs past the end of what has been read.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        # Characters discarded from the start of the buffer, for error offsets
+        self.offset = 0
+        self.eof = False
+
+    def peek(self) -> str:
+        """Skip whitespace and return the next character, "" at the end."""
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in whitespace:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self._fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise self.error(f"Expected '{char}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode the next JSON value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self._too_long() or not self._fill():
+                    raise self.error("Invalid JSON value") from None
+                continue
+            # A number at the end of the buffer may continue in the stream
+            if end == len(self.buffer) and not self.eof:
+                if self._too_long() or not self._fill():
+                    raise self.error("Invalid JSON value")
+                continue
+            self.pos = end
+            return value
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"{message} at character {self.offset + self.pos}")
+
+    def _too_long(self) -> bool:
+        return len(self.buffer) - self.pos > max_rate_size
+
+    def _fill(self) -> bool:
+        # Drop what has been consumed so memory stays bounded by one value
+        # plus a chunk
+        if self.pos:
+            self.offset += self.pos
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        if self.eof:
+            return False
+        try:
+            chunk = self.stream.read(chunk_size)
+            text = self.decoder.decode(chunk, final=not chunk)
+        except read_errors as e:
+            raise ValueError(f"Failed to read rates: {e}") from e
+        except UnicodeDecodeError as e:
+            raise ValueError(f"Rates are not valid UTF-8: {e}") from e
+        if not chunk:
+            self.eof = True
+        self.buffer += text
+        return bool(text) or not self.eof
@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+import fcntl
+import os
+from typing import Iterator
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock shared by every process, and every thread, locking
+    the same file.  The file is created if needed and left in place, as
+    removing it would let another process lock a new file of the same name.
+
+    Args:
+        path: Location of the lock file
+    """
+
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        # Locks taken through separate opens of the file exclude each other
+        # even within one process, and are released when the file is closed
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
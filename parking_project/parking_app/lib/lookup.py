@@ -0,0 +1,217 @@
+from array import array
+from datetime import datetime, timedelta, timezone as dt_timezone
+import math
+from typing import Iterator
+
+from parking_app.lib.index import (
+        MINUTES_PER_DAY,
+        MINUTES_PER_WEEK,
+        RateIndex,
+        TimezoneTable,
+        price_slots,
+        slot_boundaries
+)
+from parking_app.lib.timestamp import (
+        MICROSECONDS_PER_SECOND,
+        SECONDS_PER_DAY,
+        Instant,
+        Timestamp,
+        epoch_microseconds
+)
+from parking_app.lib.timezones import EPOCH_DAY_NUMBER
+
+
+class TimezoneLookup:
+    """
+    Lookup table for rates sharing a single timezone.
+
+    Every minute of the week maps to the segment of its DayTable holding the
+    rates covering it, so finding the candidate rates for a query is an array
+    read rather than a bisect.
+
+    Args:
+        table: The compiled TimezoneTable
+    """
+
+    def __init__(self, table: TimezoneTable):
+        self.table = table
+        self.offsets = table.offsets
+        self.segments = []
+        self.minutes = array("i", [-1]) * MINUTES_PER_WEEK
+        for day, day_table in enumerate(table.days):
+            if day_table is None:
+                continue
+            for i, segment in enumerate(day_table.segments):
+                if not segment:
+                    continue
+                first = day * MINUTES_PER_DAY + day_table.breaks[i]
+                last = day * MINUTES_PER_DAY + day_table.breaks[i + 1]
+                self.minutes[first:last] = array("i", [len(self.segments)]) * (last - first)
+                self.segments.append(segment)
+
+    def localize(self, start: int, end: int) -> tuple[int, int, int, int]:
+        """
+        Convert UTC epoch seconds to a local time range.
+
+        Returns:
+            A 4-tuple of the start day number, start minute rounded down, end
+            day number and end minute rounded up.
+        """
+
+        start_day, start_second = divmod(start + self.offsets.offset(start), SECONDS_PER_DAY)
+        end_day, end_second = divmod(end + self.offsets.offset(end), SECONDS_PER_DAY)
+        return (
+            start_day + EPOCH_DAY_NUMBER,
+            start_second // 60,
+            end_day + EPOCH_DAY_NUMBER,
+            -(-end_second // 60)
+        )
+
+    def localize_boundaries(self, boundaries: list[int]) -> list[tuple[int, int, int, int]]:
+        """
+        Convert the boundaries of slots, as for LookupTable.find_range, to
+        local times.  The offset transitions are swept once alongside the
+        boundaries rather than searched for each.
+
+        Args:
+            boundaries: UTC epoch microseconds within the horizon, in
+                increasing order
+
+        Returns:
+            Local boundaries as for TimezoneTable.find_slots.
+        """
+
+        starts = [boundary // MICROSECONDS_PER_SECOND for boundary in boundaries]
+        ends = [-(-boundary // MICROSECONDS_PER_SECOND) for boundary in boundaries]
+        start_offsets = self.offsets.offsets_at(starts)
+        end_offsets = start_offsets if starts == ends else self.offsets.offsets_at(ends)
+        local = []
+        for start, start_offset, end, end_offset in zip(starts, start_offsets, ends, end_offsets):
+            start_day, start_second = divmod(start + start_offset, SECONDS_PER_DAY)
+            end_day, end_second = divmod(end + end_offset, SECONDS_PER_DAY)
+            local.append((
+                start_day + EPOCH_DAY_NUMBER,
+                start_second // 60,
+                end_day + EPOCH_DAY_NUMBER,
+                -(-end_second // 60)
+            ))
+        return local
+
+    def find(self, start_day: int, start: int, end_day: int, end: int) -> tuple[int, int]:
+        """
+        Find the first rate containing a local time range, as for
+        TimezoneTable.find.
+        """
+
+        if start_day != end_day:
+            return self.table.find(start_day, start, end_day, end)
+
+        segment = self.minutes[(start_day % 7) * MINUTES_PER_DAY + start]
+        if segment < 0:
+            return None
+        for order, rate_end, price, _ in self.segments[segment]:
+            if rate_end >= end:
+                return (order, price)
+        return None
+
+
+class LookupTable:
+    """
+    Rate lookup engine using precomputed per-timezone tables.
+
+    Queries within the horizon convert to local time with a bisect of the
+    timezone's UTC offset transitions and find candidate rates with an array
+    read, avoiding pytz conversions and datetime arithmetic.  Queries outside
+    the horizon fall back to the RateIndex.
+
+    Args:
+        index: RateIndex compiled from the rates
+        horizon: First and last years the tables cover
+        previous: LookupTable whose tables are reused for every TimezoneTable
+            it shares with index, e.g. one compiled before index was patched
+    """
+
+    def __init__(self, index: RateIndex, horizon: tuple[int, int], previous: "LookupTable" = None):
+        self.index = index
+        self.start = int(datetime(horizon[0], 1, 1, tzinfo=dt_timezone.utc).timestamp())
+        self.end = int(datetime(horizon[1] + 1, 1, 1, tzinfo=dt_timezone.utc).timestamp())
+
+        reuse = {}
+        if previous is not None:
+            reuse = {id(zone.table): zone for zone in previous.zones}
+        self.zones = tuple(reuse.get(id(table)) or TimezoneLookup(table) for table in index.tables)
+
+    def find(self, start: Instant, end: Instant, mode: str = "single") -> int:
+        """
+        Get the price for a time range, as for RateIndex.find.  The epoch
+        time of Timestamps is used as it is.
+        """
+
+        if isinstance(start, Timestamp):
+            start_timestamp = start.seconds
+            end_timestamp = end.ceil
+        else:
+            start_timestamp = math.floor(start.timestamp())
+            end_timestamp = math.ceil(end.timestamp())
+        if start_timestamp < self.start or end_timestamp >= self.end:
+            return self.index.find(start, end, mode)
+        return self.find_timestamps(start_timestamp, end_timestamp, mode)
+
+    def find_timestamps(self, start: int, end: int, mode: str = "single") -> int:
+        """
+        Get the price for a time range given in UTC epoch seconds within the
+        horizon.
+
+        Args:
+            start: The start of the time range, rounded down to the second
+            end: The end of the time range, rounded up to the second
+            mode: As for RateIndex.find
+
+        Returns:
+            The applicable price, None if no price is available.
+        """
+
+        best = None
+        localized = []
+        for zone in self.zones:
+            local = zone.localize(start, end)
+            match = zone.find(*local)
+            if match is not None and (best is None or match < best):
+                best = match
+            if mode != "single":
+                localized.append((zone, local))
+
+        if best is not None:
+            return best[1]
+        for zone, local in localized:
+            total = zone.table.find_mode(*local, mode)
+            if total is not None:
+                return total
+        return None
+
+    def find_range(self, start: Instant, end: Instant, slot: timedelta, mode: str = "single") -> Iterator[int]:
+        """
+        Get the price of every slot of a time range, as for
+        RateIndex.find_range.
+        """
+
+        start_microseconds = epoch_microseconds(start)
+        end_microseconds = epoch_microseconds(end)
+        if (start_microseconds // MICROSECONDS_PER_SECOND < self.start
+                or -(-end_microseconds // MICROSECONDS_PER_SECOND) >= self.end):
+            yield from self.index.find_range(start, end, slot, mode)
+            return
+
+        step = slot // timedelta(microseconds=1)
+        for boundaries in slot_boundaries(start_microseconds, end_microseconds, step):
+            localized = [zone.localize_boundaries(boundaries) for zone in self.zones]
+            yield from price_slots(self.index.tables, localized, len(boundaries) - 1, mode)
+
+    def find_many(self, spans: list[tuple[Instant, Instant]], mode: str = "single") -> list[int]:
+        """
+        Get the price for each of several time ranges, as for
+        RateIndex.find_many.
+        """
+
+        prices = {span: self.find(*span, mode) for span in dict.fromkeys(spans)}
+        return [prices[span] for span in spans]
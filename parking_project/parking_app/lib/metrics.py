@@ -0,0 +1,183 @@
+from bisect import bisect_left
+import math
+from threading import get_ident
+
+
+# Buckets in seconds for request handling, from 10 microseconds to 1 second
+latency_buckets = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0
+)
+
+# Buckets in seconds for compiling rates, from 1 millisecond to 1 minute
+compile_buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+# Counters and histograms are updated without a lock: each thread adds only to
+# its own values, kept by thread ident, and values are summed across threads
+# when collected.  Under the GIL a thread's first dict insert and the copy of
+# the dict's values taken when collecting are atomic, and no two threads ever
+# update the same values.  A thread ident reused by a later thread carries on
+# from the values of the earlier thread, which keeps the sums right, and as
+# idents are reused keeps the dict near the number of threads running at once.
+
+
+class Counter:
+    """
+    Monotonically increasing count, e.g. of requests served.
+
+    Args:
+        name: Metric name, ending in _total
+        documentation: Help text
+        function: For a count kept elsewhere, called with no arguments to get
+            its value when metrics are collected
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, function=None):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        # Count added by each thread, by thread ident
+        self._values = {}
+
+    @property
+    def value(self) -> int:
+        return sum(list(self._values.values()))
+
+    def inc(self, amount: int = 1) -> None:
+        ident = get_ident()
+        values = self._values
+        values[ident] = values.get(ident, 0) + amount
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        value = self.value if self.function is None else self.function()
+        return [(self.name, "", value)]
+
+
+class Gauge:
+    """
+    Value read when metrics are collected, so keeping it up to date costs
+    nothing.
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        function: Called with no arguments to get the current value
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        return [(self.name, "", self.function())]
+
+
+class Histogram:
+    """
+    Distribution of observed values, e.g. durations, counted in cumulative
+    buckets.
+
+    Args:
+        name: Metric name
+        documentation: Help text
+        buckets: Increasing upper bounds of the buckets, a final bucket for
+            every value is added
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...] = latency_buckets):
+        if list(buckets) != sorted(set(buckets)):
+            raise ValueError(f"Invalid buckets {buckets}, must be increasing")
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        # Counts of each bucket followed by the sum of the values observed by
+        # each thread, by thread ident.  Each observation is counted in only
+        # its own bucket, the cumulative counts are summed when collected.
+        self._values = {}
+
+    def observe(self, value: float) -> None:
+        ident = get_ident()
+        values = self._values.get(ident)
+        if values is None:
+            values = self._values[ident] = [0] * (len(self.buckets) + 1) + [0.0]
+        values[bisect_left(self.buckets, value)] += 1
+        values[-1] += value
+
+    def samples(self) -> list[tuple[str, str, float]]:
+        # A thread may be collected between counting a value and adding it to
+        # its sum, which leaves the sum briefly behind the count
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for values in list(self._values.values()):
+            for i, count in enumerate(values[:-1]):
+                counts[i] += count
+            total += values[-1]
+
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            samples.append((f"{self.name}_bucket", f'{{le="{format_value(bound)}"}}', cumulative))
+        samples.append((f"{self.name}_sum", "", total))
+        samples.append((f"{self.name}_count", "", cumulative))
+        return samples
+
+
+class Registry:
+    """
+    Collection of metrics exposed together in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        """
+        Add a metric to the registry.
+
+        Returns:
+            The metric, so it can be registered where it is created.
+
+        Raises:
+            ValueError if a metric with the same name is already registered
+        """
+
+        if any(existing.name == metric.name for existing in self.metrics):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Render every metric in the Prometheus text exposition format.
+        """
+
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+# Content type of the Prometheus text exposition format
+text_content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+registry = Registry()
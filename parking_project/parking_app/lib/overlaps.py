@@ -0,0 +1,161 @@
+from bisect import bisect_right
+from heapq import heappop, heappush
+from itertools import groupby, repeat
+from operator import itemgetter
+from typing import NamedTuple
+
+from parking_app.lib.index import MINUTES_PER_DAY
+from parking_app.lib.records import RateArrays, clock_times, day_abbreviations
+
+
+# Conflicts listed in an OverlapReport, the rest are only counted
+max_conflict_details = 100
+
+# Weekdays of each days mask, e.g. (0, 2) for 0b101
+mask_days = [tuple(day for day in range(7) if mask & (1 << day)) for mask in range(1 << 7)]
+
+price_key = itemgetter(2)
+
+
+class OverlapReport(NamedTuple):
+    """
+    Overlapping rates found by find_overlaps.  Where rates overlap, a time
+    range inside both is priced by whichever comes first in the rates, so
+    overlapping rates with different prices make prices depend on the order
+    of the rates document.
+
+    Rates are compared by weekday in the local time of their timezone, as
+    parts split at midnight, so a pair of rates is counted once for each
+    weekday they overlap on, and twice if one is an overnight rate whose
+    morning and evening parts on the same weekday both overlap the other.
+    Rates in different timezones are not compared.
+
+    Attributes:
+        overlaps: Pairs of overlapping rate parts
+        conflicts: Pairs of overlapping rate parts with different prices
+        details: The first max_conflict_details conflicts, as dictionaries of
+            the weekday, the times both rates cover as in a rates document,
+            the timezone, the positions of the rates in the document with the
+            one charged first, their prices and, if any rate has an id, their
+            ids
+    """
+
+    overlaps: int
+    conflicts: int
+    details: list[dict]
+
+    def to_dict(self) -> dict:
+        return dict(self._asdict())
+
+
+def find_overlaps(rates: RateArrays) -> OverlapReport:
+    """
+    Find overlapping rates.  The intervals of each timezone and weekday are
+    sorted once, and the overlaps among them counted from the sorted starts
+    and ends, so finding overlaps takes O(n log n) time in the number of rate
+    weekdays however many rates overlap.  Only conflicts listed in the report
+    are paired up, with a sweep of their timezone and weekday.
+
+    Args:
+        rates: Rates in the order they were supplied
+
+    Returns:
+        The OverlapReport of the rates.
+    """
+
+    # Intervals of the rates of each timezone and days mask on the days they
+    # start and the days after, overnight rates split at midnight as for
+    # TimezoneTable, so each rate's intervals are made once however many
+    # days it applies to
+    masks = {}
+    for position, (timezone_id, days_mask, start, end, price) in enumerate(zip(
+            rates.timezone_ids, rates.days_masks, rates.starts, rates.ends, rates.prices)):
+        key = (timezone_id, days_mask)
+        intervals = masks.get(key)
+        if intervals is None:
+            intervals = masks[key] = ([], [])
+        if start < end:
+            intervals[0].append((start, end, price, position))
+            continue
+        intervals[0].append((start, MINUTES_PER_DAY, price, position))
+        if end > 0:
+            intervals[1].append((0, end, price, position))
+
+    # Intervals of each timezone and weekday
+    groups = [[] for _ in range(len(rates.timezones) * 7)]
+    for (timezone_id, days_mask), (same_day, next_day) in masks.items():
+        for day in mask_days[days_mask]:
+            groups[timezone_id * 7 + day].extend(same_day)
+            groups[timezone_id * 7 + (day + 1) % 7].extend(next_day)
+
+    overlaps = 0
+    conflicts = 0
+    details = []
+    for group, intervals in enumerate(groups):
+        if len(intervals) < 2:
+            continue
+        total = _count_overlaps(intervals)
+        if not total:
+            continue
+        overlaps += total
+
+        # Overlaps between rates of the same price don't conflict
+        by_price = [list(same) for _, same in groupby(sorted(intervals, key=price_key), price_key)]
+        if len(by_price) == 1:
+            continue
+        conflicting = total - sum(_count_overlaps(same) for same in by_price if len(same) > 1)
+        if not conflicting:
+            continue
+        conflicts += conflicting
+        if len(details) < max_conflict_details:
+            timezone_id, day = divmod(group, 7)
+            for start, end, first, second in _pair_conflicts(intervals, max_conflict_details - len(details)):
+                positions = sorted((first, second))
+                detail = {
+                    "day": day_abbreviations[day],
+                    "times": f"{clock_times[start]}-{clock_times[end % MINUTES_PER_DAY]}",
+                    "tz": rates.timezones[timezone_id],
+                    "rates": positions,
+                    "prices": [rates.prices[position] for position in positions],
+                }
+                if rates.ids is not None:
+                    detail["ids"] = [rates.ids[position] for position in positions]
+                details.append(detail)
+    return OverlapReport(overlaps, conflicts, details)
+
+
+def _count_overlaps(intervals: list[tuple]) -> int:
+    # Each interval overlaps the intervals starting no later than it, except
+    # those ending by its start, all of which start before it
+    starts = sorted(map(itemgetter(0), intervals))
+    ends = sorted(map(itemgetter(1), intervals))
+    count = len(starts)
+    return count * (count - 1) // 2 - sum(map(bisect_right, repeat(ends, count), starts))
+
+
+def _pair_conflicts(intervals: list[tuple], limit: int) -> list[tuple[int, int, int, int]]:
+    # Sweep the intervals in order of start, pairing each with the longest
+    # running interval of every other price among those still running
+    pairs = []
+    running = []
+    running_prices = {}
+    longest = {}
+    for start, end, price, position in sorted(intervals):
+        while running and running[0][0] <= start:
+            _, ended_price = heappop(running)
+            running_prices[ended_price] -= 1
+            if not running_prices[ended_price]:
+                del running_prices[ended_price]
+        for other_price in running_prices:
+            if other_price == price:
+                continue
+            other_end, other_position = longest[other_price]
+            pairs.append((start, min(end, other_end), other_position, position))
+            if len(pairs) == limit:
+                return pairs
+
+        heappush(running, (end, price))
+        running_prices[price] = running_prices.get(price, 0) + 1
+        if price not in longest or end > longest[price][0]:
+            longest[price] = (end, position)
+    return pairs
@@ -1,41 +1,552 @@
+from array import array
+from bisect import bisect_left
 import calendar
-from datetime import datetime, time
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+import itertools
 import logging
+import threading
+from time import perf_counter, time_ns
+from typing import Iterable, Iterator, NamedTuple, Union
 
 import pytz
 
+from parking_app.lib.availability import Window, find_windows
+from parking_app.lib.cache import LRUCache
+from parking_app.lib.index import RateIndex
+from parking_app.lib.ingest import iter_rates
+from parking_app.lib.locks import file_lock
+from parking_app.lib.lookup import LookupTable
+from parking_app.lib.metrics import Counter, Gauge, Histogram, compile_buckets, registry
+from parking_app.lib.overlaps import OverlapReport, find_overlaps
+from parking_app.lib.ratetable import RateTableFile
+from parking_app.lib.records import RateArrays, RateRecord, day_abbreviations
+from parking_app.lib.store import RateStore
+from parking_app.lib.timestamp import Instant, epoch_microseconds
+
 
 logger = logging.getLogger(__name__)
-day_abbreviations = ["mon", "tues", "wed", "thurs", "fri", "sat", "sun"]
+
+# single: the time range must be contained in one rate
+# sum: a time range spanning adjacent rates within a day is priced at the sum
+#   of the rates
+# span: as for sum, but the time range may cover any number of days
+query_modes = ["single", "sum", "span"]
+
+# index: RateIndex, searching the compiled index of each timezone
+# table: LookupTable, precomputed per-timezone lookup tables
+engines = ["index", "table"]
+
+max_id_length = 256
+
+# Prices are stored as unsigned 64 bit integers
+max_price = 2 ** 64 - 1
+
+# Kinds of change to rates, in the order they are applied by patch_rates
+change_kinds = ["delete", "update", "add"]
+
+# Invalid rates listed in an InvalidRates error, the rest are only counted
+max_rate_errors = 100
+
+
+compile_seconds = registry.register(Histogram(
+        "parking_rates_compile_seconds",
+        "Time to validate and compile a rates document, or compile rates from the shared rate table.",
+        compile_buckets
+))
+publish_seconds = registry.register(Histogram(
+        "parking_rates_publish_seconds",
+        "Time to store and publish compiled rates.",
+        compile_buckets
+))
+registry.register(Gauge(
+        "parking_rates",
+        "Number of rates in use.",
+        lambda: 0 if ParkingRates.snapshot is None else len(ParkingRates.snapshot.rates)
+))
+registry.register(Gauge(
+        "parking_rates_generation",
+        "Generation of the rates in use, increasing each time rates are compiled in this process.",
+        lambda: 0 if ParkingRates.snapshot is None else ParkingRates.snapshot.generation
+))
+registry.register(Gauge(
+        "parking_rates_table_version",
+        "Version of the shared rate table last read or written, 0 without a table file.",
+        lambda: 0 if ParkingRates.table_file is None else ParkingRates.table_file.version or 0
+))
+registry.register(Gauge(
+        "parking_rates_conflicts",
+        "Pairs of overlapping rate parts with different prices in the rates in use, found when they were loaded.",
+        lambda: 0 if ParkingRates.snapshot is None or ParkingRates.snapshot.overlaps is None
+        else ParkingRates.snapshot.overlaps.conflicts
+))
+registry.register(Gauge(
+        "parking_query_cache_entries",
+        "Number of query results cached.",
+        lambda: ParkingRates.cache.stats()["size"]
+))
+registry.register(Counter(
+        "parking_query_cache_hits_total",
+        "Queries answered from the cache.",
+        lambda: ParkingRates.cache.hits
+))
+registry.register(Counter(
+        "parking_query_cache_misses_total",
+        "Queries not found in the cache.",
+        lambda: ParkingRates.cache.misses
+))
+
+
+class RateSnapshot(NamedTuple):
+    """
+    Immutable set of rates along with the index compiled from them.
+
+    A snapshot is fully built before it is published, and published with a
+    single reference assignment, so a query holding a snapshot always sees one
+    consistent rate set without taking a lock.
+
+    Attributes:
+        generation: Unique number identifying this snapshot, used to tag cached
+            query results
+        rates: Rates in the order they were supplied
+        index: RateIndex or LookupTable compiled from rates, depending on the
+            engine in use, None until compiled for a FacilityRates
+        ids: Order in the index of each rate with an id, by id
+        overlaps: OverlapReport of the rates when they were loaded, None for
+            rates changed by patch_rates or read from the shared rate table
+        version: Digest of rates, see RateArrays.digest, the same for the same
+            rates in every process
+        loaded: UTC epoch nanoseconds the rates were compiled at, or for
+            rates read from the shared rate table the version of the table,
+            the time it was written
+    """
+
+    generation: int
+    rates: RateArrays
+    index: Union[RateIndex, LookupTable]
+    ids: dict[str, int]
+    overlaps: OverlapReport = None
+    version: str = None
+    loaded: int = None
 
 
 class ParkingRates:
-    rates = None
+    snapshot = None
+    cache = LRUCache(maxsize=4096)
+
+    # Shared RateTableFile, set with use_table_file to share rates between
+    # worker processes
+    table_file = None
+
+    # RateStore holding the last published rates, set with use_store
+    store = None
+
+    # Held by the thread changing rates, see changing
+    changes_lock = threading.Lock()
+
+    # One of engines, set with use_engine
+    engine = "index"
+    table_horizon = (1970, 2037)
+
+    # Each compiled snapshot takes the next generation so cached prices from
+    # earlier rates are not served
+    _generations = itertools.count(1)
 
     @classmethod
-    def load_rates(cls, new_rates: dict) -> None:
+    def load_rates(cls, new_rates: dict, strict: bool = False) -> OverlapReport:
         """
         Update rates to the new parking rates.
 
         Args:
             new_rates: New parking rates to update with
+            strict: As for compile_rates
+
+        Returns:
+            The OverlapReport of the new rates.
+        """
+
+        snapshot = cls.compile_rates(new_rates, strict)
+        cls.publish(snapshot)
+        return snapshot.overlaps
+
+    @classmethod
+    def compile_rates(cls, new_rates: dict, strict: bool = False) -> RateSnapshot:
+        """
+        Validate new parking rates and compile them into a snapshot without
+        affecting the rates currently in use.  Overlapping rates are found
+        along the way, see find_overlaps.
+
+        Args:
+            new_rates: New parking rates to compile
+            strict: Reject rates any of which overlap with different prices,
+                rather than pricing them by whichever comes first
+
+        Returns:
+            The compiled snapshot, ready to publish.
+
+        Raises:
+            InvalidRates if any rate contains invalid data
+            ConflictingRates if strict and rates overlap with different prices
+        """
+
+        return cls.compile_rate_stream(new_rates["rates"], strict=strict)
+
+    @classmethod
+    def compile_rate_stream(
+            cls,
+            rates: Iterable[dict],
+            compile_index: bool = True,
+            strict: bool = False
+    ) -> RateSnapshot:
+        """
+        As for compile_rates, but validates and compiles rates one at a time as
+        they are read, e.g. from iter_rates, so the rates document is never
+        held in memory.  Every rate is validated, and the invalid ones are
+        reported together.
+
+        Args:
+            rates: Rate objects, as in the rates array of a rates document
+            compile_index: False to leave the index of the snapshot None, for
+                rate sets compiling it when first queried, see FacilityRates
+            strict: As for compile_rates
+
+        Returns:
+            The compiled snapshot, ready to publish.
+
+        Raises:
+            InvalidRates if any rate contains invalid data
+            ConflictingRates as for compile_rates
+            ValueError if rates raises ValueError, e.g. the rates can't be read
+        """
+
+        began = perf_counter()
+        records = RateArrays()
+        ids = {}
+        errors = []
+        count = 0
+        for i, rate in enumerate(rates):
+            try:
+                record = Rate.from_dict(rate).to_record()
+                if record.id is not None:
+                    if record.id in ids:
+                        raise ValueError(f"Duplicate id {record.id}")
+                    ids[record.id] = len(records)
+                records.append(record)
+            except Exception as e:
+                count += 1
+                if len(errors) < max_rate_errors:
+                    errors.append({"rate": i, "error": str(e)})
+        if count:
+            raise InvalidRates(errors, count)
+
+        overlaps = find_overlaps(records)
+        if overlaps.conflicts:
+            if strict:
+                raise ConflictingRates(overlaps)
+            logger.warning(
+                    f"{overlaps.conflicts} pairs of overlapping rates have different prices, "
+                    "each priced by the rate first in the document"
+            )
+
+        index = cls._compile_index(records) if compile_index else None
+        snapshot = RateSnapshot(next(cls._generations), records, index, ids, overlaps, records.digest(), time_ns())
+        compile_seconds.observe(perf_counter() - began)
+        return snapshot
+
+    @classmethod
+    def patch_rates(cls, changes: dict) -> RateSnapshot:
+        """
+        Apply changes to the rates in use and compile them into a snapshot
+        without affecting the rates currently in use.  Only the timezones and
+        weekdays the changes touch are compiled again.  Apply and publish
+        changes while holding changing, so no other rates are published in
+        between.
+
+        Deletes are applied first, then updates, then adds.  An updated rate
+        keeps its place in the rates, deciding which rate wins where several
+        match, and added rates follow every other rate.
+
+        Args:
+            changes: Rate changes, any of
+                "delete": ids of the rates to delete
+                "update": rates replacing the rates with the same ids
+                "add": new rates, with ids not already in use
+
+        Returns:
+            The compiled snapshot, ready to publish.
+
+        Raises:
+            ValueError if changes is not a valid changes object
+            InvalidRates if any change is invalid, listing each invalid
+            change with its kind and position
+            RuntimeError if patch_rates is called before rates are
+            successfully loaded.
+        """
+
+        if type(changes) != dict or not set(changes) <= set(change_kinds):
+            raise ValueError(f"Changes must be an object of any of: {', '.join(change_kinds)}")
+        for kind in change_kinds:
+            if type(changes.get(kind, [])) != list:
+                raise ValueError(f"{kind} must be an array")
+
+        snapshot = cls._get_snapshot()
+        began = perf_counter()
+        index = snapshot.index.index if isinstance(snapshot.index, LookupTable) else snapshot.index
+        ids = dict(snapshot.ids)
+        replaced = {}
+        deleted = set()
+        added = []
+        changed = []
+        errors = []
+        count = 0
+
+        def invalid(kind: str, i: int, error: str) -> None:
+            nonlocal count
+            count += 1
+            if len(errors) < max_rate_errors:
+                errors.append({"change": kind, "rate": i, "error": error})
+
+        for i, rate_id in enumerate(changes.get("delete", [])):
+            if rate_id not in ids:
+                invalid("delete", i, f"No rate with id {rate_id}")
+                continue
+            position = bisect_left(index.orders, ids.pop(rate_id))
+            deleted.add(position)
+            changed.append(snapshot.rates[position])
+
+        for kind in ("update", "add"):
+            for i, rate in enumerate(changes.get(kind, [])):
+                try:
+                    record = Rate.from_dict(rate).to_record()
+                except Exception as e:
+                    invalid(kind, i, str(e))
+                    continue
+                if kind == "update":
+                    if record.id is None:
+                        invalid(kind, i, "Missing field 'id'")
+                        continue
+                    if record.id not in ids:
+                        invalid(kind, i, f"No rate with id {record.id}")
+                        continue
+                    position = bisect_left(index.orders, ids[record.id])
+                    if position in replaced:
+                        invalid(kind, i, f"Duplicate id {record.id}")
+                        continue
+                    replaced[position] = record
+                    changed.append(snapshot.rates[position])
+                else:
+                    if record.id is not None:
+                        if record.id in ids:
+                            invalid(kind, i, f"Duplicate id {record.id}")
+                            continue
+                        # Orders of added rates are assigned below
+                        ids[record.id] = None
+                    added.append(record)
+                changed.append(record)
+        if count:
+            raise InvalidRates(errors, count)
+
+        records = snapshot.rates.copy()
+        for position, record in replaced.items():
+            records[position] = record
+        orders = index.orders
+        if deleted:
+            for position in sorted(deleted, reverse=True):
+                del records[position]
+            orders = array("q", (order for i, order in enumerate(orders) if i not in deleted))
+
+        # Added rates are ordered after every rate, including deleted ones, so
+        # the orders of the rates already in the index are unchanged
+        next_order = index.orders[-1] + 1 if index.orders else 0
+        if type(orders) == range:
+            orders = range(len(records) + len(added))
+        else:
+            orders = array("q", orders)
+            orders.extend(range(next_order, next_order + len(added)))
+        for order, record in zip(range(next_order, next_order + len(added)), added):
+            if record.id is not None:
+                ids[record.id] = order
+        records.extend(added)
+
+        patched = index.patch(records, orders, changed)
+        snapshot = RateSnapshot(
+                next(cls._generations),
+                records,
+                cls._compile_index(records, patched, snapshot.index),
+                ids,
+                version=records.digest(),
+                loaded=time_ns()
+        )
+        compile_seconds.observe(perf_counter() - began)
+        return snapshot
+
+    @classmethod
+    def publish(cls, snapshot: RateSnapshot, persist: bool = True) -> None:
         """
+        Make a compiled snapshot the rates used by queries.  Queries already
+        in progress finish against the snapshot they started with.
 
-        loaded_rates = []
-        for rate in new_rates["rates"]:
-            loaded_rates.append(Rate(rate["days"], rate["times"], rate["tz"], rate["price"]))
+        Args:
+            snapshot: The snapshot to publish
+            persist: False to publish without writing the rates to the store
+                and table file, for rates just read from the store
+        """
 
-        cls.rates = loaded_rates
+        began = perf_counter()
+        if persist and cls.store is not None:
+            cls.store.save_rates(rate.to_dict() for rate in snapshot.rates)
+        if persist and cls.table_file is not None:
+            cls.table_file.write(snapshot.rates)
+        cls.snapshot = snapshot
+        publish_seconds.observe(perf_counter() - began)
         logger.info("Updated parking rates")
 
     @classmethod
-    def get_rate_price(cls, start: datetime, end: datetime) -> int:
+    @contextmanager
+    def changing(cls) -> Iterator[None]:
+        """
+        Hold the lock rates are changed under, while changes are applied to
+        the rates in use with patch_rates and published, or while new rates
+        are published, so changes are published one after another rather
+        than over rates published since they were applied.
+
+        Threads of a process take changes_lock.  Rates shared with other
+        worker processes through the table file, or else the store, are also
+        locked with a lock file beside it, <path>.lock, so a change applied
+        in one process waits for rates being published by another, and is
+        applied to them once patch_rates syncs.  Not reentrant.
+        """
+
+        with cls.changes_lock:
+            shared = cls.table_file or cls.store
+            if shared is None:
+                yield
+                return
+            with file_lock(f"{shared.path}.lock"):
+                yield
+
+    @classmethod
+    def use_engine(cls, engine: str, horizon: tuple[int, int] = None) -> None:
+        """
+        Choose the engine rates are compiled for.  Takes effect the next time
+        rates are loaded.
+
+        Args:
+            engine: One of engines
+            horizon: For the table engine, the first and last years covered by
+                the lookup tables.  Queries outside them use the index engine.
+
+        Raises:
+            ValueError if the engine or horizon is invalid
+        """
+
+        if engine not in engines:
+            raise ValueError(f"Invalid engine {engine}, must be one of: {', '.join(engines)}")
+        if horizon is not None:
+            if len(horizon) != 2 or horizon[0] > horizon[1]:
+                raise ValueError(f"Invalid horizon {horizon}, must be first and last years")
+            cls.table_horizon = tuple(horizon)
+        cls.engine = engine
+
+    @classmethod
+    def use_store(cls, path: str) -> None:
+        """
+        Persist published rates to a store file.  If no rates are loaded yet,
+        e.g. from a shared table file, the stored rates are loaded, without
+        writing them back to the store or the table file, so starting a
+        process or running a management command leaves both files alone.
+
+        Args:
+            path: Location of the store file
+        """
+
+        cls.store = RateStore(path)
+        if cls.snapshot is not None:
+            return
+
+        try:
+            stored_rates = cls.store.open()
+            if stored_rates is not None:
+                with stored_rates:
+                    cls.publish(cls.compile_rate_stream(iter_rates(stored_rates)), persist=False)
+        except Exception as e:
+            logger.error(f"Failed to load stored rates from {path}: {e}")
+
+    @classmethod
+    def use_table_file(cls, path: str) -> None:
+        """
+        Share rates with other worker processes through a table file.  Rates
+        published by any process are written to the file, and every process
+        picks up a newer table on its next query.
+
+        Args:
+            path: Location of the table file
+        """
+
+        cls.table_file = RateTableFile(path)
+        cls.sync()
+
+    @classmethod
+    def sync(cls) -> None:
+        """
+        Load rates from the shared table file if another process has
+        published newer rates.
+        """
+
+        table_file = cls.table_file
+        if table_file is None:
+            return
+        try:
+            table = table_file.read_if_changed()
+        except Exception as e:
+            logger.error(f"Failed to read rate table {table_file.path}: {e}")
+            return
+        if table is None:
+            return
+
+        began = perf_counter()
+        version, rates = table
+        records = RateArrays(RateRecord(*rate) for rate in rates)
+        ids = {rate_id: order for order, rate_id in enumerate(records.ids or ()) if rate_id is not None}
+        cls.snapshot = RateSnapshot(
+                next(cls._generations),
+                records,
+                cls._compile_index(records),
+                ids,
+                version=records.digest(),
+                loaded=version
+        )
+        compile_seconds.observe(perf_counter() - began)
+        logger.info(f"Updated parking rates from rate table version {version}")
+
+    @classmethod
+    def sync_pending(cls) -> bool:
+        """
+        Check, without reading it, whether the shared table file has been
+        replaced since it was last read, so the next sync will compile rates.
+        """
+
+        table_file = cls.table_file
+        return table_file is not None and table_file.changed()
+
+    @classmethod
+    def get_rate_price(
+            cls,
+            start: Instant,
+            end: Instant,
+            mode: str = "single",
+            snapshot: RateSnapshot = None
+    ) -> int:
         """
         Get the parking rate for supplied start and end times.
 
         Args:
-            start: The start of the time range
-            end: The end of the time range
+            start: The start of the time range, a datetime or Timestamp
+            end: The end of the time range, a datetime or Timestamp
+            mode: One of query_modes, how a time range not contained in a
+                single rate is priced
+            snapshot: Rates to price from, as returned by get_snapshot, by
+                default the rates in use
 
         Returns:
             The applicable rate, None if a rate is not available for the given
@@ -46,17 +557,247 @@ class ParkingRates:
             successfully loaded.
         """
 
-        if cls.rates == None:
-            raise RuntimeError("Rates must first be loaded with load_rates")
+        snapshot = cls._get_snapshot(snapshot)
+        key = cls._cache_key(start, end, mode)
+        found, price = cls.cache.get(key, snapshot.generation)
+        if not found:
+            price = snapshot.index.find(start, end, mode)
+            cls.cache.put(key, snapshot.generation, price)
+        return price
+
+    @classmethod
+    def get_rate_prices(cls, spans: list[tuple[Instant, Instant]], mode: str = "single") -> list[int]:
+        """
+        Get the parking rates for several start and end time pairs at once.
+
+        Args:
+            spans: (start, end) pairs of time ranges
+            mode: As for get_rate_price
+
+        Returns:
+            The applicable rates in the same order as spans, None for each
+            time range a rate is not available for.
+
+        Raises:
+            RuntimeError if get_rate_prices is called before rates are
+            successfully loaded.
+        """
+
+        snapshot = cls._get_snapshot()
+        keys = [cls._cache_key(start, end, mode) for start, end in spans]
+        prices = [None] * len(spans)
+        missed = []
+        for i, key in enumerate(keys):
+            found, prices[i] = cls.cache.get(key, snapshot.generation)
+            if not found:
+                missed.append(i)
+
+        if missed:
+            found_prices = snapshot.index.find_many([spans[i] for i in missed], mode)
+            for i, price in zip(missed, found_prices):
+                prices[i] = price
+                cls.cache.put(keys[i], snapshot.generation, price)
+        return prices
+
+    @classmethod
+    def get_rate_price_range(
+            cls,
+            start: Instant,
+            end: Instant,
+            slot: timedelta,
+            mode: str = "single",
+            snapshot: RateSnapshot = None
+    ) -> Iterator[int]:
+        """
+        Get the parking rate of every slot of a time range, sweeping the rates
+        once over the range rather than looking up each slot.  Prices are the
+        same as get_rate_price would give for each slot, but are not cached.
+
+        Args:
+            start: The start of the time range, a datetime or Timestamp
+            end: The end of the time range, a datetime or Timestamp
+            slot: Duration of each slot, the last slot ends at end even if
+                shorter
+            mode: As for get_rate_price
+            snapshot: As for get_rate_price
+
+        Returns:
+            An iterator of the applicable rate of each slot in time order,
+            None for each slot a rate is not available for.  Slots are priced
+            in chunks as the iterator is consumed, all from the rates in use
+            when get_rate_price_range was called.
+
+        Raises:
+            RuntimeError if get_rate_price_range is called before rates are
+            successfully loaded.
+        """
+
+        snapshot = cls._get_snapshot(snapshot)
+        return snapshot.index.find_range(start, end, slot, mode)
+
+    @classmethod
+    def get_available_windows(
+            cls,
+            start: Instant,
+            end: Instant,
+            duration: timedelta,
+            mode: str = "single",
+            snapshot: RateSnapshot = None
+    ) -> Iterator[Window]:
+        """
+        Find when a stay can start within a time range, grouped into windows of
+        start times with the same parking rate, sweeping the rates once over
+        the range rather than pricing every start time.
+
+        Args:
+            start: The start of the time range, a datetime or Timestamp
+            end: The end of the time range, a datetime or Timestamp
+            duration: Duration of the stay, a whole number of minutes
+            mode: As for get_rate_price
+            snapshot: As for get_rate_price
+
+        Returns:
+            An iterator of the availability.Windows in time order, each priced
+            as get_rate_price would price a stay starting within it.  Start
+            times no rate is available at are left out.
+
+        Raises:
+            RuntimeError if get_available_windows is called before rates are
+            successfully loaded.
+        """
+
+        # The table engine prices every time range as the index it was
+        # compiled from does, so windows are always found with the index
+        index = cls._get_snapshot(snapshot).index
+        if isinstance(index, LookupTable):
+            index = index.index
+        return find_windows(
+                index,
+                epoch_microseconds(start),
+                epoch_microseconds(end),
+                duration // timedelta(minutes=1),
+                mode
+        )
+
+    @classmethod
+    def get_snapshot(cls) -> RateSnapshot:
+        """
+        Get the rates in use, so a response can be answered from one set of
+        rates even if others are published meanwhile: tagged with their
+        version and load time, and priced by passing the snapshot to
+        get_rate_price and the like.  Unlike get_rate_price this never
+        compiles rates, so a response that turns out not to need pricing
+        doesn't compile them.
 
-        for rate in cls.rates:
-            if rate.time_span_in_rate(start, end):
-                return rate.price
-        return None
+        Raises:
+            RuntimeError if get_snapshot is called before rates are
+            successfully loaded.
+        """
+
+        cls.sync()
+        snapshot = cls.snapshot
+        if snapshot is None:
+            raise RuntimeError("Rates must first be loaded with load_rates")
+        return snapshot
 
     @classmethod
     def rates_loaded(cls) -> bool:
-        return bool(cls.rates)
+        cls.sync()
+        snapshot = cls.snapshot
+        return snapshot is not None and bool(snapshot.rates)
+
+    @classmethod
+    def cache_stats(cls) -> dict:
+        """
+        Get the query cache counters for monitoring.
+
+        Returns:
+            The cache size, capacity, hits, misses and evictions, along with
+            the generation of the rates in use.
+        """
+
+        snapshot = cls.snapshot
+        generation = 0 if snapshot is None else snapshot.generation
+        return dict(cls.cache.stats(), generation=generation)
+
+    @classmethod
+    def _compile_index(
+            cls,
+            records: RateArrays,
+            index: RateIndex = None,
+            previous: Union[RateIndex, LookupTable] = None
+    ) -> Union[RateIndex, LookupTable]:
+        # A patched index and the engine it was patched from may be passed in
+        # so unchanged lookup tables are reused
+        if index is None:
+            index = RateIndex(records)
+        if cls.engine == "table":
+            if not isinstance(previous, LookupTable):
+                previous = None
+            return LookupTable(index, cls.table_horizon, previous)
+        return index
+
+    @classmethod
+    def _get_snapshot(cls, snapshot: RateSnapshot = None) -> RateSnapshot:
+        # Read the snapshot once so the whole query uses the same rates,
+        # unless the caller already has
+        if snapshot is not None:
+            return snapshot
+        cls.sync()
+        snapshot = cls.snapshot
+        if snapshot is None:
+            raise RuntimeError("Rates must first be loaded with load_rates")
+        return snapshot
+
+    @staticmethod
+    def _cache_key(start: Instant, end: Instant, mode: str) -> tuple[int, int, str]:
+        # The same instants in different UTC offsets or forms share a cache
+        # entry
+        return (epoch_microseconds(start), epoch_microseconds(end), mode)
+
+
+class InvalidRates(ValueError):
+    """
+    Raised when compiling rates any of which are invalid.
+
+    Args:
+        errors: The first max_rate_errors invalid rates, as dictionaries of
+            the position of the rate in the document and the error message,
+            and for patch_rates the kind of change
+        count: Number of invalid rates
+    """
+
+    def __init__(self, errors: list[dict], count: int):
+        self.errors = errors
+        self.count = count
+        first = errors[0]
+        message = f"rate {first['rate']}: {first['error']}"
+        if "change" in first:
+            message = f"{first['change']} {message}"
+        if count > 1:
+            message += f" (and {count - 1} more invalid rates)"
+        super().__init__(message)
+
+
+class ConflictingRates(ValueError):
+    """
+    Raised when compiling rates in strict mode, some of which overlap with
+    different prices.
+
+    Args:
+        overlaps: The OverlapReport of the rates
+    """
+
+    def __init__(self, overlaps: OverlapReport):
+        self.overlaps = overlaps
+        first = overlaps.details[0]
+        message = (
+            f"rates {first['rates'][0]} and {first['rates'][1]} overlap on {first['day']} "
+            f"{first['times']} {first['tz']} with different prices"
+        )
+        if overlaps.conflicts > 1:
+            message += f" (and {overlaps.conflicts - 1} more conflicts)"
+        super().__init__(message)
 
 
 class Rate:
@@ -70,12 +811,14 @@ class Rate:
         timezone: Timezone rate applies to.  Specified in format "America/Chicago".
         price: Price for this rate during specified times, specified in cents,
             e.g. 925.
+        rate_id: Optional identifier to update or delete the rate by, e.g.
+            "garage-12-weekday".
 
     Raises:
         ValueError if any fields contain invalid data
     """
 
-    def __init__(self, days: str, times: str, timezone: str, price: int):
+    def __init__(self, days: str, times: str, timezone: str, price: int, rate_id: str = None):
         self.days = days
 
         self.time_span = TimeSpan(times)
@@ -83,9 +826,31 @@ class Rate:
         try:
             self.timezone = pytz.timezone(timezone)
         except Exception as e:
-            raise ValueError from e
+            raise ValueError(f"Invalid timezone {timezone}") from e
 
         self.price = price
+        self.rate_id = rate_id
+
+    @classmethod
+    def from_dict(cls, rate: dict) -> "Rate":
+        """
+        Create a Rate from a rate object of a rates document.
+
+        Raises:
+            ValueError if rate is not an object or any field is missing or
+            invalid
+        """
+
+        if type(rate) != dict:
+            raise ValueError("Rate must be an object")
+        try:
+            days, times, timezone, price = rate["days"], rate["times"], rate["tz"], rate["price"]
+        except KeyError as e:
+            raise ValueError(f"Missing field {e}") from e
+        for name, value in (("days", days), ("times", times), ("tz", timezone)):
+            if type(value) != str:
+                raise ValueError(f"Invalid {name} {value!r}, must be a string")
+        return cls(days, times, timezone, price, rate.get("id"))
 
     @property
     def days(self) -> list[str]:
@@ -99,16 +864,44 @@ class Rate:
                 raise ValueError(f"Day is not a valid day abbreviation: {day}")
         self._days = fields
 
+    @property
+    def days_mask(self) -> int:
+        """Bitmask of the weekdays this rate applies to, Monday is bit 0."""
+        mask = 0
+        for day in self._days:
+            mask |= 1 << day_abbreviations.index(day)
+        return mask
+
     @property
     def price(self) -> str:
         return self._price
 
     @price.setter
     def price(self, value: int) -> None:
-        if type(value) != int or value < 0:
+        if type(value) != int or value < 0 or value > max_price:
             raise ValueError(f'Invalid price {value}, must be a positive integer')
         self._price = value
 
+    @property
+    def rate_id(self) -> str:
+        return self._rate_id
+
+    @rate_id.setter
+    def rate_id(self, value: str) -> None:
+        if value is not None and (type(value) != str or not 0 < len(value) <= max_id_length):
+            raise ValueError(f"Invalid id {value!r}, must be a string of 1 to {max_id_length} characters")
+        self._rate_id = value
+
+    def to_record(self) -> RateRecord:
+        return RateRecord(
+                self.days_mask,
+                self.time_span.start_minute,
+                self.time_span.end_minute,
+                self.timezone.zone,
+                self.price,
+                self.rate_id
+        )
+
     def time_span_in_rate(self, start: datetime, end: datetime) -> bool:
         """
         Returns true if the day and start and end times are within this rate,
@@ -125,22 +918,33 @@ class Rate:
         # Convert times to timezone of this Rate
         start_local = start.astimezone(self.timezone)
         end_local = end.astimezone(self.timezone)
+        start_time = start_local.time()
+        end_time = end_local.time()
 
-        # Ensure times are on same day
-        # Note: This can only be checked after timezone conversion is done
+        # Note: Days can only be checked after timezone conversion is done
         day = start_local.weekday()
-        if day != end_local.weekday():
-            return False
-
-        # Check day
-        if not day_abbreviations[day] in self.days:
-            return False
-
-        # Check time
-        if not self.time_span.in_time_span(start_local.time(), end_local.time()):
-            return False
-
-        return True
+        days_apart = (end_local.date() - start_local.date()).days
+
+        if not self.time_span.overnight:
+            return (
+                days_apart == 0
+                and day_abbreviations[day] in self.days
+                and self.time_span.in_time_span(start_time, end_time)
+            )
+
+        # An overnight rate contains times in the evening of its days, the
+        # morning after them, or a range from one to the other
+        if days_apart == 0:
+            if day_abbreviations[day] in self.days and start_time >= self.time_span.start:
+                return True
+            return day_abbreviations[day - 1] in self.days and end_time <= self.time_span.end
+        if days_apart == 1:
+            return (
+                day_abbreviations[day] in self.days
+                and start_time >= self.time_span.start
+                and end_time <= self.time_span.end
+            )
+        return False
 
 
 class TimeSpan:
@@ -148,7 +952,9 @@ class TimeSpan:
     Class representing a time span, i.e. start and end times.
 
     Args:
-        span: Time span represented with format: "0900-2100"
+        span: Time span represented with format: "0900-2100".  An end time
+            before the start time, e.g. "2200-0600", is an overnight span ending
+            the following day.
 
     Raises:
         ValueError if span is not a valid time span.
@@ -158,8 +964,8 @@ class TimeSpan:
 
     def __init__(self, span: str):
         self.start, self.end = span.split("-")
-        if self.start >= self.end:
-            raise ValueError(f"Start time {self.start} does not suceed end time {self.end}")
+        if self.start == self.end:
+            raise ValueError(f"Start time {self.start} is the same as end time {self.end}")
 
     @property
     def start(self) -> time:
@@ -177,12 +983,25 @@ class TimeSpan:
     def end(self, value: str) -> None:
         self._end = self._parse_time(value)
 
+    @property
+    def overnight(self) -> bool:
+        return self._end < self._start
+
+    @property
+    def start_minute(self) -> int:
+        return self._start.hour * 60 + self._start.minute
+
+    @property
+    def end_minute(self) -> int:
+        return self._end.hour * 60 + self._end.minute
+
     def _parse_time(self, value: str) -> time:
         return datetime.strptime(value, self.format).time()
 
     def in_time_span(self, start: time, end: time) -> bool:
         """
-        Check if start and end time objects are inside the time span.
+        Check if start and end time objects on the same day are inside the
+        time span.  Overnight spans are checked by Rate.time_span_in_rate.
 
         Args:
             start: The start of the time range
@@ -0,0 +1,188 @@
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+
+# Header: magic, format version, table version, timezone count, rate count
+header_format = struct.Struct("<4sHQII")
+# Rate: days mask, start minute, end minute, timezone id, price
+record_format = struct.Struct("<BHHHQ")
+# Timezone names, and rate ids following the rates, are stored as a length
+# followed by UTF-8 bytes.  A rate without an id has an empty id.
+name_length_format = struct.Struct("<H")
+
+magic = b"PKRT"
+format_version = 2
+
+
+class RateTableFile:
+    """
+    Compiled rate table stored in a compact binary file shared by every worker
+    process.
+
+    The worker handling a rates update writes a new file and atomically
+    replaces the old one.  Other workers stat the file on each request and,
+    when it has been replaced, map it read-only and compare the version in its
+    header to the version they are serving before decoding it.
+
+    What workers share is the validated rates, not the compiled index: each
+    worker decodes the whole table into rate tuples and compiles its own index
+    from them, as the index is made of Python objects.  The table spares
+    workers parsing and validating the rates document, not the memory or time
+    of compiling it, and mapping it only spares copying it before decoding.
+
+    Args:
+        path: Location of the table file
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self.version = None
+        self._stat = None
+
+    def write(self, records: tuple) -> int:
+        """
+        Write rate records to a new table file and replace the current one.
+
+        Args:
+            records: RateRecords in the order they were supplied
+
+        Returns:
+            The version of the written table.
+        """
+
+        timezones = list(dict.fromkeys(record.tz for record in records))
+        timezone_ids = {tz: i for i, tz in enumerate(timezones)}
+
+        # Versions are nanosecond timestamps so they increase across processes
+        version = max(time.time_ns(), (self.version or 0) + 1)
+
+        parts = [header_format.pack(magic, format_version, version, len(timezones), len(records))]
+        for tz in timezones:
+            name = tz.encode("utf-8")
+            parts.append(name_length_format.pack(len(name)))
+            parts.append(name)
+        for record in records:
+            parts.append(record_format.pack(
+                    record.days_mask,
+                    record.start,
+                    record.end,
+                    timezone_ids[record.tz],
+                    record.price
+            ))
+        for record in records:
+            rate_id = (record.id or "").encode("utf-8")
+            parts.append(name_length_format.pack(len(rate_id)))
+            parts.append(rate_id)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".rates-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(b"".join(parts))
+                f.flush()
+                os.fsync(f.fileno())
+                # Taken before the file is renamed, which keeps its inode,
+                # modification time and size, so a table written by another
+                # process just after the rename is still seen as changed
+                stat = self._stat_key(os.fstat(f.fileno()))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self.version = version
+        self._stat = stat
+        return version
+
+    def read_if_changed(self) -> tuple[int, list[tuple]]:
+        """
+        Read the table file if it has been replaced with a different version
+        since it was last read or written by this process.
+
+        Returns:
+            A 2-tuple of the table version and a list of (days mask, start,
+            end, timezone name, price, id) tuples, None if the table is
+            missing or unchanged.
+
+        Raises:
+            ValueError if the file is not a valid rate table
+        """
+
+        if not self.changed():
+            return None
+
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        with f:
+            # The file opened is the one remembered, even if it is replaced
+            # again meanwhile, and even if it is invalid so it is only
+            # reported once
+            self._stat = self._stat_key(os.fstat(f.fileno()))
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                version, rates = self._decode(mapped)
+
+        if version == self.version:
+            return None
+        self.version = version
+        return (version, rates)
+
+    def changed(self) -> bool:
+        """
+        Check whether the table file has been replaced since it was last read
+        or written by this process.
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return self._stat_key(stat) != self._stat
+
+    def _decode(self, mapped: mmap.mmap) -> tuple[int, list[tuple]]:
+        if len(mapped) < header_format.size:
+            raise ValueError(f"Rate table {self.path} is truncated")
+        file_magic, file_format, version, tz_count, rate_count = header_format.unpack_from(mapped)
+        if file_magic != magic or file_format != format_version:
+            raise ValueError(f"Rate table {self.path} has an unsupported format")
+
+        offset = header_format.size
+        timezones = []
+        for _ in range(tz_count):
+            (length,) = name_length_format.unpack_from(mapped, offset)
+            offset += name_length_format.size
+            timezones.append(mapped[offset:offset + length].decode("utf-8"))
+            offset += length
+
+        ids_offset = offset + rate_count * record_format.size
+        if len(mapped) < ids_offset + rate_count * name_length_format.size:
+            raise ValueError(f"Rate table {self.path} is truncated")
+        with memoryview(mapped) as view:
+            records = record_format.iter_unpack(view[offset:ids_offset])
+            rates = [
+                (days_mask, start, end, timezones[tz_id], price, None)
+                for days_mask, start, end, tz_id, price in records
+            ]
+
+        offset = ids_offset
+        try:
+            for i in range(rate_count):
+                (length,) = name_length_format.unpack_from(mapped, offset)
+                offset += name_length_format.size
+                if length:
+                    rates[i] = rates[i][:5] + (mapped[offset:offset + length].decode("utf-8"),)
+                    offset += length
+        except struct.error:
+            raise ValueError(f"Rate table {self.path} is truncated") from None
+        if len(mapped) != offset:
+            raise ValueError(f"Rate table {self.path} is truncated")
+        return (version, rates)
+
+    @staticmethod
+    def _stat_key(stat: os.stat_result) -> tuple[int, int, int]:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
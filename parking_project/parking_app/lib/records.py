@@ -0,0 +1,159 @@
+from array import array
+import hashlib
+import itertools
+from typing import Iterable, NamedTuple
+
+
+day_abbreviations = ["mon", "tues", "wed", "thurs", "fri", "sat", "sun"]
+# Time of day of each minute of the day, e.g. "0930" for 570
+clock_times = [f"{minute // 60:02}{minute % 60:02}" for minute in range(24 * 60)]
+
+# Comma separated days of each days mask, e.g. "mon,wed" for 0b101
+day_lists = [
+    ",".join(day for i, day in enumerate(day_abbreviations) if mask & (1 << i))
+    for mask in range(1 << len(day_abbreviations))
+]
+
+
+class RateRecord(NamedTuple):
+    """
+    Immutable, compact form of a validated Rate.
+
+    Attributes:
+        days_mask: Bitmask of the weekdays the rate applies to, Monday is bit 0
+        start: Minute of the day the rate starts
+        end: Minute of the day the rate ends
+        tz: Name of the timezone the rate applies to
+        price: Price in cents
+        id: Identifier the rate is updated or deleted by, None if the rate
+            has none
+    """
+
+    days_mask: int
+    start: int
+    end: int
+    tz: str
+    price: int
+    id: str = None
+
+    def to_dict(self) -> dict:
+        """Convert back to the rates document representation."""
+        rate = {
+            "days": day_lists[self.days_mask],
+            "times": f"{clock_times[self.start]}-{clock_times[self.end]}",
+            "tz": self.tz,
+            "price": self.price,
+        }
+        if self.id is not None:
+            rate = {"id": self.id, **rate}
+        return rate
+
+
+class RateArrays:
+    """
+    Compact sequence of rates, held as parallel arrays of their fields rather
+    than a RateRecord and its int objects per rate.  Indexing and iterating
+    give RateRecords.
+
+    Args:
+        records: RateRecords to start with
+    """
+
+    def __init__(self, records: Iterable[RateRecord] = ()):
+        self.days_masks = array("B")
+        self.starts = array("H")
+        self.ends = array("H")
+        self.timezone_ids = array("H")
+        self.prices = array("Q")
+        # Timezone names by timezone id
+        self.timezones = []
+        self._timezone_ids = {}
+        # Rate ids, None until a rate with an id is added
+        self.ids = None
+        self.extend(records)
+
+    def append(self, record: RateRecord) -> None:
+        self.prices.append(record.price)
+        self.days_masks.append(record.days_mask)
+        self.starts.append(record.start)
+        self.ends.append(record.end)
+        self.timezone_ids.append(self._timezone_id(record.tz))
+        if record.id is not None and self.ids is None:
+            self.ids = [None] * (len(self.prices) - 1)
+        if self.ids is not None:
+            self.ids.append(record.id)
+
+    def extend(self, records: Iterable[RateRecord]) -> None:
+        for record in records:
+            self.append(record)
+
+    def copy(self) -> "RateArrays":
+        rates = RateArrays()
+        for name in ("days_masks", "starts", "ends", "timezone_ids", "prices"):
+            setattr(rates, name, array(getattr(self, name).typecode, getattr(self, name)))
+        rates.timezones = list(self.timezones)
+        rates._timezone_ids = dict(self._timezone_ids)
+        rates.ids = None if self.ids is None else list(self.ids)
+        return rates
+
+    def digest(self) -> str:
+        """
+        Hex digest of everything deciding the prices of the rates: their
+        fields other than ids, and their order.  Equal rates give the same
+        digest in every process.
+        """
+
+        digest = hashlib.blake2b(digest_size=16)
+        for values in (self.days_masks, self.starts, self.ends, self.timezone_ids, self.prices):
+            digest.update(len(values).to_bytes(8, "little"))
+            digest.update(values.tobytes())
+        digest.update("\n".join(self.timezones).encode())
+        return digest.hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def __getitem__(self, i: int) -> RateRecord:
+        return RateRecord(
+                self.days_masks[i],
+                self.starts[i],
+                self.ends[i],
+                self.timezones[self.timezone_ids[i]],
+                self.prices[i],
+                None if self.ids is None else self.ids[i]
+        )
+
+    def __setitem__(self, i: int, record: RateRecord) -> None:
+        self.days_masks[i] = record.days_mask
+        self.starts[i] = record.start
+        self.ends[i] = record.end
+        self.timezone_ids[i] = self._timezone_id(record.tz)
+        self.prices[i] = record.price
+        if record.id is not None and self.ids is None:
+            self.ids = [None] * len(self.prices)
+        if self.ids is not None:
+            self.ids[i] = record.id
+
+    def __delitem__(self, i: int) -> None:
+        for values in (self.days_masks, self.starts, self.ends, self.timezone_ids, self.prices, self.ids):
+            if values is not None:
+                del values[i]
+
+    def __iter__(self):
+        timezones = self.timezones
+        ids = self.ids or itertools.repeat(None)
+        for days_mask, start, end, timezone_id, price, rate_id in zip(
+                self.days_masks, self.starts, self.ends, self.timezone_ids, self.prices, ids):
+            yield RateRecord(days_mask, start, end, timezones[timezone_id], price, rate_id)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, (RateArrays, tuple, list)):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    def _timezone_id(self, tz: str) -> int:
+        timezone_id = self._timezone_ids.get(tz)
+        if timezone_id is None:
+            timezone_id = self._timezone_ids[tz] = len(self.timezones)
+            self.timezones.append(tz)
+        return timezone_id
@@ -0,0 +1,131 @@
+from contextlib import contextmanager
+from itertools import islice
+import json
+import os
+import tempfile
+from typing import Iterable
+
+
+# Rates encoded for each write by save_rates
+write_batch_size = 1000
+
+
+class RateStore:
+    """
+    Local file holding the last accepted parking rates document, so rates
+    survive a restart, and can be shared by worker processes storing rates to
+    the same file: see changed.
+
+    Args:
+        path: Location of the store file
+    """
+
+    def __init__(self, path: str):
+        self.path = str(path)
+        self._stat = None
+
+    def save(self, rates: dict) -> None:
+        """
+        Store a rates document, atomically replacing the previous one.
+
+        Args:
+            rates: The rates document
+        """
+
+        with self._replace() as f:
+            json.dump(rates, f)
+
+    def save_rates(self, rates: Iterable[dict]) -> None:
+        """
+        As for save, but writes a rates document one rate at a time so the
+        document is never built in memory.
+
+        Args:
+            rates: The rate objects of the rates document
+        """
+
+        with self._replace() as f:
+            # Rates are encoded a batch at a time, keeping memory flat while
+            # making few calls to json.dumps, which unlike json.dump encodes
+            # with the C encoder.  The brackets of each encoded batch are
+            # dropped.
+            f.write('{"rates": [')
+            separator = ""
+            rates = iter(rates)
+            while True:
+                batch = list(islice(rates, write_batch_size))
+                if not batch:
+                    break
+                f.write(separator + json.dumps(batch)[1:-1])
+                separator = ", "
+            f.write("]}")
+
+    def open(self):
+        """
+        Open the stored rates document to be read as a stream, e.g. with
+        iter_rates.
+
+        Returns:
+            The store file opened for reading bytes, None if no rates have been
+            stored.
+        """
+
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return None
+        self._stat = self._stat_key(os.fstat(f.fileno()))
+        return f
+
+    def changed(self) -> bool:
+        """
+        Check whether the store file has been replaced, e.g. by another
+        process, since it was last opened or saved by this RateStore.
+        """
+
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return self._stat_key(stat) != self._stat
+
+    def load(self) -> dict:
+        """
+        Load the stored rates document.
+
+        Returns:
+            The rates document, None if no rates have been stored.
+
+        Raises:
+            ValueError if the stored document is not valid JSON
+        """
+
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def _replace(self):
+        # Write to a temporary file in the same directory and rename it over
+        # the store file only once it is complete
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".rates-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+                # Taken before the rename, as for RateTableFile.write
+                stat = self._stat_key(os.fstat(f.fileno()))
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._stat = stat
+
+    @staticmethod
+    def _stat_key(stat: os.stat_result) -> tuple[int, int, int]:
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+from typing import NamedTuple, Union
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+MICROSECONDS_PER_SECOND = 1000000
+
+epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class Timestamp(NamedTuple):
+    """
+    An instant parsed from an ISO-8601 string along with its integer epoch
+    time, so the lookup engines can use it without datetime arithmetic.
+
+    Attributes:
+        seconds: UTC epoch seconds, rounded down
+        microsecond: Microseconds past seconds
+        parsed: The parsed datetime, in its original UTC offset
+    """
+
+    seconds: int
+    microsecond: int
+    parsed: datetime
+
+    @property
+    def ceil(self) -> int:
+        """UTC epoch seconds, rounded up."""
+        return self.seconds + (1 if self.microsecond else 0)
+
+
+# Either form of instant accepted by the lookup engines
+Instant = Union[datetime, Timestamp]
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parse an ISO-8601 datetime string with timezone info, as sent by clients.
+
+    Besides the strings datetime.fromisoformat accepts, a "Z" suffix is
+    accepted for UTC, and a space in place of the "+" of the UTC offset, as a
+    "+" left unescaped in a query string arrives as a space.
+
+    Args:
+        value: Datetime string, e.g. 2015-07-01T07:00:00-05:00
+
+    Returns:
+        An aware datetime.
+
+    Raises:
+        ValueError if value is not a valid ISO-8601 datetime string or does not
+        include timezone info.
+    """
+
+    # A space after the date and time separator can only be the offset sign
+    sign = value.rfind(" ")
+    if sign > 10:
+        value = value[:sign] + "+" + value[sign + 1:]
+    elif value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        raise ValueError("Timezone must be specified.")
+    return parsed
+
+
+def parse_timestamp(value: str) -> Timestamp:
+    """
+    Parse an ISO-8601 datetime string with timezone info to integer epoch
+    time.
+
+    The epoch time is computed once here, from a single datetime
+    subtraction, rather than by each lookup converting the datetime.
+
+    Args:
+        value: Datetime string, as for parse_datetime
+
+    Returns:
+        The parsed Timestamp.
+
+    Raises:
+        ValueError as for parse_datetime
+    """
+
+    parsed = parse_datetime(value)
+    delta = parsed - epoch
+    return Timestamp(delta.days * SECONDS_PER_DAY + delta.seconds, delta.microseconds, parsed)
+
+
+def epoch_microseconds(value: Instant) -> int:
+    """
+    UTC epoch microseconds of a datetime or Timestamp, exact for both.
+    """
+
+    if isinstance(value, Timestamp):
+        return value.seconds * MICROSECONDS_PER_SECOND + value.microsecond
+    return (value - epoch) // timedelta(microseconds=1)
@@ -0,0 +1,139 @@
+from bisect import bisect_right
+from datetime import datetime, timedelta
+import math
+import threading
+
+from parking_app.lib.timestamp import MICROSECONDS_PER_SECOND, SECONDS_PER_DAY
+
+
+MICROSECONDS_PER_MINUTE = 60 * MICROSECONDS_PER_SECOND
+MICROSECONDS_PER_DAY = SECONDS_PER_DAY * MICROSECONDS_PER_SECOND
+
+# Day number, as returned by index.day_number, of 1970-01-01
+EPOCH_DAY_NUMBER = 719162
+
+# Start of the first offset of every timezone, before any instant a datetime
+# can hold
+first_transition = -2 ** 63
+
+epoch = datetime(1970, 1, 1)
+
+
+class TimezoneOffsets:
+    """
+    UTC offsets of a timezone at every instant, taken from the same transition
+    data pytz converts with, so converting an epoch time to local time is a
+    bisect and integer arithmetic rather than a datetime conversion.  Past the
+    last transition pytz keeps the last offset, and so does this.
+
+    Get one with timezone_offsets, which shares them between every rate and
+    rate index of a timezone.
+
+    Args:
+        timezone: A pytz timezone, or a tzinfo with a fixed offset
+
+    Attributes:
+        times: UTC epoch seconds each offset takes effect from, in increasing
+            order
+        offsets: UTC offset in seconds from each of times
+    """
+
+    def __init__(self, timezone):
+        transition_times = getattr(timezone, "_utc_transition_times", None)
+        if transition_times is None:
+            # Timezones with a fixed offset have no transitions
+            self.times = [first_transition]
+            self.offsets = [timezone.utcoffset(epoch) // timedelta(seconds=1)]
+            return
+
+        self.times = [first_transition] + [(t - epoch) // timedelta(seconds=1) for t in transition_times[1:]]
+        self.offsets = [info[0] // timedelta(seconds=1) for info in timezone._transition_info]
+
+    def offset(self, timestamp: int) -> int:
+        """Get the UTC offset in seconds in effect at a UTC epoch second."""
+        return self.offsets[bisect_right(self.times, timestamp) - 1]
+
+    def offsets_at(self, timestamps: list[int]) -> list[int]:
+        """
+        Get the UTC offset in seconds in effect at each of several UTC epoch
+        seconds, in increasing order.  The transitions are swept once
+        alongside the timestamps rather than searched for each.
+        """
+
+        times = self.times
+        offsets = self.offsets
+        k = bisect_right(times, timestamps[0]) - 1
+        following = times[k + 1] if k + 1 < len(times) else math.inf
+        result = []
+        for timestamp in timestamps:
+            while following <= timestamp:
+                k += 1
+                following = times[k + 1] if k + 1 < len(times) else math.inf
+            result.append(offsets[k])
+        return result
+
+    def localize(self, start: int, end: int) -> tuple[int, int, int, int]:
+        """
+        Convert a time range in UTC epoch microseconds to local time, exactly
+        as index.day_number, index.start_minute and index.end_minute would
+        convert it after astimezone.
+
+        Returns:
+            A 4-tuple of the start day number, start minute rounded down, end
+            day number and end minute rounded up.
+        """
+
+        start_offset = self.offset(start // MICROSECONDS_PER_SECOND) * MICROSECONDS_PER_SECOND
+        end_offset = self.offset(end // MICROSECONDS_PER_SECOND) * MICROSECONDS_PER_SECOND
+        start_day, start_microsecond = divmod(start + start_offset, MICROSECONDS_PER_DAY)
+        end_day, end_microsecond = divmod(end + end_offset, MICROSECONDS_PER_DAY)
+        return (
+            start_day + EPOCH_DAY_NUMBER,
+            start_microsecond // MICROSECONDS_PER_MINUTE,
+            end_day + EPOCH_DAY_NUMBER,
+            -(-end_microsecond // MICROSECONDS_PER_MINUTE)
+        )
+
+    def localize_boundaries(self, boundaries: list[int]) -> list[tuple[int, int, int, int]]:
+        """
+        Convert the boundaries of slots to local time, each as localize would
+        convert it as both the start and the end of a time range.
+
+        Args:
+            boundaries: UTC epoch microseconds in increasing order
+
+        Returns:
+            Local boundaries as for index.TimezoneTable.find_slots.
+        """
+
+        offsets = self.offsets_at([boundary // MICROSECONDS_PER_SECOND for boundary in boundaries])
+        local = []
+        for boundary, offset in zip(boundaries, offsets):
+            day, microsecond = divmod(boundary + offset * MICROSECONDS_PER_SECOND, MICROSECONDS_PER_DAY)
+            day += EPOCH_DAY_NUMBER
+            local.append((day, microsecond // MICROSECONDS_PER_MINUTE, day, -(-microsecond // MICROSECONDS_PER_MINUTE)))
+        return local
+
+
+# Offsets of every timezone used so far by name, kept for the life of the
+# process so reloading rates reuses them
+_offsets = {}
+_offsets_lock = threading.Lock()
+
+
+def timezone_offsets(timezone) -> TimezoneOffsets:
+    """
+    Get the shared TimezoneOffsets of a timezone, computing them the first
+    time the timezone is used.
+
+    Args:
+        timezone: A pytz timezone
+    """
+
+    offsets = _offsets.get(timezone.zone)
+    if offsets is None:
+        with _offsets_lock:
+            offsets = _offsets.get(timezone.zone)
+            if offsets is None:
+                offsets = _offsets[timezone.zone] = TimezoneOffsets(timezone)
+    return offsets
@@ -1,6 +1,28 @@
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
 import json
 
+import pytz
+
+from parking_app.lib.rates import query_modes
+from parking_app.lib.timestamp import Timestamp, parse_datetime, parse_timestamp
+
+
+# Longest slot of a range query, a year of minutes
+max_slot_minutes = 366 * 24 * 60
+
+# Longest date range of an availability search, in days
+max_availability_days = 31
+
+# Longest stay of an availability search, a week of minutes
+max_stay_minutes = 7 * 24 * 60
+
+# Most windows an availability search returns at once, and may skip
+max_availability_limit = 100
+max_availability_offset = 10000
+
+# Values of a boolean query parameter
+flag_values = {"true": True, "1": True, "false": False, "0": False}
+
 
 def validate_get_parking(start: str, end: str) -> tuple[datetime, datetime]:
     """
@@ -18,11 +40,8 @@ def validate_get_parking(start: str, end: str) -> tuple[datetime, datetime]:
         format or does not include timezone info.
     """
 
-    start_datetime = datetime.fromisoformat(start)
-    end_datetime = datetime.fromisoformat(end)
-
-    if None in (start_datetime.tzinfo, end_datetime.tzinfo):
-        raise ValueError("Timezone must be specified.")
+    start_datetime = parse_datetime(start)
+    end_datetime = parse_datetime(end)
 
     if start_datetime >= end_datetime:
         raise ValueError(f"Start time does not precede end time.")
@@ -30,6 +49,171 @@ def validate_get_parking(start: str, end: str) -> tuple[datetime, datetime]:
     return (start_datetime, end_datetime)
 
 
+def validate_get_parking_timestamps(start: str, end: str) -> tuple[Timestamp, Timestamp]:
+    """
+    As for validate_get_parking, but returns Timestamps carrying their epoch
+    time, so the lookup engines and the query cache need no datetime
+    conversions.
+
+    Raises:
+        ValueError as for validate_get_parking
+    """
+
+    start_timestamp = parse_timestamp(start)
+    end_timestamp = parse_timestamp(end)
+
+    if (start_timestamp.seconds, start_timestamp.microsecond) >= (end_timestamp.seconds, end_timestamp.microsecond):
+        raise ValueError(f"Start time does not precede end time.")
+
+    return (start_timestamp, end_timestamp)
+
+
+def validate_get_parking_range(
+        start: str,
+        end: str,
+        slot: str,
+        max_slots: int
+) -> tuple[Timestamp, Timestamp, timedelta]:
+    """
+    Validates the parameters of a range query, as for
+    validate_get_parking_timestamps along with the slot duration.
+
+    Args:
+        start: Start time as a datetime string
+        end: End time as a datetime string
+        slot: Slot duration in minutes
+        max_slots: Most slots the time range may be divided into
+
+    Returns:
+        A 3-tuple of the start and end Timestamps and the slot duration.
+
+    Raises:
+        ValueError if start or end is invalid, slot is not a positive whole
+        number of minutes, or the range has more than max_slots slots
+    """
+
+    start_timestamp, end_timestamp = validate_get_parking_timestamps(start, end)
+
+    if not slot.isdecimal() or not 1 <= int(slot) <= max_slot_minutes:
+        raise ValueError(f"Invalid slot {slot}, must be a whole number of minutes from 1 to {max_slot_minutes}")
+    duration = timedelta(minutes=int(slot))
+
+    count = -(-(end_timestamp.parsed - start_timestamp.parsed) // duration)
+    if count > max_slots:
+        raise ValueError(f"Time range has {count} slots, must have at most {max_slots}")
+
+    return (start_timestamp, end_timestamp, duration)
+
+
+def validate_get_availability(
+        start: str,
+        end: str,
+        duration: str,
+        tz: str
+) -> tuple[datetime, datetime, timedelta]:
+    """
+    Validates the parameters of an availability search, the dates searched
+    and the duration of the stay.
+
+    Args:
+        start: First date searched, as YYYY-MM-DD
+        end: Last date searched, as YYYY-MM-DD
+        duration: Duration of the stay in minutes
+        tz: IANA timezone name the dates are in
+
+    Returns:
+        A 3-tuple of the start and end of the time range searched, midnight
+        at the start of start and at the end of end in tz, and the duration.
+
+    Raises:
+        ValueError if start or end is not a valid date, end precedes start,
+        more than max_availability_days are searched, duration is not a whole
+        number of minutes from 1 to max_stay_minutes, or tz is unknown
+    """
+
+    start_date = date.fromisoformat(start)
+    end_date = date.fromisoformat(end)
+    days = (end_date - start_date).days + 1
+    if days < 1:
+        raise ValueError(f"Start date does not precede or equal end date.")
+    if days > max_availability_days:
+        raise ValueError(f"Dates span {days} days, must span at most {max_availability_days}")
+
+    if not duration.isdecimal() or not 1 <= int(duration) <= max_stay_minutes:
+        raise ValueError(f"Invalid duration {duration}, must be a whole number of minutes from 1 to {max_stay_minutes}")
+
+    try:
+        timezone = pytz.timezone(tz)
+    except pytz.UnknownTimeZoneError:
+        raise ValueError(f"Unknown timezone {tz}") from None
+
+    return (
+        timezone.localize(datetime.combine(start_date, time())),
+        timezone.localize(datetime.combine(end_date + timedelta(days=1), time())),
+        timedelta(minutes=int(duration))
+    )
+
+
+def validate_page(limit: str, offset: str) -> tuple[int, int]:
+    """
+    Validates the limit and offset of a page of results.
+
+    Returns:
+        A 2-tuple of the limit and offset.
+
+    Raises:
+        ValueError if limit is not from 1 to max_availability_limit, or offset
+        is not from 0 to max_availability_offset
+    """
+
+    if not limit.isdecimal() or not 1 <= int(limit) <= max_availability_limit:
+        raise ValueError(f"Invalid limit {limit}, must be a whole number from 1 to {max_availability_limit}")
+    if not offset.isdecimal() or int(offset) > max_availability_offset:
+        raise ValueError(f"Invalid offset {offset}, must be a whole number from 0 to {max_availability_offset}")
+    return (int(limit), int(offset))
+
+
+def validate_query_mode(mode: str) -> str:
+    """
+    Validates the query mode passed from the client.
+
+    Args:
+        mode: Name of the query mode
+
+    Returns:
+        The query mode.
+
+    Raises:
+        ValueError if mode is not one of the supported query modes
+    """
+
+    if mode not in query_modes:
+        raise ValueError(f"Invalid mode {mode}, must be one of: {', '.join(query_modes)}")
+    return mode
+
+
+def validate_flag(name: str, value) -> bool:
+    """
+    Validates a boolean query parameter passed from the client.
+
+    Args:
+        name: Name of the parameter, for the error message
+        value: Value of the parameter, or a bool default
+
+    Returns:
+        The value as a bool.
+
+    Raises:
+        ValueError if value is not one of flag_values or a bool
+    """
+
+    if type(value) == bool:
+        return value
+    if value not in flag_values:
+        raise ValueError(f"Invalid {name} {value}, must be one of: {', '.join(flag_values)}")
+    return flag_values[value]
+
+
 def validate_put_parking(body: str) -> dict:
     """
     Validates the parking rates string passed from the client is a) valid JSON
@@ -54,3 +238,63 @@ def validate_put_parking(body: str) -> dict:
         raise ValueError from e
     else:
         return rates
+
+
+def validate_patch_parking(body: str) -> dict:
+    """
+    Validates the rate changes passed from the client are a JSON object.  The
+    changes themselves are validated when they are applied.
+
+    Args:
+        body: The request body which, if valid, contains a JSON object of
+            rate changes
+
+    Returns:
+        The rate changes as a dictionary.
+
+    Raises:
+        ValueError if the passed string is invalid
+    """
+
+    try:
+        changes = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError from e
+
+    if type(changes) != dict:
+        raise ValueError("Body must be a JSON object of rate changes")
+    return changes
+
+
+def validate_post_batch(body: str, max_items: int) -> list[dict]:
+    """
+    Validates the batch query body passed from the client is a JSON array of
+    objects.  The start and end of each item are not validated here so that a
+    bad item can be reported without failing the whole batch.
+
+    Args:
+        body: The request body which, if valid, contains a JSON array of
+            objects with start and end fields
+        max_items: Most items the batch may have
+
+    Returns:
+        The batch items as a list of dictionaries.
+
+    Raises:
+        ValueError if the passed string is invalid, or the batch has more
+        than max_items items
+    """
+
+    try:
+        items = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError from e
+
+    if type(items) != list:
+        raise ValueError("Body must be a JSON array of start/end objects.")
+    if len(items) > max_items:
+        raise ValueError(f"Batch has {len(items)} items, must have at most {max_items}")
+    for item in items:
+        if type(item) != dict:
+            raise ValueError("Body must be a JSON array of start/end objects.")
+    return items
@@ -0,0 +1,108 @@
+import os
+import resource
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from parking_app.lib.bulk import PricingSummary, price_stays, stay_formats
+from parking_app.lib.ingest import iter_rates
+from parking_app.lib.rates import ParkingRates, query_modes
+
+
+class Command(BaseCommand):
+    help = (
+        "Price a CSV or NDJSON file of stays, each a start and end time, across a pool of "
+        "processes, writing the rate of each stay in input order."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("stays", help="File of stays, - for standard input")
+        parser.add_argument(
+                "--output",
+                "-o",
+                default="-",
+                help="File the priced stays are written to, standard output by default"
+        )
+        parser.add_argument(
+                "--format",
+                choices=stay_formats,
+                help="Format of the stays and output, by default ndjson for .ndjson and .jsonl files, otherwise csv"
+        )
+        parser.add_argument(
+                "--mode",
+                choices=query_modes,
+                default=settings.PARKING_QUERY_MODE,
+                help="As for /park/query, PARKING_QUERY_MODE by default"
+        )
+        parser.add_argument(
+                "--rates",
+                help="Rates document to price with, JSON or, for .ndjson files, NDJSON, rather than the server's rates"
+        )
+        parser.add_argument(
+                "--processes",
+                type=int,
+                default=os.cpu_count(),
+                help="Worker processes, one per CPU by default"
+        )
+
+    def handle(self, *args, **options):
+        rates = self._rates(options["rates"])
+        format = options["format"] or stays_format(options["stays"])
+        if options["processes"] < 1:
+            raise CommandError("--processes must be at least 1")
+
+        stays = sys.stdin if options["stays"] == "-" else open(options["stays"], encoding="utf-8", newline="")
+        try:
+            output = sys.stdout if options["output"] == "-" else open(options["output"], "w", encoding="utf-8", newline="")
+            try:
+                summary = price_stays(
+                        stays,
+                        output,
+                        rates,
+                        format,
+                        options["mode"],
+                        options["processes"],
+                        self._progress
+                )
+            finally:
+                if output is not sys.stdout:
+                    output.close()
+        finally:
+            if stays is not sys.stdin:
+                stays.close()
+
+        self._progress(summary)
+        self.stderr.write(
+                f"{summary.unavailable} stays unavailable, {summary.invalid} invalid, "
+                f"{max_rss_mb(resource.RUSAGE_CHILDREN):.0f} MB max RSS per worker"
+        )
+
+    def _rates(self, path: str):
+        if path is None:
+            if not ParkingRates.rates_loaded():
+                raise CommandError("No parking rates loaded, load them with PUT /park/rates or pass --rates")
+            return ParkingRates.snapshot.rates
+
+        try:
+            with open(path, "rb") as f:
+                format = "ndjson" if path.endswith(".ndjson") else "json"
+                snapshot = ParkingRates.compile_rate_stream(iter_rates(f, format), compile_index=False)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Failed to load rates from {path}: {e}")
+        return snapshot.rates
+
+    def _progress(self, summary: PricingSummary) -> None:
+        self.stderr.write(
+                f"{summary.stays} stays in {summary.seconds:.1f} s, {summary.stays_per_second:.0f} stays/s, "
+                f"{max_rss_mb(resource.RUSAGE_SELF):.0f} MB max RSS"
+        )
+
+
+def stays_format(path: str) -> str:
+    return "ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv"
+
+
+def max_rss_mb(who: int) -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024
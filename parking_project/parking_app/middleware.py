@@ -0,0 +1,163 @@
+import asyncio
+from time import perf_counter, time
+from typing import Iterator
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed, RequestDataTooBig
+from django.http import HttpRequest, HttpResponse
+from django.utils.decorators import sync_and_async_middleware
+
+from parking_app.lib.capture import (
+        BodyCopy,
+        CaptureFile,
+        body_digest,
+        body_hash,
+        captured_headers,
+        changing_methods,
+        encode_body
+)
+
+
+@sync_and_async_middleware
+def traffic_capture_middleware(get_response):
+    """
+    Capture sampled query and rates requests, along with their responses and
+    how long they took, to the CaptureFile at PARKING_CAPTURE_FILE, sampling
+    queries at PARKING_CAPTURE_SAMPLE.  Unused unless PARKING_CAPTURE_FILE is
+    set, so requests are not slowed when not capturing.
+    """
+
+    if not settings.PARKING_CAPTURE_FILE:
+        raise MiddlewareNotUsed()
+    capture = CaptureFile(
+            settings.PARKING_CAPTURE_FILE,
+            settings.PARKING_CAPTURE_SAMPLE,
+            settings.PARKING_CAPTURE_MAX_BODY
+    )
+
+    if asyncio.iscoroutinefunction(get_response):
+        async def middleware(request: HttpRequest) -> HttpResponse:
+            if not capture.wants(request.method, request.path):
+                return await get_response(request)
+            record, copy = request_record(capture, request)
+            began = perf_counter()
+            response = await get_response(request)
+            return capture_response(capture, record, copy, response, began)
+    else:
+        def middleware(request: HttpRequest) -> HttpResponse:
+            if not capture.wants(request.method, request.path):
+                return get_response(request)
+            record, copy = request_record(capture, request)
+            began = perf_counter()
+            response = get_response(request)
+            return capture_response(capture, record, copy, response, began)
+
+    return middleware
+
+
+def request_record(capture: CaptureFile, request: HttpRequest) -> tuple[dict, BodyCopy]:
+    # The record of the request, and the BodyCopy its body is copied with if
+    # it is copied to a file
+    record = {
+        "time": time(),
+        "method": request.method,
+        "path": request.path,
+        "query": request.META.get("QUERY_STRING", ""),
+    }
+    headers = {name: request.headers[name] for name in captured_headers if name in request.headers}
+    if headers:
+        record["headers"] = headers
+    if request.method == "GET":
+        return (record, None)
+
+    # Bodies are only read ahead of the view if small, so large rates
+    # documents are still streamed from the request
+    body = None
+    try:
+        if int(request.META.get("CONTENT_LENGTH") or -1) in range(capture.max_body + 1):
+            body = request.body
+    except (ValueError, RequestDataTooBig):
+        pass
+    if body is not None:
+        encode_body(record, "body", body)
+        return (record, None)
+
+    # Rates changes are always captured whole, so a replay prices the queries
+    # after them with the same rates.  Their bodies are copied to a file as
+    # the view reads them, through the stream HttpRequest reads from.
+    #
+    # That stream is the private _stream of Django 3.1, pinned in the Pipfile,
+    # which HttpRequest.read, readline and body read from.  WSGIRequest sets it
+    # to a LimitedStream over wsgi.input, and ASGIRequest to the file the body
+    # was received into, both before any middleware runs, so wsgi.input or the
+    # ASGI body can't be wrapped instead.  Should a Django upgrade drop it, the
+    # body is left out as for other large bodies, and replay refuses the
+    # capture rather than replaying it without the change.
+    if request.method in changing_methods and hasattr(request, "_stream"):
+        record["body_file"], file = capture.body_file()
+        copy = request._stream = BodyCopy(request._stream, file)
+        return (record, copy)
+    record["body_omitted"] = True
+    return (record, None)
+
+
+def capture_response(
+        capture: CaptureFile,
+        record: dict,
+        copy: BodyCopy,
+        response: HttpResponse,
+        began: float
+) -> HttpResponse:
+    # A streamed response is captured once it has been sent, timed to the
+    # end of the stream
+    if copy is not None:
+        copy.close()
+    if response.streaming:
+        response.streaming_content = captured_stream(
+                capture,
+                record,
+                response.status_code,
+                response.streaming_content,
+                began
+        )
+    else:
+        body = response.content
+        finish_record(capture, record, response.status_code, body_digest(body), body, began)
+    return response
+
+
+def captured_stream(
+        capture: CaptureFile,
+        record: dict,
+        status: int,
+        content: Iterator[bytes],
+        began: float
+) -> Iterator[bytes]:
+    # The body is only kept while it is small enough to store
+    digest = body_hash()
+    chunks = []
+    size = 0
+    for chunk in content:
+        digest.update(chunk)
+        size += len(chunk)
+        if size <= capture.max_body:
+            chunks.append(chunk)
+        yield chunk
+    body = b"".join(chunks) if size <= capture.max_body else None
+    finish_record(capture, record, status, digest.hexdigest(), body, began)
+
+
+def finish_record(
+        capture: CaptureFile,
+        record: dict,
+        status: int,
+        digest: str,
+        body: bytes,
+        began: float
+) -> None:
+    record["duration_us"] = round((perf_counter() - began) * 1e6, 1)
+    record["status"] = status
+    record["response_digest"] = digest
+    if body is not None and len(body) <= capture.max_body:
+        encode_body(record, "response", body)
+    capture.write(record)
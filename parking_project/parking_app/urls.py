@@ -1,11 +1,23 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
-from .views import ParkingQueryView, ParkingRatesView
+if settings.PARKING_ASYNC_VIEWS:
+    from . import async_views as views
+else:
+    from . import views
 
 urlpatterns = [
-    path('query', ParkingQueryView.as_view(), name='parking_query'),
-    path('rates', ParkingRatesView.as_view(), name='parking_rates'),
+    path('query', views.ParkingQueryView.as_view(), name='parking_query'),
+    path('query/batch', views.ParkingBatchQueryView.as_view(), name='parking_query_batch'),
+    path('query/range', views.ParkingRangeQueryView.as_view(), name='parking_query_range'),
+    path('availability', views.ParkingAvailabilityView.as_view(), name='parking_availability'),
+    path('rates', views.ParkingRatesView.as_view(), name='parking_rates'),
     path('ready', views.ready, name='ready'),
-    path('health', views.health, name='health')
+    path('health', views.health, name='health'),
+    path('metrics', views.metrics, name='metrics'),
+    path('<slug:facility>/query', views.ParkingQueryView.as_view(), name='facility_query'),
+    path('<slug:facility>/query/batch', views.ParkingBatchQueryView.as_view(), name='facility_query_batch'),
+    path('<slug:facility>/query/range', views.ParkingRangeQueryView.as_view(), name='facility_query_range'),
+    path('<slug:facility>/availability', views.ParkingAvailabilityView.as_view(), name='facility_availability'),
+    path('<slug:facility>/rates', views.ParkingRatesView.as_view(), name='facility_rates')
 ]
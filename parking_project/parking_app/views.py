@@ -1,10 +1,115 @@
+from datetime import datetime
+import json
 import logging
+from time import perf_counter
 
-from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.generic import View
 
-from parking_app.lib.rates import ParkingRates
-from parking_app.lib.validator import validate_get_parking, validate_put_parking
+from parking_app.lib.availability import rank_windows
+from parking_app.lib.etags import etag_matches, query_etag
+from parking_app.lib.facilities import facilities, facility_pattern
+from parking_app.lib.metrics import Counter, Histogram, registry, text_content_type
+from parking_app.lib.ingest import iter_rates, ndjson_content_types, stream_format
+from parking_app.lib.rates import ConflictingRates, InvalidRates, ParkingRates
+from parking_app.lib.timestamp import epoch_microseconds
+from parking_app.lib.validator import (
+        validate_flag,
+        validate_get_availability,
+        validate_get_parking_range,
+        validate_get_parking_timestamps,
+        validate_page,
+        validate_patch_parking,
+        validate_post_batch,
+        validate_query_mode
+)
+
+
+parse_seconds = registry.register(Histogram(
+        "parking_query_parse_seconds",
+        "Time to validate the start and end of a query."
+))
+lookup_seconds = registry.register(Histogram(
+        "parking_query_lookup_seconds",
+        "Time to price a query, including the cache lookup."
+))
+queries_total = registry.register(Counter(
+        "parking_queries_total",
+        "Queries priced, counting each item of a batch."
+))
+unavailable_total = registry.register(Counter(
+        "parking_queries_unavailable_total",
+        "Queries priced as unavailable, counting each item of a batch."
+))
+not_modified_total = registry.register(Counter(
+        "parking_queries_not_modified_total",
+        "Queries, range queries and availability searches answered 304 Not Modified, without pricing them."
+))
+
+# Items a batch query may price.  A batch is priced at once, on the event loop
+# under ASGI, so it is kept to a few milliseconds of pricing.
+max_batch_items = 1000
+
+# Slots a range query may return in one JSON response, and when streamed as
+# newline delimited JSON.  Streamed slots are priced as they are sent, on the
+# event loop under ASGI, so a stream is kept to under a second or so of
+# pricing rather than holding up every other request of the worker.
+max_range_slots = 10000
+max_stream_slots = 100000
+
+
+def get_rates(facility: str = None, create: bool = False):
+    """
+    Get the rates requests are served from: ParkingRates, or for a URL with a
+    facility the FacilityRates of that facility.
+
+    Args:
+        facility: Facility name from the URL, None for the default rates
+        create: As for FacilityRegistry.get
+
+    Returns:
+        The rates, None if the facility is not valid or has no rates and
+        create is false.
+    """
+
+    if facility is None:
+        return ParkingRates
+    try:
+        return facilities.get(facility, create)
+    except ValueError:
+        return None
+
+
+def unknown_facility(facility: str) -> JsonResponse:
+    return JsonResponse({"error": f"Unknown facility {facility}"}, status=404)
+
+
+def not_modified(request: HttpRequest, etag: str) -> bool:
+    """
+    Check whether the client already has the response with an entity tag,
+    so it can be answered 304 Not Modified without pricing the query.
+    """
+
+    if_none_match = request.headers.get("If-None-Match")
+    return if_none_match is not None and etag_matches(if_none_match, etag)
+
+
+def cache_headers(response: HttpResponse, etag: str) -> HttpResponse:
+    """
+    Add the headers letting clients and shared caches reuse a query response
+    until the rates change: its ETag and PARKING_QUERY_MAX_AGE.  There is no
+    Last-Modified, as each worker loads the rates at its own time and would
+    send a different one for the same response.
+
+    Args:
+        response: The query response, or a 304 response
+        etag: Entity tag of the response, see query_etag
+    """
+
+    response["ETag"] = etag
+    response["Cache-Control"] = f"public, max-age={settings.PARKING_QUERY_MAX_AGE}"
+    return response
 
 
 class ParkingQueryView(View):
@@ -14,7 +119,10 @@ class ParkingQueryView(View):
         super(ParkingQueryView, self).__init__(*args, **kwargs)
 
     def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
-        if not ParkingRates.rates_loaded():
+        rates = get_rates(kwargs.get("facility"))
+        if rates is None:
+            return unknown_facility(kwargs["facility"])
+        if not rates.rates_loaded():
             self.logger.error("Unable to process query, parking rates not yet loaded.")
             return JsonResponse(
                     {"error": "Parking rates not yet loaded"},
@@ -29,7 +137,9 @@ class ParkingQueryView(View):
             )
 
         try:
-            start, end = validate_get_parking(start_arg, end_arg)
+            began = perf_counter()
+            start, end = validate_get_parking_timestamps(start_arg, end_arg)
+            parse_seconds.observe(perf_counter() - began)
         except Exception as e:
             self.logger.error(f"Failed to validate query string parameters: {e}")
             return JsonResponse(
@@ -37,11 +147,257 @@ class ParkingQueryView(View):
                     status=400
             )
 
-        price = ParkingRates.get_rate_price(start, end)
+        try:
+            mode = validate_query_mode(request.GET.get("mode", settings.PARKING_QUERY_MODE))
+        except Exception as e:
+            self.logger.error(f"Failed to validate query string parameters: {e}")
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # The rates are read once and both tag and price the response, so it
+        # is always priced from the rates its tag names, even if others are
+        # published meanwhile
+        snapshot = rates.get_snapshot()
+        etag = query_etag(snapshot.version, epoch_microseconds(start), epoch_microseconds(end), mode)
+        if not_modified(request, etag):
+            not_modified_total.inc()
+            return cache_headers(HttpResponse(status=304), etag)
+
+        began = perf_counter()
+        price = rates.get_rate_price(start, end, mode, snapshot)
+        lookup_seconds.observe(perf_counter() - began)
 
+        queries_total.inc()
         if price == None:
+            unavailable_total.inc()
             price = "unavailable"
-        return JsonResponse({"rate": price})
+        return cache_headers(JsonResponse({"rate": price}), etag)
+
+
+class ParkingBatchQueryView(View):
+
+    def __init__(self, *args, **kwargs):
+        self.logger = logging.getLogger(ParkingBatchQueryView.__name__)
+        super(ParkingBatchQueryView, self).__init__(*args, **kwargs)
+
+    def post(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        rates = get_rates(kwargs.get("facility"))
+        if rates is None:
+            return unknown_facility(kwargs["facility"])
+        if not rates.rates_loaded():
+            self.logger.error("Unable to process batch query, parking rates not yet loaded.")
+            return JsonResponse(
+                    {"error": "Parking rates not yet loaded"},
+                    status=503
+            )
+
+        try:
+            mode = validate_query_mode(request.GET.get("mode", settings.PARKING_QUERY_MODE))
+        except Exception as e:
+            self.logger.error(f"Failed to validate query string parameters: {e}")
+            return JsonResponse({"error": str(e)}, status=400)
+
+        try:
+            items = validate_post_batch(request.body, max_batch_items)
+        except Exception as e:
+            self.logger.error(f"Failed to load request body: {e}")
+            return JsonResponse(
+                    {"error": f"Invalid JSON in body: {e}"},
+                    status=400
+            )
+
+        # Validate each item on its own so one bad item doesn't fail the batch
+        results = [None] * len(items)
+        spans = []
+        positions = []
+        for i, item in enumerate(items):
+            start_arg = item.get("start")
+            end_arg = item.get("end")
+            if type(start_arg) != str or type(end_arg) != str:
+                results[i] = {"error": "start and end fields missing"}
+                continue
+            try:
+                spans.append(validate_get_parking_timestamps(start_arg, end_arg))
+            except Exception as e:
+                results[i] = {"error": f"Invalid start/end dates: {e}"}
+                continue
+            positions.append(i)
+
+        prices = rates.get_rate_prices(spans, mode)
+        queries_total.inc(len(prices))
+        for i, price in zip(positions, prices):
+            if price == None:
+                unavailable_total.inc()
+                price = "unavailable"
+            results[i] = {"rate": price}
+
+        return JsonResponse({"results": results})
+
+
+class ParkingRangeQueryView(View):
+
+    def __init__(self, *args, **kwargs):
+        self.logger = logging.getLogger(ParkingRangeQueryView.__name__)
+        super(ParkingRangeQueryView, self).__init__(*args, **kwargs)
+
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        rates = get_rates(kwargs.get("facility"))
+        if rates is None:
+            return unknown_facility(kwargs["facility"])
+        if not rates.rates_loaded():
+            self.logger.error("Unable to process range query, parking rates not yet loaded.")
+            return JsonResponse(
+                    {"error": "Parking rates not yet loaded"},
+                    status=503
+            )
+        start_arg = request.GET.get("start")
+        end_arg = request.GET.get("end")
+        slot_arg = request.GET.get("slot")
+        if None in [start_arg, end_arg, slot_arg]:
+            return JsonResponse(
+                    {"error": "start, end and slot URL parameters missing"},
+                    status=400
+            )
+
+        accept = request.headers.get("Accept", "")
+        stream = any(content_type in accept for content_type in ndjson_content_types)
+        try:
+            start, end, slot = validate_get_parking_range(
+                    start_arg,
+                    end_arg,
+                    slot_arg,
+                    max_stream_slots if stream else max_range_slots
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to validate query string parameters: {e}")
+            return JsonResponse(
+                    {"error": f"Invalid start/end dates or slot: {e}"},
+                    status=400
+            )
+
+        try:
+            mode = validate_query_mode(request.GET.get("mode", settings.PARKING_QUERY_MODE))
+        except Exception as e:
+            self.logger.error(f"Failed to validate query string parameters: {e}")
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Slot times are given in the UTC offset of the requested start, so
+        # the offset is part of the window, as is the response format.  The
+        # rates are read once, as for ParkingQueryView.
+        snapshot = rates.get_snapshot()
+        etag = query_etag(
+                snapshot.version,
+                epoch_microseconds(start),
+                epoch_microseconds(end),
+                start.parsed.utcoffset(),
+                slot,
+                mode,
+                stream
+        )
+        if not_modified(request, etag):
+            not_modified_total.inc()
+            response = cache_headers(HttpResponse(status=304), etag)
+            response["Vary"] = "Accept"
+            return response
+
+        slots = self._slots(start.parsed, end.parsed, slot, rates.get_rate_price_range(start, end, slot, mode, snapshot))
+        if stream:
+            response = StreamingHttpResponse(
+                    (json.dumps(item) + "\n" for item in slots),
+                    content_type="application/x-ndjson"
+            )
+        else:
+            response = JsonResponse({"slots": list(slots)})
+        response["Vary"] = "Accept"
+        return cache_headers(response, etag)
+
+    @staticmethod
+    def _slots(start, end, slot, prices):
+        # Slot times are given in the UTC offset of the requested start
+        slot_start = start
+        for price in prices:
+            slot_end = min(slot_start + slot, end)
+            queries_total.inc()
+            if price == None:
+                unavailable_total.inc()
+                price = "unavailable"
+            yield {"start": slot_start.isoformat(), "end": slot_end.isoformat(), "rate": price}
+            slot_start = slot_end
+
+
+class ParkingAvailabilityView(View):
+
+    def __init__(self, *args, **kwargs):
+        self.logger = logging.getLogger(ParkingAvailabilityView.__name__)
+        super(ParkingAvailabilityView, self).__init__(*args, **kwargs)
+
+    def get(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        rates = get_rates(kwargs.get("facility"))
+        if rates is None:
+            return unknown_facility(kwargs["facility"])
+        if not rates.rates_loaded():
+            self.logger.error("Unable to process availability search, parking rates not yet loaded.")
+            return JsonResponse(
+                    {"error": "Parking rates not yet loaded"},
+                    status=503
+            )
+        start_arg = request.GET.get("start")
+        end_arg = request.GET.get("end")
+        duration_arg = request.GET.get("duration")
+        tz_arg = request.GET.get("tz")
+        if None in [start_arg, end_arg, duration_arg, tz_arg]:
+            return JsonResponse(
+                    {"error": "start, end, duration and tz URL parameters missing"},
+                    status=400
+            )
+
+        try:
+            start, end, duration = validate_get_availability(start_arg, end_arg, duration_arg, tz_arg)
+        except Exception as e:
+            self.logger.error(f"Failed to validate query string parameters: {e}")
+            return JsonResponse(
+                    {"error": f"Invalid start/end dates, duration or tz: {e}"},
+                    status=400
+            )
+
+        try:
+            mode = validate_query_mode(request.GET.get("mode", settings.PARKING_QUERY_MODE))
+            limit, offset = validate_page(request.GET.get("limit", "10"), request.GET.get("offset", "0"))
+        except Exception as e:
+            self.logger.error(f"Failed to validate query string parameters: {e}")
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # The rates are read once, as for ParkingQueryView
+        snapshot = rates.get_snapshot()
+        etag = query_etag(
+                snapshot.version,
+                epoch_microseconds(start),
+                epoch_microseconds(end),
+                duration,
+                start.tzinfo.zone,
+                mode,
+                limit,
+                offset
+        )
+        if not_modified(request, etag):
+            not_modified_total.inc()
+            return cache_headers(HttpResponse(status=304), etag)
+
+        windows, total = rank_windows(rates.get_available_windows(start, end, duration, mode, snapshot), offset, limit)
+        # Start times are given in the timezone searched
+        response = JsonResponse({
+            "windows": [
+                {
+                    "earliest_start": datetime.fromtimestamp(window.first * 60, start.tzinfo).isoformat(),
+                    "latest_start": datetime.fromtimestamp(window.last * 60, start.tzinfo).isoformat(),
+                    "rate": window.price
+                }
+                for window in windows
+            ],
+            "total": total,
+            "offset": offset,
+            "limit": limit
+        })
+        return cache_headers(response, etag)
 
 
 class ParkingRatesView(View):
@@ -50,14 +406,41 @@ class ParkingRatesView(View):
         self.logger = logging.getLogger(ParkingRatesView.__name__)
         super(ParkingRatesView, self).__init__(*args, **kwargs)
     def put(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
-        # Return 201 if data has not been set, 200 otherwise
-        if not ParkingRates.rates_loaded():
-            return_status = 201
-        else:
-            return_status = 200
+        facility = kwargs.get("facility")
+        if facility is not None and not facility_pattern.fullmatch(facility):
+            return JsonResponse(
+                    {"error": f"Invalid facility {facility}, must be 1 to 64 letters, digits, - or _"},
+                    status=400
+            )
 
         try:
-            rates_dict = validate_put_parking(request.body)
+            strict = validate_flag("strict", request.GET.get("strict", settings.PARKING_RATES_STRICT))
+        except ValueError as e:
+            return JsonResponse({"error": str(e)}, status=400)
+
+        # Rates are read, validated and compiled as the body streams in, and
+        # compiled fully before publishing so queries in progress are
+        # unaffected.  A new facility is only created once its rates are
+        # compiled, so invalid rates leave no facility behind.
+        try:
+            rates = iter_rates(
+                    request,
+                    stream_format(request.content_type),
+                    request.headers.get("Content-Encoding", "").lower()
+            )
+            snapshot = (get_rates(facility) or ParkingRates).compile_rate_stream(rates, strict=strict)
+        except InvalidRates as e:
+            self.logger.error(f"Error loading rates objects: {e}")
+            return JsonResponse(
+                    {"error": f"Invalid field in rates: {e}. Parking rates not updated.", "errors": e.errors},
+                    status=400
+            )
+        except ConflictingRates as e:
+            self.logger.error(f"Conflicting rates: {e}")
+            return JsonResponse(
+                    {"error": f"Conflicting rates: {e}. Parking rates not updated.", "overlaps": e.overlaps.to_dict()},
+                    status=409
+            )
         except Exception as e:
             self.logger.error(f"Failed to load request body: {e}")
             return JsonResponse(
@@ -65,16 +448,79 @@ class ParkingRatesView(View):
                     status=400
             )
 
+        # New rates don't depend on the rates in use, so only publishing waits
+        # for rate changes being applied, in this or another worker process,
+        # which then either apply to these rates or are replaced by them.
+        # Slow uploads don't hold up changes.
+        parking_rates = get_rates(facility, create=True)
+        with parking_rates.changing():
+            # Return 201 if data has not been set, 200 otherwise
+            if not parking_rates.rates_loaded():
+                return_status = 201
+            else:
+                return_status = 200
+
+            try:
+                parking_rates.publish(snapshot)
+            except Exception as e:
+                self.logger.error(f"Error publishing rates: {e}")
+                return JsonResponse(
+                        {"error": f"Failed to store rates: {e}. Parking rates not updated."},
+                        status=500
+                )
+
+        return JsonResponse({"overlaps": snapshot.overlaps.to_dict()}, status=return_status)
+
+    def patch(self, request: HttpRequest, *args, **kwargs) -> HttpResponse:
+        rates = get_rates(kwargs.get("facility"))
+        if rates is None:
+            return unknown_facility(kwargs["facility"])
+        if not rates.rates_loaded():
+            self.logger.error("Unable to apply rate changes, parking rates not yet loaded.")
+            return JsonResponse(
+                    {"error": "Parking rates not yet loaded"},
+                    status=503
+            )
+
         try:
-            ParkingRates.load_rates(rates_dict)
+            changes = validate_patch_parking(request.body)
         except Exception as e:
-            self.logger.error(f"Error loading rates objects: {e}")
+            self.logger.error(f"Failed to load request body: {e}")
             return JsonResponse(
-                    {"error": f"Invalid field in rates: {e}. Parking rates not updated."},
+                    {"error": f"Invalid JSON in body: {e}. Parking rates not updated."},
                     status=400
             )
 
-        return HttpResponse("", status=return_status)
+        # Changes are applied to the rates in use, so concurrent changes, and
+        # new rates, are published one after another by every worker process
+        # rather than a change being published over rates published since it
+        # was applied
+        with rates.changing():
+            try:
+                snapshot = rates.patch_rates(changes)
+            except InvalidRates as e:
+                self.logger.error(f"Error applying rate changes: {e}")
+                return JsonResponse(
+                        {"error": f"Invalid rate change: {e}. Parking rates not updated.", "errors": e.errors},
+                        status=400
+                )
+            except Exception as e:
+                self.logger.error(f"Error applying rate changes: {e}")
+                return JsonResponse(
+                        {"error": f"Invalid rate changes: {e}. Parking rates not updated."},
+                        status=400
+                )
+
+            try:
+                rates.publish(snapshot)
+            except Exception as e:
+                self.logger.error(f"Error publishing rates: {e}")
+                return JsonResponse(
+                        {"error": f"Failed to store rates: {e}. Parking rates not updated."},
+                        status=500
+                )
+
+        return HttpResponse("", status=200)
 
 
 def ready(request: HttpRequest) -> HttpResponse:
@@ -83,9 +529,16 @@ def ready(request: HttpRequest) -> HttpResponse:
 
 def health(request: HttpRequest) -> HttpResponse:
     if ParkingRates.rates_loaded():
-        return JsonResponse({"status": "Healthy"}, status=200)
+        return JsonResponse(
+                {"status": "Healthy", "cache": ParkingRates.cache_stats()},
+                status=200
+        )
     else:
         return JsonResponse(
                 {"status": "Unhealthy", "details": "parking rates not available"},
                 status=503
         )
+
+
+def metrics(request: HttpRequest) -> HttpResponse:
+    return HttpResponse(registry.render(), content_type=text_content_type)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -39,9 +40,11 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'parking_app.apps.ParkingAppConfig',
 ]
 
 MIDDLEWARE = [
+    'parking_app.middleware.traffic_capture_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -145,3 +148,58 @@ LOGGING = {
         'level': 'INFO'
     }
 }
+
+# Compiled rate table shared by all worker processes.  When unset rates are
+# held only by the process that received them.
+PARKING_RATES_TABLE = os.environ.get('PARKING_RATES_TABLE')
+
+# Last accepted rates document, loaded when the server starts.  Set to an
+# empty string to disable.
+PARKING_RATES_STORE = os.environ.get('PARKING_RATES_STORE', BASE_DIR / 'parking_rates.json')
+
+# Directory the rates of each facility, served under /park/<facility>/, are
+# stored in and loaded from when the facility is first requested.  Set to an
+# empty string to keep facility rates in memory only.
+PARKING_FACILITIES_STORE = os.environ.get('PARKING_FACILITIES_STORE', BASE_DIR / 'facilities')
+
+# Estimated memory in bytes the compiled rate indexes of all facilities may
+# take together.  Beyond it the indexes of the least recently queried
+# facilities are dropped, and compiled again when next queried.
+PARKING_FACILITIES_MEMORY = int(os.environ.get('PARKING_FACILITIES_MEMORY', 512 * 1024 * 1024))
+
+# Reject rates documents with rates overlapping at different prices, rather
+# than pricing them by whichever rate comes first.  Overridden per request with
+# the strict query parameter of PUT /park/rates.
+PARKING_RATES_STRICT = os.environ.get('PARKING_RATES_STRICT') == '1'
+
+# Default pricing of time ranges not contained in a single rate, overridden
+# per request with the mode query parameter.  "single" prices only ranges
+# inside one rate, "sum" sums the prices of adjacent rates covering the range.
+PARKING_QUERY_MODE = os.environ.get('PARKING_QUERY_MODE', 'single')
+
+# Seconds clients and shared caches may reuse a query response without
+# revalidating it.  Responses carry an ETag changing with the rates, so with
+# the default of 0 every reuse is revalidated, answered 304 Not Modified if the
+# rates are unchanged; a higher value serves responses up to that stale after
+# rates change.
+PARKING_QUERY_MAX_AGE = int(os.environ.get('PARKING_QUERY_MAX_AGE', 0))
+
+# JSON lines file sampled /park/query and /park/rates traffic is appended to,
+# for replaying with benchmarks/replay.py.  Unset to not capture traffic.
+# Rates changes are always captured, queries at the PARKING_CAPTURE_SAMPLE
+# fraction, and request and response bodies larger than
+# PARKING_CAPTURE_MAX_BODY bytes are left out, but for the bodies of rates
+# changes, which are copied to files beside the capture file.
+PARKING_CAPTURE_FILE = os.environ.get('PARKING_CAPTURE_FILE')
+PARKING_CAPTURE_SAMPLE = float(os.environ.get('PARKING_CAPTURE_SAMPLE', 0.01))
+PARKING_CAPTURE_MAX_BODY = int(os.environ.get('PARKING_CAPTURE_MAX_BODY', 1024 * 1024))
+
+# Engine used to look up rates.  "index" searches the compiled index of each
+# timezone, "table" uses precomputed lookup tables for queries between the
+# first and last years of PARKING_RATES_TABLE_HORIZON.
+PARKING_RATES_ENGINE = os.environ.get('PARKING_RATES_ENGINE', 'index')
+PARKING_RATES_TABLE_HORIZON = (1970, 2037)
+
+# Serve the async views, running rates updates in a thread pool.  Set by
+# asgi.py, the synchronous views are used under WSGI and runserver.
+PARKING_ASYNC_VIEWS = os.environ.get('PARKING_ASYNC_VIEWS') == '1'
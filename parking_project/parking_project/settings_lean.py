@@ -0,0 +1,35 @@
+"""
+Lean Django settings for serving the parking API.
+
+Boots only what parking_app needs.  The admin, auth, sessions, messages and
+static files apps are not installed, so requests skip their middleware, and
+there are no templates, database or translations.  Select with
+DJANGO_SETTINGS_MODULE=parking_project.settings_lean.
+"""
+
+from parking_project.settings import *
+
+
+DEBUG = False
+
+INSTALLED_APPS = [
+    'parking_app.apps.ParkingAppConfig',
+]
+
+MIDDLEWARE = [
+    'parking_app.middleware.traffic_capture_middleware',
+    'django.middleware.security.SecurityMiddleware',
+    'django.middleware.common.CommonMiddleware',
+]
+
+# The API's URLs have no trailing slash, so appending one would only cost
+# every request a second URL resolution
+APPEND_SLASH = False
+
+TEMPLATES = []
+
+DATABASES = {}
+
+AUTH_PASSWORD_VALIDATORS = []
+
+USE_I18N = False
@@ -13,10 +13,14 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
+from django.apps import apps
 from django.urls import include, path
 
 urlpatterns = [
     path('park/', include('parking_app.urls')),
-    path('admin/', admin.site.urls),
 ]
+
+# The admin isn't installed by the lean settings
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+    urlpatterns.append(path('admin/', admin.site.urls))
@@ -0,0 +1,13 @@
+import os
+
+import django
+
+
+# Views are tested with the lean settings, keeping rates in memory so tests
+# never load or replace the rates stored in the project
+os.environ['DJANGO_SETTINGS_MODULE'] = 'parking_project.settings_lean'
+os.environ['PARKING_RATES_STORE'] = ''
+os.environ['PARKING_FACILITIES_STORE'] = ''
+for name in ('PARKING_RATES_TABLE', 'PARKING_CAPTURE_FILE', 'PARKING_ASYNC_VIEWS'):
+    os.environ.pop(name, None)
+django.setup()
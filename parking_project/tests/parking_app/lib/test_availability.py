@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+import random
+
+import pytest
+
+from parking_app.lib.availability import Window, find_windows, rank_windows
+from parking_app.lib.index import RateIndex
+from parking_app.lib.rates import ParkingRates, Rate
+from parking_app.lib.timestamp import epoch_microseconds
+from parking_app.lib.timezones import MICROSECONDS_PER_MINUTE
+
+
+rates = [
+    Rate('mon,tues,thurs', '0900-2100', 'America/Chicago', 1500),
+    Rate('fri,sat,sun', '0900-2100', 'America/Chicago', 2000),
+    Rate('sun', '0000-0900', 'America/Chicago', 700),
+    Rate('sat,sun', '2100-0300', 'America/Chicago', 1200),
+    Rate('mon,wed', '0800-2200', 'America/New_York', 3000),
+    Rate('tues', '0000-2359', 'Asia/Kolkata', 500),
+    Rate('wed', '1000-1400', 'UTC', 400),
+]
+
+
+def random_rates(generator: random.Random) -> list[Rate]:
+    days = ['mon', 'tues', 'wed', 'thurs', 'fri', 'sat', 'sun']
+    random_rates = []
+    for _ in range(30):
+        start, end = generator.sample(range(0, 24 * 60, 5), 2)
+        random_rates.append(Rate(
+                ','.join(generator.sample(days, generator.randint(1, 4))),
+                f'{start // 60:02}{start % 60:02}-{end // 60:02}{end % 60:02}',
+                generator.choice(['America/Chicago', 'Europe/London']),
+                generator.randint(1, 20) * 100
+        ))
+    return random_rates
+
+
+def expand(windows: list[Window]) -> dict[int, int]:
+    return {minute: window.price for window in windows for minute in range(window.first, window.last + 1)}
+
+
+class TestFindWindows:
+    @pytest.mark.parametrize('mode', ['single', 'sum', 'span'])
+    @pytest.mark.parametrize('first_day,seed', [
+        ('2020-03-07T18:00:00+00:00', 1),   # Daylight saving time starts in Chicago
+        ('2020-10-24T18:00:00+00:00', 2),   # Daylight saving time ends in London
+        ('2020-07-01T00:00:00+00:00', 3),
+    ])
+    def test_matches_find(self, mode, first_day, seed):
+        index = RateIndex([rate.to_record() for rate in rates + random_rates(random.Random(seed))])
+        start = epoch_microseconds(datetime.fromisoformat(first_day)) + 30 * 1000000
+        end = start + 2 * 24 * 60 * MICROSECONDS_PER_MINUTE
+
+        for duration in (45, 180, 1500):
+            windows = list(find_windows(index, start, end, duration, mode))
+            found = expand(windows)
+            first = -(-start // MICROSECONDS_PER_MINUTE)
+            for minute in range(first, end // MICROSECONDS_PER_MINUTE - duration + 1):
+                price = index.find_microseconds(
+                        minute * MICROSECONDS_PER_MINUTE,
+                        (minute + duration) * MICROSECONDS_PER_MINUTE,
+                        mode
+                )
+                assert found.get(minute) == price
+
+            # Windows are in time order, and adjacent windows differ in price
+            for window, following in zip(windows, windows[1:]):
+                assert window.last < following.first
+                assert window.last + 1 < following.first or window.price != following.price
+
+    def test_offset_change_at_end(self):
+        # Stays ending in the hour skipped when daylight saving time starts
+        # end an hour later, past the end of the first rate
+        index = RateIndex([
+            Rate('sun', '0100-0230', 'America/Chicago', 300).to_record(),
+            Rate('sun', '0000-0900', 'America/Chicago', 700).to_record(),
+        ])
+        start = epoch_microseconds(datetime.fromisoformat('2020-03-08T00:00:00-06:00'))
+        windows = list(find_windows(index, start, start + 6 * 60 * MICROSECONDS_PER_MINUTE, 45))
+
+        minute = start // MICROSECONDS_PER_MINUTE
+        assert windows == [
+            Window(minute, minute + 59, 700),
+            Window(minute + 60, minute + 74, 300),
+            Window(minute + 75, minute + 6 * 60 - 45, 700),
+        ]
+
+    def test_range_shorter_than_stay(self):
+        index = RateIndex([rate.to_record() for rate in rates])
+        start = epoch_microseconds(datetime(2020, 7, 1, tzinfo=timezone.utc))
+        assert list(find_windows(index, start, start + 60 * MICROSECONDS_PER_MINUTE, 90)) == []
+
+
+class TestRankWindows:
+    windows = [Window(0, 9, 500), Window(20, 29, 300), Window(40, 49, 500), Window(60, 69, 100)]
+
+    def test_rank(self):
+        ranked, total = rank_windows(iter(self.windows), 0, 3)
+        assert ranked == [self.windows[3], self.windows[1], self.windows[0]]
+        assert total == 4
+
+    def test_offset(self):
+        ranked, total = rank_windows(iter(self.windows), 2, 5)
+        assert ranked == [self.windows[0], self.windows[2]]
+        assert total == 4
+
+
+class TestGetAvailableWindows:
+    @pytest.mark.parametrize('engine', ['index', 'table'])
+    def test_get_available_windows(self, engine):
+        try:
+            ParkingRates.use_engine(engine)
+            ParkingRates.load_rates({'rates': [
+                {'days': 'fri', 'times': '0900-1200', 'tz': 'America/Chicago', 'price': 1000},
+                {'days': 'fri', 'times': '1200-2100', 'tz': 'America/Chicago', 'price': 1500},
+                {'days': 'fri', 'times': '0600-2100', 'tz': 'America/Chicago', 'price': 2500},
+            ]})
+            start = datetime.fromisoformat('2020-07-03T00:00:00-05:00')
+            windows = list(ParkingRates.get_available_windows(
+                    start,
+                    start + timedelta(days=1),
+                    timedelta(hours=3),
+                    'single'
+            ))
+        finally:
+            ParkingRates.use_engine('index')
+
+        minute = epoch_microseconds(start) // MICROSECONDS_PER_MINUTE
+        assert windows == [
+            Window(minute + 6 * 60, minute + 9 * 60 - 1, 2500),
+            Window(minute + 9 * 60, minute + 9 * 60, 1000),
+            Window(minute + 9 * 60 + 1, minute + 12 * 60 - 1, 2500),
+            Window(minute + 12 * 60, minute + 18 * 60, 1500),
+        ]
@@ -0,0 +1,66 @@
+import io
+import json
+
+import pytest
+
+from parking_app.lib import bulk
+from parking_app.lib.bulk import price_stays
+from parking_app.lib.records import RateArrays, RateRecord
+
+
+rates = RateArrays([
+    RateRecord(0b0001111, 9 * 60, 21 * 60, 'America/Chicago', 1500),
+    RateRecord(0b1110000, 9 * 60, 21 * 60, 'America/Chicago', 2000),
+])
+
+# Wednesday 2015-07-01 is priced at 1500 and Saturday 2015-07-04 at 2000
+stays = [
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T12:00:00-05:00', 'unavailable'),
+    ('2015-07-01T10:00:00-05:00', '2015-07-01T12:00:00-05:00', 1500),
+    ('2015-07-04T15:00:00+00:00', '2015-07-04T20:00:00+00:00', 2000),
+]
+
+
+class TestPriceStays:
+    def test_csv(self, monkeypatch):
+        # Chunks are written in input order however they are priced
+        monkeypatch.setattr(bulk, 'chunk_stays', 2)
+        lines = ['id,end,start\n'] + [f'{i},{end},{start}\n' for i, (start, end, _) in enumerate(stays * 5)]
+        lines.insert(3, '99,2015-07-01T12:00:00-05:00,2015-07-01T12:00:00-05:00\n')
+        lines.insert(5, '\n')
+        output = io.StringIO()
+        summary = price_stays(lines, output, rates, processes=2)
+
+        expected = ['start,end,rate,error']
+        expected += [f'{start},{end},{price},' for start, end, price in stays * 5]
+        expected.insert(3, '2015-07-01T12:00:00-05:00,2015-07-01T12:00:00-05:00,,'
+                'Invalid start/end dates: Start time does not precede end time.')
+        assert output.getvalue().splitlines() == expected
+        assert summary[:3] == (16, 5, 1)
+
+    def test_csv_without_header(self):
+        lines = [f'{start},{end}\n' for start, end, _ in stays] + ['2015-07-01T07:00:00-05:00\n']
+        output = io.StringIO()
+        summary = price_stays(lines, output, rates, processes=1)
+        assert output.getvalue().splitlines()[1:] == (
+            [f'{start},{end},{price},' for start, end, price in stays]
+            + ['2015-07-01T07:00:00-05:00,,,Stay must have a start and end']
+        )
+        assert summary.invalid == 1
+
+    def test_ndjson(self):
+        lines = [json.dumps({'start': start, 'end': end}) + '\n' for start, end, _ in stays] + ['[]\n']
+        output = io.StringIO()
+        progress = []
+        price_stays(lines, output, rates, 'ndjson', 'sum', 1, progress.append, progress_seconds=0)
+        assert [json.loads(line) for line in output.getvalue().splitlines()] == (
+            [{'start': start, 'end': end, 'rate': price} for start, end, price in stays]
+            + [{'start': None, 'end': None, 'error': 'Stay must have a start and end'}]
+        )
+        assert progress[-1].stays == 4
+
+    def test_invalid_options(self):
+        with pytest.raises(ValueError):
+            price_stays([], io.StringIO(), rates, format='xml')
+        with pytest.raises(ValueError):
+            price_stays([], io.StringIO(), rates, mode='all')
@@ -0,0 +1,37 @@
+import pytest
+
+from parking_app.lib.cache import LRUCache
+
+
+class TestLRUCache:
+    def test_get_put(self):
+        cache = LRUCache(maxsize=2)
+        assert cache.get('a', 0) == (False, None)
+        cache.put('a', 0, 1500)
+        cache.put('b', 0, None)
+        assert cache.get('a', 0) == (True, 1500)
+        assert cache.get('b', 0) == (True, None)
+        assert cache.stats() == {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 1, 'evictions': 0}
+
+    def test_eviction(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 0, 1)
+        cache.put('b', 0, 2)
+        cache.get('a', 0)     # b is now least recently used
+        cache.put('c', 0, 3)
+        assert cache.get('b', 0) == (False, None)
+        assert cache.get('a', 0) == (True, 1)
+        assert cache.get('c', 0) == (True, 3)
+        assert cache.evictions == 1
+
+    def test_generation(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 0, 1)
+        assert cache.get('a', 1) == (False, None)
+        # The stale entry is dropped rather than served to the old generation
+        assert cache.get('a', 0) == (False, None)
+        assert cache.stats()['size'] == 0
+
+    def test_init_invalid(self):
+        with pytest.raises(ValueError):
+            LRUCache(maxsize=0)
@@ -0,0 +1,93 @@
+import gzip
+import io
+
+import pytest
+
+from parking_app.lib.capture import (
+        BodyCopy,
+        CaptureFile,
+        body_digest,
+        body_directory,
+        body_hash,
+        decode_body,
+        encode_body,
+        read_captures
+)
+
+
+class TestCaptureFile:
+    @pytest.mark.parametrize('method,path,sample,wanted', [
+        ('GET', '/park/query', 1, True),
+        ('GET', '/park/query/range', 1, True),
+        ('POST', '/park/north-garage/query/batch', 1, True),
+        ('GET', '/park/query', 0, False),
+        ('PUT', '/park/rates', 0, True),             # Rates changes are always captured
+        ('PATCH', '/park/north-garage/rates', 0, True),
+        ('GET', '/park/health', 1, False),
+        ('GET', '/park/query/other', 1, False),
+    ])
+    def test_wants(self, tmp_path, method, path, sample, wanted):
+        capture = CaptureFile(tmp_path / 'capture.jsonl', sample, 1024)
+        assert capture.wants(method, path) == wanted
+        capture.close()
+
+    def test_invalid_sample(self, tmp_path):
+        with pytest.raises(ValueError):
+            CaptureFile(tmp_path / 'capture.jsonl', 1.5, 1024)
+
+    def test_write_read(self, tmp_path):
+        path = tmp_path / 'capture.jsonl'
+        records = [{'method': 'GET', 'path': '/park/query', 'status': 200}, {'method': 'PUT', 'path': '/park/rates'}]
+        capture = CaptureFile(path, 1, 1024)
+        for record in records:
+            capture.write(record)
+        capture.close()
+
+        # Appended to by every capture of the file
+        capture = CaptureFile(path, 1, 1024)
+        capture.write(records[0])
+        capture.close()
+
+        with open(path) as f:
+            assert list(read_captures(f)) == records + records[:1]
+
+
+def test_bodies():
+    record = {}
+    encode_body(record, 'body', '{"rates": []}'.encode())
+    compressed = gzip.compress(b'{"rates": []}')
+    encode_body(record, 'response', compressed)
+    assert record['body'] == '{"rates": []}'
+    assert 'response_base64' in record
+    assert decode_body(record, 'body') == b'{"rates": []}'
+    assert decode_body(record, 'response') == compressed
+    assert decode_body(record, 'other') is None
+
+
+def test_body_copy(tmp_path):
+    # Large bodies are copied to a file as they are read, along with what is
+    # left unread when closed
+    capture = CaptureFile(tmp_path / 'capture.jsonl', 1, 16)
+    name, file = capture.body_file()
+    body = b'{"rates": [' + b'{}, ' * 100000 + b'{}]}'
+    copy = BodyCopy(io.BytesIO(body), file)
+    assert copy.read(10) + copy.read(90) == body[:100]
+    copy.close()
+    capture.close()
+
+    directory = body_directory(str(tmp_path / 'capture.jsonl'))
+    assert decode_body({'body_file': name}, 'body', directory) == body
+    assert decode_body({'body_file': name}, 'body') is None
+
+
+def test_body_digest():
+    digest = body_hash()
+    digest.update(b'{"rate": ')
+    digest.update(b'1750}')
+    assert digest.hexdigest() == body_digest(b'{"rate": 1750}')
+    assert body_digest(b'{"rate": 1750}') != body_digest(b'{"rate": 2000}')
+
+
+def test_read_captures_invalid():
+    with pytest.raises(ValueError, match='Line 2'):
+        list(read_captures(io.StringIO('{"method": "GET"}\n[]\n')))
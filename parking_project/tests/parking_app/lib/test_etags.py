@@ -0,0 +1,21 @@
+from parking_app.lib.etags import etag_matches, query_etag
+
+
+def test_query_etag():
+    etag = query_etag('abc', 1000, 2000, 'single')
+    assert etag.startswith('"') and etag.endswith('"')
+    assert query_etag('abc', 1000, 2000, 'single') == etag
+    assert query_etag('abd', 1000, 2000, 'single') != etag
+    assert query_etag('abc', 1000, 2000, 'sum') != etag
+    # Window values are separated, so they can't run into each other
+    assert query_etag('abc', 100, 2000, 'single') != query_etag('abc', 1000, 200, 'single')
+
+
+def test_etag_matches():
+    etag = query_etag('abc', 1000, 2000, 'single')
+    assert etag_matches(etag, etag)
+    assert etag_matches(f'W/{etag}', etag)
+    assert etag_matches(f'"other", {etag}', etag)
+    assert etag_matches('*', etag)
+    assert not etag_matches('"other"', etag)
+    assert not etag_matches('', etag)
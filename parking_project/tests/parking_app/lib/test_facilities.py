@@ -0,0 +1,130 @@
+from datetime import datetime
+
+import pytest
+import pytz
+
+from parking_app.lib import facilities as facilities_module
+from parking_app.lib.facilities import FacilityRegistry
+from parking_app.lib.rates import ParkingRates
+
+
+start = pytz.utc.localize(datetime(2015, 7, 1, 12))
+end = pytz.utc.localize(datetime(2015, 7, 1, 13))
+
+
+def load_rates(rates, price: int) -> None:
+    rates.load_rates({'rates': [
+        {'id': 'weekdays', 'days': 'mon,tues,wed,thurs,fri', 'times': '0600-1800', 'tz': 'UTC', 'price': price},
+    ]})
+
+
+class TestFacilityRegistry:
+    def test_separate_rates(self):
+        facilities = FacilityRegistry()
+        load_rates(facilities.get('north', create=True), 1000)
+        load_rates(facilities.get('south', create=True), 2000)
+        assert facilities.get('north').get_rate_price(start, end) == 1000
+        assert facilities.get('south').get_rate_price(start, end) == 2000
+        assert facilities.get('north').cache is not facilities.get('south').cache
+        assert facilities.get('north').snapshot is not ParkingRates.snapshot
+
+    def test_unknown(self):
+        facilities = FacilityRegistry()
+        assert facilities.get('north') is None
+        assert 'north' not in facilities.rate_sets
+        rates = facilities.get('north', create=True)
+        assert not rates.rates_loaded()
+        with pytest.raises(RuntimeError):
+            rates.get_rate_price(start, end)
+
+    @pytest.mark.parametrize('facility', ['', 'north/south', '../rates', 'x' * 65])
+    def test_invalid_name(self, facility):
+        with pytest.raises(ValueError):
+            FacilityRegistry().get(facility, create=True)
+
+    def test_store(self, tmp_path):
+        load_rates(FacilityRegistry(store_dir=tmp_path).get('north', create=True), 1500)
+
+        # Stored rates are read when the facility is first requested, and
+        # compiled when first queried
+        facilities = FacilityRegistry(store_dir=tmp_path)
+        assert facilities.get('south') is None
+        rates = facilities.get('north')
+        assert rates.rates_loaded()
+        assert rates.compile_pending()
+        assert rates.get_rate_price(start, end) == 1500
+        assert not rates.compile_pending()
+        assert rates.snapshot.ids == {'weekdays': 0}
+
+    def test_store_shared(self, tmp_path):
+        # Registries of two worker processes storing rates in one directory
+        first = FacilityRegistry(store_dir=tmp_path)
+        second = FacilityRegistry(store_dir=tmp_path)
+        load_rates(first.get('north', create=True), 100)
+        assert second.get('north').get_rate_price(start, end) == 100
+
+        # Rates stored by one are read by the other on its next query
+        load_rates(first.get('north'), 999)
+        assert first.get('north').get_rate_price(start, end) == 999
+        assert second.get('north').compile_pending()
+        assert second.get('north').get_rate_price(start, end) == 999
+        assert not second.get('north').compile_pending()
+        assert list(second.compiled) == ['north']
+
+        # As are rates of a facility created empty by the other
+        empty = second.get('south', create=True)
+        load_rates(first.get('south', create=True), 500)
+        assert empty.rates_loaded()
+        assert empty.get_rate_price(start, end) == 500
+
+    def test_price_from_snapshot(self, tmp_path):
+        # A snapshot taken before its index is compiled is compiled for the
+        # query, even once other rates are published
+        load_rates(FacilityRegistry(store_dir=tmp_path).get('north', create=True), 1500)
+        rates = FacilityRegistry(store_dir=tmp_path).get('north')
+        snapshot = rates.get_snapshot()
+        assert snapshot.index is None
+
+        load_rates(rates, 2500)
+        assert rates.get_rate_price(start, end, snapshot=snapshot) == 1500
+        assert rates.get_rate_price(start, end) == 2500
+
+    def test_memory_budget(self, monkeypatch):
+        monkeypatch.setattr(facilities_module, 'index_bytes_per_rate', 100)
+        monkeypatch.setattr(facilities_module, 'timezone_bytes', {'index': 0, 'table': 0})
+        facilities = FacilityRegistry(memory_budget=300)
+        for facility in ('a', 'b', 'c'):
+            load_rates(facilities.get(facility, create=True), 1000)
+        assert list(facilities.compiled) == ['a', 'b', 'c']
+
+        # Querying a makes b the coldest, dropped when a fourth is compiled
+        facilities.get('a').get_rate_price(start, end)
+        load_rates(facilities.get('d', create=True), 1000)
+        assert list(facilities.compiled) == ['c', 'a', 'd']
+        assert facilities.get('b').compile_pending()
+        assert facilities.evictions == 1
+        assert facilities.memory() == 300
+
+        # A dropped index is compiled again on the next query
+        assert facilities.get('b').get_rate_price(start, end) == 1000
+        assert list(facilities.compiled) == ['a', 'd', 'b']
+
+    def test_patch_after_drop(self):
+        facilities = FacilityRegistry()
+        rates = facilities.get('north', create=True)
+        document = {'rates': [
+            {'id': str(i), 'days': 'mon', 'times': f'{i:02}00-{i + 1:02}00', 'tz': 'UTC', 'price': 100 + i}
+            for i in range(4)
+        ]}
+        rates.load_rates(document)
+        rates.publish(rates.patch_rates({'delete': ['0']}))
+        rates._drop_index()
+
+        # Ids refer to positions in the recompiled index
+        assert rates.snapshot.ids == {'1': 0, '2': 1, '3': 2}
+        rates.publish(rates.patch_rates({'update': [dict(document['rates'][2], price=1)]}))
+        assert [rate.price for rate in rates.snapshot.rates] == [101, 1, 103]
+        assert rates.get_rate_price(
+                pytz.utc.localize(datetime(2015, 7, 6, 2, 15)),
+                pytz.utc.localize(datetime(2015, 7, 6, 2, 45))
+        ) == 1
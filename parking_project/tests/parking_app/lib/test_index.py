@@ -0,0 +1,212 @@
+from datetime import datetime, timedelta
+import json
+
+import pytest
+
+from parking_app.lib import index as index_module
+from parking_app.lib.index import (
+        DayTable,
+        RateIndex,
+        WeeklyTimeline,
+        changed_days,
+        day_number,
+        end_minute,
+        slot_boundaries,
+        start_minute
+)
+from parking_app.lib.rates import Rate, RateRecord
+
+
+example_rates_file_path = 'parking_app/data/rates.json'
+
+
+def load_example_rates() -> list[Rate]:
+    with open(example_rates_file_path) as f:
+        rates_dict = json.load(f)
+    return [Rate(r['days'], r['times'], r['tz'], r['price']) for r in rates_dict['rates']]
+
+
+def linear_scan(rates, start, end):
+    for rate in rates:
+        if rate.time_span_in_rate(start, end):
+            return rate.price
+    return None
+
+
+@pytest.mark.parametrize('value,expected_start,expected_end', [
+    ('2020-10-08T12:00:00', 720, 720),
+    ('2020-10-08T12:00:01', 720, 721),
+    ('2020-10-08T12:00:00.000001', 720, 721),
+    ('2020-10-08T00:00:00', 0, 0),
+])
+def test_minutes(value, expected_start, expected_end):
+    local = datetime.fromisoformat(value)
+    assert start_minute(local) == expected_start
+    assert end_minute(local) == expected_end
+
+
+class TestDayTable:
+    def test_find_first_match(self):
+        # Overlapping rates, the earlier rate wins where both contain the range
+        table = DayTable([(0, 600, 900, 100, 0), (1, 480, 1200, 200, 0)])
+        assert table.find(600, 700) == (0, 100)
+        assert table.find(500, 700) == (1, 200)
+        assert table.find(850, 1000) == (1, 200)
+        assert table.find(400, 700) is None
+        assert table.find(1100, 1201) is None
+        assert table.find(1200, 1201) is None
+
+
+    @pytest.mark.parametrize('start,end,expected', [
+        (720, 900, 1000),
+        (720, 1020, 1000),     # Ends on boundary
+        (780, 1200, 1500),
+        (720, 1260, 1500),
+        (600, 780, None),      # Starts before first rate
+        (1020, 1380, None),    # Gap
+        (1320, 1380, 900),
+        (1320, 1381, None),    # Ends after last rate
+    ])
+    def test_find_sum(self, start, end, expected):
+        table = DayTable([(0, 720, 1020, 1000, 0), (1, 1020, 1260, 500, 0), (2, 1320, 1380, 900, 0)])
+        assert table.find_sum(start, end) == expected
+
+    def test_find_sum_overlapping(self):
+        # A rate is counted again each time the range passes back into it
+        table = DayTable([(0, 600, 900, 100, 0), (1, 480, 1200, 200, 0)])
+        assert table.find_sum(500, 1000) == 500
+        assert table.find_sum(500, 700) == 300
+
+
+    def test_find_sum_overnight_parts(self):
+        # The morning and evening parts of an overnight rate are separate
+        table = DayTable([(0, 0, 360, 1200, 1), (1, 360, 1320, 2000, 0), (0, 1320, 1440, 1200, 0)])
+        assert table.find_sum(300, 1380) == 4400
+
+
+def local_range(start: datetime, end: datetime) -> tuple[int, int, int, int]:
+    return (day_number(start), start_minute(start), day_number(end), end_minute(end))
+
+
+class TestWeeklyTimeline:
+    def test_price(self):
+        # Overnight from Sunday into Monday followed by Monday daytime
+        timeline = WeeklyTimeline([(0, 6, 1320, 360, 1000), (1, 0, 360, 1200, 500)])
+        sunday_night = datetime.fromisoformat('2020-10-11T23:00:00')
+        monday_morning = datetime.fromisoformat('2020-10-12T05:00:00')
+        monday_noon = datetime.fromisoformat('2020-10-12T12:00:00')
+        assert timeline.price(*local_range(sunday_night, monday_morning)) == 1000
+        assert timeline.price(*local_range(sunday_night, monday_noon)) == 1500
+        assert timeline.price(*local_range(monday_morning, monday_noon)) == 1500
+        assert timeline.price(*local_range(monday_noon, monday_noon.replace(hour=21))) is None
+
+    def test_price_many_weeks(self):
+        # Every day covered by two adjacent rates
+        timeline = WeeklyTimeline(
+                [(0, day, 0, 720, 100) for day in range(7)]
+                + [(1, day, 720, 0, 200) for day in range(7)]
+        )
+        start = datetime.fromisoformat('2020-10-05T00:00:00')
+        assert timeline.price(*local_range(start, start + timedelta(days=1))) == 300
+        assert timeline.price(*local_range(start, start + timedelta(days=30))) == 30 * 300
+        assert timeline.price(*local_range(start, start + timedelta(days=30, hours=1))) == 30 * 300 + 100
+        assert timeline.price(*local_range(start + timedelta(hours=13), start + timedelta(days=365, hours=13))) == 365 * 300 + 200
+
+    def test_price_no_rates(self):
+        timeline = WeeklyTimeline([])
+        start = datetime.fromisoformat('2020-10-05T00:00:00')
+        assert timeline.price(*local_range(start, start + timedelta(hours=1))) is None
+
+
+def test_day_number():
+    monday = datetime.fromisoformat('2020-10-05T00:00:00')
+    assert day_number(monday) % 7 == 0
+    assert day_number(monday + timedelta(days=1, hours=23)) - day_number(monday) == 1
+
+
+class TestRateIndex:
+    def test_find_matches_linear_scan(self):
+        rates = load_example_rates()
+        rates.append(Rate('mon,wed', '0800-2200', 'America/New_York', 3000))
+        rates.append(Rate('tues', '0000-2359', 'Asia/Kolkata', 500))
+        rates.append(Rate('fri,sun', '2200-0600', 'America/Chicago', 1200))
+        rates.append(Rate('sat', '1800-0000', 'America/Chicago', 700))
+        index = RateIndex([rate.to_record() for rate in rates])
+
+        start = datetime.fromisoformat('2020-10-05T00:00:00-05:00')
+        for offset in range(0, 7 * 24 * 60, 45):
+            for duration in (30, 61, 240, 900, 1500, 7 * 24 * 60 + 30):
+                query_start = start + timedelta(minutes=offset)
+                query_end = query_start + timedelta(minutes=duration, seconds=offset % 2)
+                assert index.find(query_start, query_end) == \
+                        linear_scan(rates, query_start, query_end)
+
+    def test_find_many(self):
+        rates = load_example_rates()
+        rates.append(Rate('mon,wed', '0800-2200', 'America/New_York', 3000))
+        index = RateIndex([rate.to_record() for rate in rates])
+
+        start = datetime.fromisoformat('2020-10-05T00:00:00-05:00')
+        spans = [
+            (start + timedelta(minutes=offset), start + timedelta(minutes=offset + 120))
+            for offset in range(0, 7 * 24 * 60, 30)
+        ]
+        spans += spans[:10]
+        assert index.find_many(spans) == [index.find(*span) for span in spans]
+
+    def test_find_no_rates(self):
+        index = RateIndex([])
+        start = datetime.fromisoformat('2020-10-08T12:00:00-05:00')
+        assert index.find(start, start + timedelta(hours=1)) is None
+        assert list(index.find_range(start, start + timedelta(hours=1), timedelta(minutes=15))) == [None] * 4
+
+    @pytest.mark.parametrize('mode', ['single', 'sum', 'span'])
+    @pytest.mark.parametrize('start,slot', [
+        ('2020-10-05T00:00:00-05:00', timedelta(minutes=15)),
+        ('2020-10-05T00:20:30.5-05:00', timedelta(minutes=45)),   # Slots ending mid-minute
+        ('2020-11-01T00:00:00-05:00', timedelta(minutes=20)),     # Daylight saving time ends
+        ('2020-10-05T00:00:00-05:00', timedelta(hours=5)),        # Slots crossing midnight
+    ])
+    def test_find_range(self, monkeypatch, mode, start, slot):
+        monkeypatch.setattr(index_module, 'range_chunk_size', 10)
+        rates = load_example_rates()
+        rates.append(Rate('mon,wed', '0800-2200', 'America/New_York', 3000))
+        rates.append(Rate('fri,sun', '2200-0600', 'America/Chicago', 1200))
+        index = RateIndex([rate.to_record() for rate in rates])
+
+        start = datetime.fromisoformat(start)
+        end = start + timedelta(days=2, minutes=10)
+        prices = []
+        slot_start = start
+        while slot_start < end:
+            slot_end = min(slot_start + slot, end)
+            prices.append(index.find(slot_start, slot_end, mode))
+            slot_start = slot_end
+        assert list(index.find_range(start, end, slot, mode)) == prices
+        assert any(price is not None for price in prices)
+
+
+def test_slot_boundaries(monkeypatch):
+    monkeypatch.setattr(index_module, 'range_chunk_size', 3)
+    assert list(slot_boundaries(0, 10, 2)) == [[0, 2, 4, 6], [6, 8, 10]]
+    assert list(slot_boundaries(0, 7, 2)) == [[0, 2, 4, 6], [6, 7]]
+    assert list(slot_boundaries(0, 6, 2)) == [[0, 2, 4, 6]]
+
+
+class TestDayTableSweep:
+    def test_sweep_matches_find(self):
+        table = DayTable([(0, 540, 1260, 1500, 0), (1, 0, 600, 700, 0), (2, 600, 1440, 300, 0)])
+        spans = [(start, start + duration) for start in range(0, 1440, 25) for duration in (10, 100)]
+        spans.sort()
+        spans.append((30, 90))  # Back to an earlier segment
+        assert table.sweep(spans) == [table.find(start, end) for start, end in spans]
+
+
+@pytest.mark.parametrize('record,expected', [
+    (RateRecord(0b0000101, 540, 1260, 'UTC', 1500), 0b0000101),
+    (RateRecord(0b0000101, 1260, 360, 'UTC', 1500), 0b0001111),  # Overnight
+    (RateRecord(0b1000000, 1260, 360, 'UTC', 1500), 0b1000001),  # Sunday night into Monday
+    (RateRecord(0b1000000, 1260, 0, 'UTC', 1500), 0b1000000),    # Ends at midnight
+])
+def test_changed_days(record, expected):
+    assert changed_days(record) == expected
@@ -0,0 +1,131 @@
+import gzip
+import io
+import json
+
+import pytest
+
+from parking_app.lib import ingest
+from parking_app.lib.ingest import iter_rates, stream_format
+from parking_app.lib.rates import InvalidRates, ParkingRates, RateRecord
+
+
+rates_file_path = 'tests/data/rates.json'
+
+
+def rates_stream(text: str) -> io.BytesIO:
+    return io.BytesIO(text.encode())
+
+
+class TestIterRates:
+    def test_document(self):
+        with open(rates_file_path, 'rb') as f:
+            rates = list(iter_rates(f))
+        with open(rates_file_path) as f:
+            assert rates == json.load(f)['rates']
+
+    @pytest.mark.parametrize('document,expected', [
+        ('[]', []),
+        ('{"rates": []}', []),
+        (' [ {"price": 1} , {"price": 2} ] ', [{'price': 1}, {'price': 2}]),
+        ('{"name": {"rates": [1]}, "rates": [{"price": 1}], "count": 1}', [{'price': 1}]),
+        ('[1, 2.5, "a", null]', [1, 2.5, 'a', None]),
+    ])
+    def test_json(self, document, expected):
+        assert list(iter_rates(rates_stream(document))) == expected
+
+    @pytest.mark.parametrize('document', [
+        '',
+        '{}',
+        '{"rates": {}}',
+        '{"rates": [}',
+        '[{"price": 1}',
+        '[{"price": 1},]',
+        '[{"price": 1}] []',
+        '[{"price": 1} {"price": 2}]',
+        '"rates"',
+    ])
+    def test_json_invalid(self, document):
+        with pytest.raises(ValueError):
+            list(iter_rates(rates_stream(document)))
+
+    def test_chunks(self, monkeypatch):
+        # Values, including numbers and multi-byte characters, split across
+        # reads are decoded whole
+        monkeypatch.setattr(ingest, 'chunk_size', 3)
+        rates = [{'price': 123456789, 'tz': 'Amérique/Chicago'}] * 5
+        assert list(iter_rates(rates_stream(json.dumps({'rates': rates})))) == rates
+
+    def test_rate_too_large(self, monkeypatch):
+        # The buffer is not grown past max_rate_size to decode a value
+        monkeypatch.setattr(ingest, 'chunk_size', 16)
+        monkeypatch.setattr(ingest, 'max_rate_size', 100)
+        with pytest.raises(ValueError):
+            list(iter_rates(rates_stream(json.dumps([{'tz': 'x' * 200}]))))
+
+    def test_ndjson(self):
+        stream = rates_stream('{"price": 1}\n\n{"price": 2}\r\n{"price": 3}')
+        assert list(iter_rates(stream, 'ndjson')) == [{'price': 1}, {'price': 2}, {'price': 3}]
+
+    def test_ndjson_invalid(self):
+        rates = iter_rates(rates_stream('{"price": 1}\n{"price": \n'), 'ndjson')
+        assert next(rates) == {'price': 1}
+        with pytest.raises(ValueError, match='line 2'):
+            next(rates)
+
+    @pytest.mark.parametrize('format,document', [
+        ('json', '{"rates": [{"price": 1}]}'),
+        ('ndjson', '{"price": 1}\n'),
+    ])
+    def test_gzip(self, format, document):
+        stream = io.BytesIO(gzip.compress(document.encode()))
+        assert list(iter_rates(stream, format, 'gzip')) == [{'price': 1}]
+
+    def test_gzip_invalid(self):
+        with pytest.raises(ValueError):
+            list(iter_rates(rates_stream('{"rates": []}'), 'json', 'gzip'))
+
+    def test_invalid_arguments(self):
+        with pytest.raises(ValueError):
+            iter_rates(rates_stream('[]'), 'xml')
+        with pytest.raises(ValueError):
+            iter_rates(rates_stream('[]'), 'json', 'br')
+
+    def test_stream_format(self):
+        assert stream_format('application/x-ndjson') == 'ndjson'
+        assert stream_format('application/json') == 'json'
+        assert stream_format('') == 'json'
+
+
+class TestCompileRateStream:
+    def test_compile(self):
+        stream = rates_stream(
+                '{"days": "mon", "times": "0900-2100", "tz": "America/Chicago", "price": 1500}\n'
+                '{"days": "sat,sun", "times": "2200-0600", "tz": "UTC", "price": 500}\n'
+        )
+        snapshot = ParkingRates.compile_rate_stream(iter_rates(stream, 'ndjson'))
+        assert snapshot.rates == (
+            RateRecord(0b0000001, 9 * 60, 21 * 60, 'America/Chicago', 1500),
+            RateRecord(0b1100000, 22 * 60, 6 * 60, 'UTC', 500),
+        )
+
+    def test_invalid_rates(self):
+        rates = [
+            {'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+            {'days': 'wedn', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+            {'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago'},
+            {'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicgo', 'price': 1500},
+            [],
+        ]
+        with pytest.raises(InvalidRates) as e:
+            ParkingRates.compile_rate_stream(rates)
+        assert e.value.count == 4
+        assert [error['rate'] for error in e.value.errors] == [1, 2, 3, 4]
+        assert e.value.errors[2]['error'] == 'Invalid timezone America/Chicgo'
+        assert str(e.value).startswith('rate 1: ')
+
+    def test_max_errors(self, monkeypatch):
+        monkeypatch.setattr('parking_app.lib.rates.max_rate_errors', 2)
+        with pytest.raises(InvalidRates) as e:
+            ParkingRates.compile_rate_stream([{}] * 5)
+        assert e.value.count == 5
+        assert len(e.value.errors) == 2
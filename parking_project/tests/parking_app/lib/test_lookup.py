@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from parking_app.lib.index import RateIndex
+from parking_app.lib.lookup import LookupTable
+from parking_app.lib.rates import Rate
+from parking_app.lib.timestamp import parse_timestamp
+
+
+rates = [
+    Rate('mon,tues,thurs', '0900-2100', 'America/Chicago', 1500),
+    Rate('fri,sat,sun', '0900-2100', 'America/Chicago', 2000),
+    Rate('sun', '0000-0900', 'America/Chicago', 700),
+    Rate('sat,sun', '2100-0300', 'America/Chicago', 1200),
+    Rate('mon,wed', '0800-2200', 'America/New_York', 3000),
+    Rate('tues', '0000-2359', 'Asia/Kolkata', 500),
+    Rate('wed', '1000-1400', 'UTC', 400),
+]
+
+
+class TestLookupTable:
+    @pytest.mark.parametrize('mode', ['single', 'sum', 'span'])
+    @pytest.mark.parametrize('first_day', [
+        '2020-03-05T00:00:00+00:00',    # Daylight saving time starts
+        '2020-10-29T00:00:00+00:00',    # Daylight saving time ends
+    ])
+    def test_find_matches_index(self, mode, first_day):
+        index = RateIndex([rate.to_record() for rate in rates])
+        table = LookupTable(index, (2000, 2030))
+
+        start = datetime.fromisoformat(first_day)
+        for offset in range(0, 7 * 24 * 60, 50):
+            for duration in (30, 61, 240, 900, 1500, 3 * 24 * 60):
+                query_start = start + timedelta(minutes=offset, seconds=offset % 3)
+                query_end = query_start + timedelta(minutes=duration, seconds=offset % 2)
+                assert table.find(query_start, query_end, mode) == \
+                        index.find(query_start, query_end, mode)
+
+    def test_find_outside_horizon(self):
+        index = RateIndex([rate.to_record() for rate in rates])
+        table = LookupTable(index, (2020, 2020))
+        start = datetime.fromisoformat('2021-10-07T12:00:00-05:00')
+        end = datetime.fromisoformat('2021-10-07T18:00:00-05:00')
+        assert table.find(start, end) == index.find(start, end) == 1500
+
+    @pytest.mark.parametrize('mode', ['single', 'sum', 'span'])
+    @pytest.mark.parametrize('start,end', [
+        ('2020-03-07T00:00:00-06:00', '2020-03-10T00:00:00-06:00'),               # Daylight saving time starts
+        ('2020-10-30T12:00:00.25+00:00', '2020-11-02T12:00:00+00:00'),            # Daylight saving time ends
+        ('2037-12-30T00:00:00+00:00', '2038-01-02T00:00:00+00:00'),               # Past the horizon
+    ])
+    def test_find_range(self, mode, start, end):
+        index = RateIndex([rate.to_record() for rate in rates])
+        table = LookupTable(index, (2000, 2037))
+        start = parse_timestamp(start)
+        end = parse_timestamp(end)
+        slot = timedelta(minutes=25)
+        prices = list(table.find_range(start, end, slot, mode))
+
+        expected = []
+        slot_start = start.parsed
+        while slot_start < end.parsed:
+            slot_end = min(slot_start + slot, end.parsed)
+            expected.append(table.find(
+                    parse_timestamp(slot_start.isoformat()),
+                    parse_timestamp(slot_end.isoformat()),
+                    mode
+            ))
+            slot_start = slot_end
+        assert prices == expected
+
+    def test_find_many(self):
+        index = RateIndex([rate.to_record() for rate in rates])
+        table = LookupTable(index, (2000, 2030))
+        start = datetime.fromisoformat('2020-10-05T00:00:00-05:00')
+        spans = [(start + timedelta(hours=h), start + timedelta(hours=h + 2)) for h in range(0, 168, 5)]
+        assert table.find_many(spans) == index.find_many(spans)
+
+    @pytest.mark.parametrize('horizon', [(2000, 2030), (2021, 2021)])
+    def test_find_timestamps(self, horizon):
+        # Parsed timestamps price the same as datetimes, inside the horizon
+        # and through the fallback to the index outside it
+        index = RateIndex([rate.to_record() for rate in rates])
+        table = LookupTable(index, horizon)
+        for start, end in [
+            ('2020-10-05T09:00:00.5-05:00', '2020-10-05T20:59:59.5-05:00'),
+            ('2020-10-05T09:00:00-05:00', '2020-10-05T21:00:00.000001-05:00'),
+            ('2020-10-10T21:30:00-05:00', '2020-10-11T02:00:00-05:00'),
+            ('2020-10-08T03:00:00Z', '2020-10-08T05:00:00Z'),
+        ]:
+            for engine in (index, table):
+                assert engine.find(parse_timestamp(start), parse_timestamp(end)) == \
+                        index.find(datetime.fromisoformat(start), datetime.fromisoformat(end))
+
+    def test_reuse(self):
+        records = [rate.to_record() for rate in rates]
+        index = RateIndex(records)
+        previous = LookupTable(index, (2000, 2030))
+
+        changed = records[4]._replace(price=3100)
+        patched = index.patch(records[:4] + [changed] + records[5:], None, [records[4], changed])
+        table = LookupTable(patched, (2000, 2030), previous)
+        # Only the America/New_York zone is compiled again
+        assert [zone is old for zone, old in zip(table.zones, previous.zones)] == [True, False, True, True]
+
+        start = parse_timestamp('2020-10-12T09:00:00-04:00')
+        end = parse_timestamp('2020-10-12T10:00:00-04:00')
+        assert table.find(start, end) == 3100
+        # Zones don't depend on the horizon
+        assert LookupTable(patched, (2001, 2030), previous).zones[0] is previous.zones[0]
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from parking_app.lib.metrics import Counter, Gauge, Histogram, Registry, registry
+from parking_app.lib.rates import ParkingRates
+
+
+def test_counter():
+    counter = Counter('requests_total', 'Requests served.')
+    counter.inc()
+    counter.inc(2)
+    assert counter.samples() == [('requests_total', '', 3)]
+
+    # A count kept elsewhere is read when collected
+    assert Counter('hits_total', 'Hits.', lambda: 7).samples() == [('hits_total', '', 7)]
+
+
+def test_gauge():
+    values = [1]
+    gauge = Gauge('size', 'Size.', lambda: values[-1])
+    values.append(5)
+    assert gauge.samples() == [('size', '', 5)]
+
+
+def test_histogram():
+    histogram = Histogram('latency_seconds', 'Latency.', (0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+    assert histogram.samples() == [
+        ('latency_seconds_bucket', '{le="0.1"}', 2),
+        ('latency_seconds_bucket', '{le="1"}', 3),
+        ('latency_seconds_bucket', '{le="+Inf"}', 4),
+        ('latency_seconds_sum', '', 2.65),
+        ('latency_seconds_count', '', 4),
+    ]
+
+
+def test_threads():
+    counter = Counter('requests_total', 'Requests served.')
+    histogram = Histogram('latency_seconds', 'Latency.', (0.1, 1.0))
+
+    def record():
+        for _ in range(1000):
+            counter.inc()
+            histogram.observe(0.5)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.samples() == [('requests_total', '', 8000)]
+    assert histogram.samples()[1:] == [
+        ('latency_seconds_bucket', '{le="1"}', 8000),
+        ('latency_seconds_bucket', '{le="+Inf"}', 8000),
+        ('latency_seconds_sum', '', 4000.0),
+        ('latency_seconds_count', '', 8000),
+    ]
+
+
+def test_histogram_invalid_buckets():
+    with pytest.raises(ValueError):
+        Histogram('latency_seconds', 'Latency.', (1.0, 0.1))
+
+
+def test_registry_render():
+    test_registry = Registry()
+    test_registry.register(Counter('requests_total', 'Requests served.')).inc()
+    test_registry.register(Histogram('latency_seconds', 'Latency.', (0.25,))).observe(0.5)
+    assert test_registry.render() == (
+        '# HELP requests_total Requests served.\n'
+        '# TYPE requests_total counter\n'
+        'requests_total 1\n'
+        '# HELP latency_seconds Latency.\n'
+        '# TYPE latency_seconds histogram\n'
+        'latency_seconds_bucket{le="0.25"} 0\n'
+        'latency_seconds_bucket{le="+Inf"} 1\n'
+        'latency_seconds_sum 0.5\n'
+        'latency_seconds_count 1\n'
+    )
+
+
+def test_registry_duplicate():
+    test_registry = Registry()
+    test_registry.register(Counter('requests_total', 'Requests served.'))
+    with pytest.raises(ValueError):
+        test_registry.register(Counter('requests_total', 'Requests served.'))
+
+
+def test_rates_metrics():
+    ParkingRates.load_rates({'rates': [
+        {'days': 'mon,tues', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+        {'days': 'wed', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1000},
+    ]})
+    rendered = registry.render()
+    assert '\nparking_rates 2\n' in rendered
+    assert f'\nparking_rates_generation {ParkingRates.snapshot.generation}\n' in rendered
+    assert '\nparking_rates_compile_seconds_count ' in rendered
@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from parking_app.lib import overlaps as overlaps_module
+from parking_app.lib.overlaps import find_overlaps
+from parking_app.lib.records import RateArrays, RateRecord
+
+
+def brute_force(records: list[RateRecord]) -> tuple[int, int]:
+    # Compare the minutes of every part of every pair of rates on every
+    # weekday
+    def parts(record: RateRecord, day: int) -> list[set[int]]:
+        found = []
+        if record.days_mask & (1 << day):
+            found.append(set(range(record.start, record.end if record.start < record.end else 24 * 60)))
+        if record.start > record.end and record.days_mask & (1 << (day - 1) % 7):
+            found.append(set(range(0, record.end)))
+        return found
+
+    overlaps = conflicts = 0
+    for i, first in enumerate(records):
+        for second in records[i + 1:]:
+            if first.tz != second.tz:
+                continue
+            for day in range(7):
+                for first_part in parts(first, day):
+                    for second_part in parts(second, day):
+                        if first_part & second_part:
+                            overlaps += 1
+                            conflicts += first.price != second.price
+    return overlaps, conflicts
+
+
+class TestFindOverlaps:
+    def test_no_overlaps(self):
+        report = find_overlaps(RateArrays([
+            RateRecord(0b0011111, 9 * 60, 17 * 60, 'America/Chicago', 1500),
+            RateRecord(0b0011111, 17 * 60, 9 * 60, 'America/Chicago', 1000),     # Adjacent overnight
+            RateRecord(0b1100000, 9 * 60, 17 * 60, 'America/Chicago', 2000),
+            RateRecord(0b0011111, 9 * 60, 17 * 60, 'UTC', 1000),                 # Another timezone
+        ]))
+        assert report == (0, 0, [])
+
+    def test_conflicts(self):
+        report = find_overlaps(RateArrays([
+            RateRecord(0b0000001, 9 * 60, 17 * 60, 'America/Chicago', 1500, 'day'),
+            RateRecord(0b0000001, 12 * 60, 13 * 60, 'America/Chicago', 1500, 'lunch'),
+            RateRecord(0b1000000, 22 * 60, 10 * 60, 'America/Chicago', 900, 'night'),
+        ]))
+        # The overnight Sunday rate overlaps Monday morning
+        assert report.overlaps == 2
+        assert report.conflicts == 1
+        assert report.details == [{
+            'day': 'mon',
+            'times': '0900-1000',
+            'tz': 'America/Chicago',
+            'rates': [0, 2],
+            'prices': [1500, 900],
+            'ids': ['day', 'night'],
+        }]
+
+    def test_max_details(self, monkeypatch):
+        monkeypatch.setattr(overlaps_module, 'max_conflict_details', 3)
+        records = [RateRecord(0b1111111, 9 * 60, 17 * 60, 'UTC', price) for price in range(5)]
+        report = find_overlaps(RateArrays(records))
+        assert report.conflicts == 10 * 7
+        assert len(report.details) == 3
+        assert report.details[0] == {'day': 'mon', 'times': '0900-1700', 'tz': 'UTC', 'rates': [0, 1], 'prices': [0, 1]}
+
+    @pytest.mark.parametrize('seed', range(5))
+    def test_matches_brute_force(self, seed):
+        generator = random.Random(seed)
+        records = []
+        for _ in range(40):
+            start, end = generator.sample(range(0, 24 * 60, 60), 2)
+            records.append(RateRecord(
+                    generator.randrange(1, 128),
+                    start,
+                    end,
+                    generator.choice(['UTC', 'America/Chicago']),
+                    generator.choice([100, 200, 300])
+            ))
+        report = find_overlaps(RateArrays(records))
+        assert (report.overlaps, report.conflicts) == brute_force(records)
+        for detail in report.details:
+            first, second = (records[position] for position in detail['rates'])
+            assert first.price != second.price
@@ -1,26 +1,70 @@
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 import json
+import random
 
 import pytest
 
-from parking_app.lib.rates import ParkingRates, Rate, TimeSpan
+from parking_app.lib.index import RateIndex
+from parking_app.lib.rates import ConflictingRates, InvalidRates, ParkingRates, Rate, RateRecord, TimeSpan
 
 
 rates_file_path = 'tests/data/rates.json'
+adjacent_rates_file_path = 'tests/data/rates_adjacent.json'
 
 
 class TestParkingRates:
     def test_load_rates(self):
         self._load_rates()
 
-        assert_rate_object(
-                ParkingRates.rates[0],
-                self.rates_dict['rates'][0]['days'],
-                self.rates_dict['rates'][0]['times'],
-                self.rates_dict['rates'][0]['tz'],
-                self.rates_dict['rates'][0]['price']
+        assert ParkingRates.snapshot.rates[0] == RateRecord(
+                days_mask=0b0001011,
+                start=9 * 60,
+                end=21 * 60,
+                tz=self.rates_dict['rates'][0]['tz'],
+                price=self.rates_dict['rates'][0]['price']
         )
 
+    def test_compile_rates(self):
+        self._load_rates()
+        published = ParkingRates.snapshot
+
+        snapshot = ParkingRates.compile_rates({'rates': [
+            {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2500}
+        ]})
+        # Compiling does not affect the published rates until published
+        assert ParkingRates.snapshot is published
+        assert snapshot.generation != published.generation
+
+        ParkingRates.publish(snapshot)
+        assert ParkingRates.snapshot is snapshot
+
+    def test_compile_rates_invalid(self):
+        self._load_rates()
+        published = ParkingRates.snapshot
+        with pytest.raises(ValueError):
+            ParkingRates.load_rates({'rates': [
+                {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2500},
+                {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': -1}
+            ]})
+        assert ParkingRates.snapshot is published
+
+    def test_load_rates_overlaps(self):
+        self._load_rates()
+        published = ParkingRates.snapshot
+        rates = {'rates': [
+            {'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+            {'days': 'mon,tues', 'times': '1200-1300', 'tz': 'America/Chicago', 'price': 500},
+        ]}
+        with pytest.raises(ConflictingRates) as e:
+            ParkingRates.load_rates(rates, strict=True)
+        assert str(e.value) == 'rates 0 and 1 overlap on mon 1200-1300 America/Chicago with different prices'
+        assert ParkingRates.snapshot is published
+
+        # Without strict the first rate is charged, and the overlap reported
+        report = ParkingRates.load_rates(rates)
+        assert (report.overlaps, report.conflicts) == (1, 1)
+        assert ParkingRates.snapshot.overlaps is report
+
     @pytest.mark.parametrize('start,end,expected', [
         ('2020-10-08T12:00:00-04:00', '2020-10-08T18:00:00-04:00', 1500),
         ('2020-10-08T12:00:00-05:00', '2020-10-08T18:00:00-05:00', 1500),
@@ -35,12 +79,242 @@ class TestParkingRates:
         price = ParkingRates.get_rate_price(start_dt, end_dt)
         assert price == expected
 
+    @pytest.mark.parametrize('start,end,single,summed', [
+        ('2020-10-07T13:00:00-05:00', '2020-10-07T15:00:00-05:00', 1000, 1000),
+        ('2020-10-07T10:00:00-05:00', '2020-10-07T13:00:00-05:00', None, None),  # Starts before rates
+        ('2020-10-07T13:00:00-05:00', '2020-10-07T20:00:00-05:00', None, 1500),  # Adjacent rates
+        ('2020-10-07T13:00:00-05:00', '2020-10-07T17:00:00-05:00', 1000, 1000),  # Ends on boundary
+        ('2020-10-07T09:00:00-05:00', '2020-10-07T11:00:00-05:00', None, None),
+        ('2020-10-07T17:00:00-05:00', '2020-10-07T23:00:00-05:00', None, None),  # Gap between rates
+        ('2020-10-07T12:00:00-05:00', '2020-10-07T21:00:00-05:00', None, 1500),
+        ('2020-10-07T13:00:00-05:00', '2020-10-08T13:00:00-05:00', None, None),  # Multiple days
+    ])
+    def test_get_rate_price_sum(self, start, end, single, summed):
+        with open(adjacent_rates_file_path) as f:
+            ParkingRates.load_rates(json.load(f))
+        start_dt = datetime.fromisoformat(start)
+        end_dt = datetime.fromisoformat(end)
+        assert ParkingRates.get_rate_price(start_dt, end_dt) == single
+        assert ParkingRates.get_rate_price(start_dt, end_dt, "sum") == summed
+        assert ParkingRates.get_rate_prices([(start_dt, end_dt)], "sum") == [summed]
+
+    @pytest.mark.parametrize('start,end,expected', [
+        ('2020-10-09T23:00:00-05:00', '2020-10-10T05:00:00-05:00', 1200),   # Overnight
+        ('2020-10-09T23:00:00-05:00', '2020-10-10T08:00:00-05:00', 3200),   # Overnight and day
+        ('2020-10-09T23:00:00-05:00', '2020-10-11T08:00:00-05:00', 5200),   # Two nights
+        ('2020-10-09T23:00:00-05:00', '2020-10-11T09:00:00-05:00', None),   # Gap on Sunday
+        ('2020-10-09T21:00:00-05:00', '2020-10-10T08:00:00-05:00', None),   # Gap on Friday
+        ('2020-10-09T23:00:00-05:00', '2020-10-16T23:30:00-05:00', None),   # Week with gaps
+        ('2020-10-10T12:00:00-05:00', '2020-10-10T13:00:00-05:00', 2000),   # Within a day
+    ])
+    def test_get_rate_price_span(self, start, end, expected):
+        ParkingRates.load_rates({'rates': [
+            {'days': 'fri,sat', 'times': '2200-0600', 'tz': 'America/Chicago', 'price': 1200},
+            {'days': 'sat', 'times': '0600-2200', 'tz': 'America/Chicago', 'price': 2000},
+            {'days': 'sun', 'times': '0600-0800', 'tz': 'America/Chicago', 'price': 800},
+        ]})
+        start_dt = datetime.fromisoformat(start)
+        end_dt = datetime.fromisoformat(end)
+        assert ParkingRates.get_rate_price(start_dt, end_dt, "span") == expected
+
+    def test_use_engine(self):
+        try:
+            ParkingRates.use_engine('table', (2000, 2030))
+            self._load_rates()
+            start = datetime.fromisoformat('2020-10-08T12:00:00-05:00')
+            end = datetime.fromisoformat('2020-10-08T18:00:00-05:00')
+            assert ParkingRates.get_rate_price(start, end) == 1500
+        finally:
+            ParkingRates.use_engine('index')
+
+    @pytest.mark.parametrize('engine,horizon', [
+        ('scan', None),
+        ('table', (2030, 2000)),
+        ('table', (2000,)),
+    ])
+    def test_use_engine_invalid(self, engine, horizon):
+        with pytest.raises(ValueError):
+            ParkingRates.use_engine(engine, horizon)
+        assert ParkingRates.engine == 'index'
+
+    def test_get_rate_prices(self):
+        self._load_rates()
+        spans = [
+            (datetime.fromisoformat(start), datetime.fromisoformat(end))
+            for start, end in [
+                ('2020-10-08T12:00:00-05:00', '2020-10-08T18:00:00-05:00'),
+                ('2020-10-09T12:00:00-05:00', '2020-10-09T18:00:00-05:00'),
+                ('2020-10-08T12:00:00-04:00', '2020-10-08T18:00:00-04:00'),
+                ('2020-10-08T12:00:00-05:00', '2020-10-08T18:00:00-05:00'),
+            ]
+        ]
+        assert ParkingRates.get_rate_prices(spans) == [1500, None, 1500, 1500]
+        assert ParkingRates.get_rate_prices([]) == []
+
+    def test_load_rates_invalidates_cache(self):
+        self._load_rates()
+        start = datetime.fromisoformat('2020-10-08T12:00:00-05:00')
+        end = datetime.fromisoformat('2020-10-08T18:00:00-05:00')
+        assert ParkingRates.get_rate_price(start, end) == 1500
+        hits = ParkingRates.cache_stats()['hits']
+        assert ParkingRates.get_rate_price(start, end) == 1500
+        assert ParkingRates.cache_stats()['hits'] == hits + 1
+
+        ParkingRates.load_rates({'rates': [
+            {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2500}
+        ]})
+        assert ParkingRates.get_rate_price(start, end) == 2500
+
+    def test_get_snapshot(self):
+        self._load_rates()
+        snapshot = ParkingRates.get_snapshot()
+        assert snapshot.version == ParkingRates.snapshot.rates.digest()
+
+        # Loading the same rates again gives the same version
+        self._load_rates()
+        assert ParkingRates.get_snapshot().version == snapshot.version
+        assert ParkingRates.get_snapshot().loaded >= snapshot.loaded
+
+        ParkingRates.load_rates({'rates': [
+            {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2500}
+        ]})
+        assert ParkingRates.get_snapshot().version != snapshot.version
+
+    def test_price_from_snapshot(self):
+        # Rates published after a snapshot is taken don't change its prices
+        self._load_rates()
+        snapshot = ParkingRates.get_snapshot()
+        ParkingRates.load_rates({'rates': [
+            {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2500}
+        ]})
+
+        start = datetime.fromisoformat('2015-07-02T09:00:00-05:00')
+        end = datetime.fromisoformat('2015-07-02T12:00:00-05:00')
+        assert ParkingRates.get_rate_price(start, end, snapshot=snapshot) == 1500
+        assert ParkingRates.get_rate_price(start, end) == 2500
+        assert list(ParkingRates.get_rate_price_range(start, end, timedelta(hours=3), snapshot=snapshot)) == [1500]
+
+    def test_record_to_dict(self):
+        self._load_rates()
+        assert [rate.to_dict() for rate in ParkingRates.snapshot.rates] == self.rates_dict['rates']
+
     def _load_rates(self) -> None:
         with open(rates_file_path) as f:
             self.rates_dict = json.load(f)
         ParkingRates.load_rates(self.rates_dict)
 
 
+class TestPatchRates:
+    rates = [
+        {'id': 'a', 'days': 'mon,tues', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+        {'id': 'b', 'days': 'mon', 'times': '1000-1200', 'tz': 'America/Chicago', 'price': 900},
+        {'days': 'wed', 'times': '0600-1800', 'tz': 'Asia/Kolkata', 'price': 1750},
+        {'id': 'c', 'days': 'wed', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1000},
+    ]
+
+    @pytest.fixture(autouse=True)
+    def load(self):
+        ParkingRates.load_rates({'rates': self.rates})
+
+    def price(self, start: str, end: str) -> int:
+        return ParkingRates.get_rate_price(datetime.fromisoformat(start), datetime.fromisoformat(end))
+
+    def test_patch(self):
+        assert self.price('2020-10-12T10:00:00-05:00', '2020-10-12T11:00:00-05:00') == 1500
+        published = ParkingRates.snapshot
+        snapshot = ParkingRates.patch_rates({
+            'delete': ['c'],
+            'update': [{'id': 'a', 'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1600}],
+            'add': [{'id': 'c', 'days': 'thurs', 'times': '0900-2100', 'tz': 'America/New_York', 'price': 500}],
+        })
+        assert ParkingRates.snapshot is published
+        ParkingRates.publish(snapshot)
+
+        assert [rate.to_dict() for rate in snapshot.rates] == [
+            {'id': 'a', 'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1600},
+            self.rates[1],
+            self.rates[2],
+            {'id': 'c', 'days': 'thurs', 'times': '0900-2100', 'tz': 'America/New_York', 'price': 500},
+        ]
+        # The updated rate still comes first, and the cached price is not used
+        assert self.price('2020-10-12T10:00:00-05:00', '2020-10-12T11:00:00-05:00') == 1600
+        assert self.price('2020-10-13T10:00:00-05:00', '2020-10-13T11:00:00-05:00') is None
+        assert self.price('2020-10-14T10:00:00-05:00', '2020-10-14T11:00:00-05:00') is None
+        assert self.price('2020-10-15T10:00:00-04:00', '2020-10-15T11:00:00-04:00') == 500
+
+        # The Asia/Kolkata table was not touched
+        assert snapshot.index.timezones['Asia/Kolkata'] is published.index.timezones['Asia/Kolkata']
+
+    def test_patch_invalid(self):
+        published = ParkingRates.snapshot
+        with pytest.raises(InvalidRates) as e:
+            ParkingRates.patch_rates({
+                'delete': ['x'],
+                'update': [
+                    {'id': 'a', 'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': -1},
+                    {'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1},
+                ],
+                'add': [{'id': 'b', 'days': 'thurs', 'times': '0900-2100', 'tz': 'UTC', 'price': 500}],
+            })
+        assert [(error['change'], error['rate']) for error in e.value.errors] == [
+            ('delete', 0), ('update', 0), ('update', 1), ('add', 0)
+        ]
+        assert str(e.value).startswith('delete rate 0: ')
+        assert ParkingRates.snapshot is published
+
+    @pytest.mark.parametrize('changes', [[], {'replace': []}, {'add': {}}])
+    def test_patch_invalid_changes(self, changes):
+        with pytest.raises(ValueError):
+            ParkingRates.patch_rates(changes)
+
+    def test_duplicate_ids(self):
+        with pytest.raises(InvalidRates):
+            ParkingRates.compile_rates({'rates': self.rates + [self.rates[0]]})
+
+    @pytest.mark.parametrize('engine', ['index', 'table'])
+    def test_patch_matches_compile(self, engine):
+        generator = random.Random(16)
+        timezones = ['America/Chicago', 'America/New_York', 'Asia/Kolkata', 'UTC']
+        days = ['mon', 'tues', 'wed', 'thurs', 'fri', 'sat', 'sun']
+
+        def random_rate(rate_id: str) -> dict:
+            start, end = generator.sample(range(0, 24 * 60, 30), 2)
+            return {
+                'id': rate_id,
+                'days': ','.join(generator.sample(days, generator.randint(1, 3))),
+                'times': f'{start // 60:02}{start % 60:02}-{end // 60:02}{end % 60:02}',
+                'tz': generator.choice(timezones),
+                'price': generator.randint(1, 50) * 100,
+            }
+
+        queries = []
+        for _ in range(300):
+            start = datetime(2020, 10, 5, tzinfo=timezone.utc) + timedelta(minutes=generator.randrange(0, 7 * 24 * 60, 15))
+            queries.append((start, start + timedelta(minutes=generator.randrange(15, 3 * 24 * 60, 15))))
+
+        try:
+            ParkingRates.use_engine(engine)
+            ParkingRates.load_rates({'rates': [random_rate(str(i)) for i in range(60)]})
+            next_id = 60
+            for _ in range(10):
+                ids = [rate.id for rate in ParkingRates.snapshot.rates]
+                deleted = generator.sample(ids, 3)
+                updated = generator.sample([i for i in ids if i not in deleted], 3)
+                ParkingRates.publish(ParkingRates.patch_rates({
+                    'delete': deleted,
+                    'update': [random_rate(rate_id) for rate_id in updated],
+                    'add': [random_rate(str(next_id + i)) for i in range(4)],
+                }))
+                next_id += 4
+
+                compiled = RateIndex(ParkingRates.snapshot.rates)
+                for mode in ['single', 'sum', 'span']:
+                    for start, end in queries:
+                        assert ParkingRates.snapshot.index.find(start, end, mode) == compiled.find(start, end, mode)
+        finally:
+            ParkingRates.use_engine('index')
+
+
 class TestRate:
     @pytest.mark.parametrize('days, time_span, timezone, price', [
         ('mon', '0900-2100', 'America/Chicago', 1500),
@@ -68,23 +342,55 @@ class TestRate:
         assert True == rate.time_span_in_rate(start, end)
         assert False == rate.time_span_in_rate(start, end.replace(hour=23))
 
+    @pytest.mark.parametrize('start,end,expected', [
+        ('2020-10-09T23:00:00-05:00', '2020-10-09T23:30:00-05:00', True),   # Friday evening
+        ('2020-10-10T01:00:00-05:00', '2020-10-10T05:00:00-05:00', True),   # Saturday morning
+        ('2020-10-09T22:00:00-05:00', '2020-10-10T06:00:00-05:00', True),   # Overnight
+        ('2020-10-09T21:59:00-05:00', '2020-10-10T06:00:00-05:00', False),
+        ('2020-10-09T22:00:00-05:00', '2020-10-10T06:00:01-05:00', False),
+        ('2020-10-09T05:00:00-05:00', '2020-10-09T06:00:00-05:00', False),  # Thursday night
+        ('2020-10-10T23:00:00-05:00', '2020-10-10T23:30:00-05:00', False),  # Saturday evening
+        ('2020-10-09T23:00:00-05:00', '2020-10-11T01:00:00-05:00', False),  # Multiple days
+    ])
+    def test_time_span_in_rate_overnight(self, start, end, expected):
+        rate = Rate('fri', '2200-0600', 'America/Chicago', 1500)
+        assert rate.time_span_in_rate(datetime.fromisoformat(start), datetime.fromisoformat(end)) == expected
+
+    def test_time_span_in_rate_multiple_weeks(self):
+        rate = Rate('mon', '0900-2100', 'America/Chicago', 1500)
+        start = datetime.fromisoformat('2020-10-12T12:00:00-05:00')
+        end = datetime.fromisoformat('2020-10-19T13:00:00-05:00')
+        assert False == rate.time_span_in_rate(start, end)
+
+    @pytest.mark.parametrize('days, expected', [
+        ('mon', 0b0000001),
+        ('mon,wed,fri', 0b0010101),
+        ('sun,sat', 0b1100000),
+    ])
+    def test_days_mask(self, days, expected):
+        rate = Rate(days, '0900-2100', 'America/Chicago', 1500)
+        assert rate.days_mask == expected
+
 
 class TestTimeSpan:
-    @pytest.mark.parametrize('start,end', [
-        ('1000', '1200'),
-        ('0900', '1200')
+    @pytest.mark.parametrize('start,end,overnight', [
+        ('1000', '1200', False),
+        ('0900', '1200', False),
+        ('2200', '0600', True),
+        ('1000', '0900', True),
     ])
-    def test_init(self, start, end):
+    def test_init(self, start, end, overnight):
         span = TimeSpan(f'{start}-{end}')
         assert span.start.strftime(TimeSpan.format) == start
         assert span.end.strftime(TimeSpan.format) == end
+        assert span.overnight == overnight
 
     @pytest.mark.parametrize('bad_time_span', [
         '999-1400',    # invalid start time
         '1000-999',    # invalid end time
         '1000-2500',   # invalid hour
         '1000-1261',   # invalid minute
-        '1000-0900',   # end time precedes start
+        '1000-1000',   # end time same as start
         '1000-end',    # bad time value
         '10:00-12:00', # incorrect format
         '1000-1100-1200',
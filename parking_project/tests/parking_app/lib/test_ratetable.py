@@ -0,0 +1,152 @@
+from datetime import datetime
+import os
+import threading
+
+import pytest
+
+from parking_app.lib.cache import LRUCache
+from parking_app.lib.rates import ParkingRates, RateRecord
+from parking_app.lib.ratetable import RateTableFile
+
+
+def weekdays(price: int) -> dict:
+    return {'id': 'weekdays', 'days': 'mon,tues,thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': price}
+
+
+def worker_rates(path) -> type:
+    # ParkingRates of a worker process sharing rates through a table file
+    rates = type('WorkerRates', (ParkingRates,), {
+        'snapshot': None,
+        'cache': LRUCache(maxsize=16),
+        'table_file': None,
+        'changes_lock': threading.Lock(),
+    })
+    rates.use_table_file(path)
+    return rates
+
+
+records = (
+    RateRecord(0b0001011, 540, 1260, 'America/Chicago', 1500),
+    RateRecord(0b1110000, 540, 1260, 'America/Chicago', 2000),
+    RateRecord(0b0000100, 360, 1080, 'Asia/Kolkata', 1750, 'kolkata-wed'),
+)
+
+
+class TestRateTableFile:
+    def test_write_read(self, tmp_path):
+        path = tmp_path / 'rates.table'
+        writer = RateTableFile(path)
+        version = writer.write(records)
+
+        # The writer already holds this version
+        assert writer.read_if_changed() is None
+
+        reader = RateTableFile(path)
+        assert reader.read_if_changed() == (version, [tuple(record) for record in records])
+        assert reader.read_if_changed() is None
+
+        new_version = writer.write(records[:1])
+        assert new_version > version
+        assert reader.read_if_changed() == (new_version, [tuple(records[0])])
+
+    def test_changed(self, tmp_path):
+        path = tmp_path / 'rates.table'
+        reader = RateTableFile(path)
+        assert not reader.changed()
+
+        RateTableFile(path).write(records)
+        assert reader.changed()
+        reader.read_if_changed()
+        assert not reader.changed()
+
+    def test_replaced_after_write(self, tmp_path, monkeypatch):
+        path = tmp_path / 'rates.table'
+        writer = RateTableFile(path)
+        other = RateTableFile(path)
+        replace = os.replace
+
+        # Another process replaces the table just after the writer renames
+        # its own into place
+        def replace_then_write(source, destination):
+            monkeypatch.setattr(os, 'replace', replace)
+            replace(source, destination)
+            other.write(records[:1])
+
+        monkeypatch.setattr(os, 'replace', replace_then_write)
+        writer.write(records)
+        assert writer.changed()
+        assert writer.read_if_changed() == (other.version, [tuple(records[0])])
+
+    def test_read_missing(self, tmp_path):
+        assert RateTableFile(tmp_path / 'rates.table').read_if_changed() is None
+
+    @pytest.mark.parametrize('contents', [
+        b'',
+        b'PKRT',
+        b'XXXX\x01\x00' + bytes(16),
+    ])
+    def test_read_invalid(self, tmp_path, contents):
+        path = tmp_path / 'rates.table'
+        path.write_bytes(contents)
+        with pytest.raises(ValueError):
+            RateTableFile(path).read_if_changed()
+
+    def test_read_truncated(self, tmp_path):
+        path = tmp_path / 'rates.table'
+        RateTableFile(path).write(records)
+        path.write_bytes(path.read_bytes()[:-1])
+        with pytest.raises(ValueError):
+            RateTableFile(path).read_if_changed()
+
+
+class TestParkingRatesTableFile:
+    @pytest.fixture(autouse=True)
+    def reset_table_file(self):
+        yield
+        ParkingRates.table_file = None
+
+    def test_sync(self, tmp_path):
+        path = tmp_path / 'rates.table'
+        ParkingRates.use_table_file(path)
+        ParkingRates.load_rates({'rates': [
+            {'days': 'thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500}
+        ]})
+        start = datetime.fromisoformat('2020-10-08T12:00:00-05:00')
+        end = datetime.fromisoformat('2020-10-08T18:00:00-05:00')
+        assert ParkingRates.get_rate_price(start, end) == 1500
+
+        # Another worker process publishes new rates
+        assert not ParkingRates.sync_pending()
+        RateTableFile(path).write((RateRecord(0b0001000, 540, 1260, 'America/Chicago', 2500),))
+        assert ParkingRates.sync_pending()
+        assert ParkingRates.get_rate_price(start, end) == 2500
+        assert not ParkingRates.sync_pending()
+
+    def test_changes_across_processes(self, tmp_path):
+        path = tmp_path / 'rates.table'
+        first = worker_rates(path)
+        second = worker_rates(path)
+        first.load_rates({'rates': [weekdays(1500)]})
+        published = threading.Event()
+
+        def put():
+            with second.changing():
+                second.publish(second.compile_rates({'rates': [weekdays(2500)]}))
+            published.set()
+
+        # New rates published by the second worker wait for a change the first
+        # is applying, rather than being published over by it
+        with first.changing():
+            snapshot = first.patch_rates({'add': [dict(weekdays(2000), id='weekend', days='sat,sun')]})
+            thread = threading.Thread(target=put)
+            thread.start()
+            assert not published.wait(0.2)
+            first.publish(snapshot)
+        thread.join()
+        assert [rate.price for rate in first.get_snapshot().rates] == [2500]
+        assert [rate.price for rate in second.get_snapshot().rates] == [2500]
+
+        # A change applies to rates published by the other worker
+        with first.changing():
+            first.publish(first.patch_rates({'update': [weekdays(3000)]}))
+        assert [rate.price for rate in second.get_snapshot().rates] == [3000]
@@ -0,0 +1,66 @@
+import pytest
+
+from parking_app.lib.records import RateArrays, RateRecord
+
+
+records = [
+    RateRecord(0b0000011, 9 * 60, 21 * 60, 'America/Chicago', 1500),
+    RateRecord(0b1100000, 22 * 60, 6 * 60, 'UTC', 500),
+    RateRecord(0b0000100, 0, 24 * 60, 'America/Chicago', 2 ** 40),
+]
+
+
+class TestRateArrays:
+    def test_sequence(self):
+        rates = RateArrays(records)
+        assert len(rates) == 3
+        assert rates[1] == records[1]
+        assert rates[-1] == records[-1]
+        assert list(rates) == records
+        assert rates == records
+        assert rates == tuple(records)
+        assert rates != records[:2]
+        # Each timezone name is held once
+        assert rates.timezones == ['America/Chicago', 'UTC']
+        assert list(rates.timezone_ids) == [0, 1, 0]
+        assert rates.ids is None
+
+    def test_ids(self):
+        rates = RateArrays(records[:2])
+        rates.append(records[2]._replace(id='a'))
+        assert rates.ids == [None, None, 'a']
+        assert rates[2].id == 'a'
+        assert rates[0].id is None
+
+        rates = RateArrays(records)
+        rates[1] = records[1]._replace(id='b')
+        assert [rate.id for rate in rates] == [None, 'b', None]
+
+    def test_change(self):
+        rates = RateArrays(records)
+        rates[0] = records[0]._replace(tz='Europe/Paris', price=100)
+        del rates[1]
+        assert rates == [records[0]._replace(tz='Europe/Paris', price=100), records[2]]
+
+    def test_copy(self):
+        rates = RateArrays(r._replace(id=str(i)) for i, r in enumerate(records))
+        copy = rates.copy()
+        del copy[0]
+        copy[0] = records[0]
+        assert [rate.id for rate in rates] == ['0', '1', '2']
+        assert rates[0] == records[0]._replace(id='0')
+        assert copy == [records[0], records[2]._replace(id='2')]
+
+    def test_digest(self):
+        rates = RateArrays(records)
+        assert rates.digest() == RateArrays(records).digest()
+        # Ids don't change prices, order and every other field does
+        assert RateArrays(r._replace(id='a') for r in records).digest() == rates.digest()
+        assert RateArrays(reversed(records)).digest() != rates.digest()
+        assert RateArrays(records[:2] + [records[2]._replace(price=1)]).digest() != rates.digest()
+        assert RateArrays(records[:2] + [records[2]._replace(tz='UTC')]).digest() != rates.digest()
+
+    def test_out_of_range(self):
+        rates = RateArrays()
+        with pytest.raises(IndexError):
+            rates[0]
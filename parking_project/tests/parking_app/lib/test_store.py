@@ -0,0 +1,93 @@
+from datetime import datetime
+import json
+
+import pytest
+
+from parking_app.lib.rates import ParkingRates
+from parking_app.lib.store import RateStore
+
+
+rates_file_path = 'tests/data/rates.json'
+
+
+class TestRateStore:
+    def test_save_load(self, tmp_path):
+        with open(rates_file_path) as f:
+            rates_dict = json.load(f)
+        store = RateStore(tmp_path / 'rates.json')
+        store.save(rates_dict)
+        assert RateStore(tmp_path / 'rates.json').load() == rates_dict
+
+    def test_save_rates(self, tmp_path):
+        with open(rates_file_path) as f:
+            rates_dict = json.load(f)
+        store = RateStore(tmp_path / 'rates.json')
+        store.save_rates(iter(rates_dict['rates']))
+        assert store.load() == rates_dict
+
+        store.save_rates([])
+        assert store.load() == {'rates': []}
+
+    def test_changed(self, tmp_path):
+        store = RateStore(tmp_path / 'rates.json')
+        other = RateStore(tmp_path / 'rates.json')
+        assert not store.changed()
+
+        other.save({'rates': []})
+        assert not other.changed()
+        assert store.changed()
+        store.open().close()
+        assert not store.changed()
+
+    def test_load_missing(self, tmp_path):
+        assert RateStore(tmp_path / 'rates.json').load() is None
+
+    def test_load_invalid(self, tmp_path):
+        (tmp_path / 'rates.json').write_text('{ "rates": [')
+        with pytest.raises(ValueError):
+            RateStore(tmp_path / 'rates.json').load()
+
+
+class TestParkingRatesStore:
+    @pytest.fixture(autouse=True)
+    def reset_store(self):
+        yield
+        ParkingRates.store = None
+
+    def test_warm_start(self, tmp_path):
+        path = tmp_path / 'rates.json'
+        ParkingRates.use_store(path)
+        ParkingRates.load_rates({'rates': [
+            {'days': 'mon,tues,thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500}
+        ]})
+        assert RateStore(path).load() == {'rates': [
+            {'days': 'mon,tues,thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500}
+        ]}
+
+        # Simulate a restart
+        ParkingRates.snapshot = None
+        ParkingRates.use_store(path)
+        start = datetime.fromisoformat('2020-10-08T12:00:00-05:00')
+        end = datetime.fromisoformat('2020-10-08T18:00:00-05:00')
+        assert ParkingRates.get_rate_price(start, end) == 1500
+
+    def test_warm_start_leaves_store(self, tmp_path):
+        # Loading the stored rates at startup doesn't write them back
+        path = tmp_path / 'rates.json'
+        with open(rates_file_path) as f:
+            stored = f.read()
+        path.write_text(stored)
+        modified = path.stat().st_mtime_ns
+
+        ParkingRates.snapshot = None
+        ParkingRates.use_store(path)
+        assert ParkingRates.rates_loaded()
+        assert path.read_text() == stored
+        assert path.stat().st_mtime_ns == modified
+
+    def test_warm_start_invalid(self, tmp_path):
+        path = tmp_path / 'rates.json'
+        path.write_text('{"rates": [{"days": "wedn"}]}')
+        ParkingRates.snapshot = None
+        ParkingRates.use_store(path)
+        assert not ParkingRates.rates_loaded()
@@ -0,0 +1,111 @@
+from datetime import datetime, timedelta, timezone
+import random
+
+import pytest
+
+from parking_app.lib.timestamp import Timestamp, epoch_microseconds, parse_datetime, parse_timestamp
+
+
+def expected_timestamp(value: str) -> Timestamp:
+    parsed = datetime.fromisoformat(value)
+    seconds, microsecond = divmod(epoch_microseconds(parsed), 1000000)
+    return Timestamp(seconds, microsecond, parsed)
+
+
+def random_datetime_string(rng: random.Random) -> str:
+    local = datetime(1, 1, 1) + timedelta(
+            days=rng.randrange(365 * 9998),
+            seconds=rng.randrange(24 * 60 * 60),
+            microseconds=rng.choice([0, 0, rng.randrange(1000) * 1000, rng.randrange(1000000)])
+    )
+    offset = timedelta(minutes=rng.randrange(-23 * 60 - 59, 23 * 60 + 60))
+    timespec = rng.choice(["minutes", "seconds", "milliseconds", "microseconds"])
+    return local.replace(tzinfo=timezone(offset)).isoformat(sep=rng.choice("T "), timespec=timespec)
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T07:00:00-05:00'),
+    ('2015-07-01T07:00:00Z', '2015-07-01T07:00:00+00:00'),
+    ('2015-07-01T07:00:00 05:00', '2015-07-01T07:00:00+05:00'),  # unescaped +
+    ('2015-07-01 07:00 05:00', '2015-07-01T07:00:00+05:00'),
+    ('2015-07-01T07:00:00.250+05:30', '2015-07-01T07:00:00.250+05:30'),
+    ('2016-02-29T23:59:59.999999-00:30', '2016-02-29T23:59:59.999999-00:30'),
+    ('2015-07-01T07:00:00-05:00:30', '2015-07-01T07:00:00-05:00:30'),
+    ('2015-07-01T07:00:00 05:00:30', '2015-07-01T07:00:00+05:00:30'),
+])
+def test_parse_timestamp(value, expected):
+    timestamp = parse_timestamp(value)
+    assert timestamp == expected_timestamp(expected)
+    assert timestamp.parsed.utcoffset() == datetime.fromisoformat(expected).utcoffset()
+
+
+@pytest.mark.parametrize('value', [
+    '2015-07-01T07:00:00',           # no timezone
+    '2015-02-29T07:00:00+00:00',     # not a leap year
+    '1900-02-29T07:00:00+00:00',
+    '2015-04-31T07:00:00+00:00',
+    '2015-00-01T07:00:00+00:00',
+    '0000-01-01T07:00:00+00:00',
+    '2015-07-01T24:00:00+00:00',
+    '2015-07-01T07:00:60+00:00',
+    '2015-07-01T07:00:00+24:00',
+    '2015-07-01T07:00:00X',
+    '',
+])
+def test_parse_timestamp_invalid(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+def test_parse_timestamp_matches_fromisoformat():
+    rng = random.Random(10)
+    for _ in range(20000):
+        value = random_datetime_string(rng)
+        assert parse_timestamp(value) == expected_timestamp(value), value
+
+
+def test_parse_timestamp_mutations_match_fromisoformat():
+    # Corrupted strings must be rejected exactly when fromisoformat rejects
+    # them, and otherwise parse to the same instant
+    rng = random.Random(11)
+    for _ in range(20000):
+        characters = list(random_datetime_string(rng))
+        for _ in range(rng.randint(1, 3)):
+            characters[rng.randrange(len(characters))] = rng.choice("0123456789-:.T+Z x")
+        value = "".join(characters)
+
+        try:
+            expected = expected_timestamp(value)
+        except (ValueError, TypeError):
+            expected = None
+        try:
+            actual = parse_timestamp(value)
+        except ValueError:
+            actual = None
+
+        if expected is None and actual is not None:
+            # Only the forms sent by clients that fromisoformat doesn't know
+            sign = value.rfind(" ")
+            if sign > 10:
+                expected = expected_timestamp(value[:sign] + "+" + value[sign + 1:])
+            else:
+                expected = expected_timestamp(value[:-1] + "+00:00")
+        assert actual == expected, value
+        if actual is not None:
+            assert actual.parsed.utcoffset() == expected.parsed.utcoffset(), value
+
+
+def test_parse_datetime():
+    assert parse_datetime('2015-07-01 07:00 05:00') == datetime.fromisoformat('2015-07-01T07:00+05:00')
+    with pytest.raises(ValueError, match="Timezone must be specified"):
+        parse_datetime('2015-07-01 07:00')
+
+
+def test_ceil():
+    assert parse_timestamp('2015-07-01T07:00:00+00:00').ceil == 1435734000
+    assert parse_timestamp('2015-07-01T07:00:00.001+00:00').ceil == 1435734001
+
+
+def test_epoch_microseconds():
+    value = '1969-12-31T23:59:59.500-01:00'
+    assert epoch_microseconds(parse_timestamp(value)) == epoch_microseconds(datetime.fromisoformat(value))
@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import pytest
+import pytz
+
+from parking_app.lib.index import day_number, end_minute, start_minute
+from parking_app.lib.timestamp import epoch_microseconds
+from parking_app.lib.timezones import TimezoneOffsets, timezone_offsets
+
+
+class TestTimezoneOffsets:
+    @pytest.mark.parametrize('tz', ['America/Chicago', 'Europe/London', 'Asia/Kolkata', 'UTC', 'Etc/GMT+5'])
+    @pytest.mark.parametrize('year', [1900, 2020, 2040])
+    def test_offset(self, tz, year):
+        timezone_info = pytz.timezone(tz)
+        offsets = TimezoneOffsets(timezone_info)
+        start = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp())
+        end = int(datetime(year + 1, 1, 1, tzinfo=timezone.utc).timestamp())
+        for timestamp in range(start, end, 3 * 60 * 60):
+            expected = datetime.fromtimestamp(timestamp, timezone_info).utcoffset()
+            assert offsets.offset(timestamp) == expected.total_seconds()
+
+    def test_offsets_at(self):
+        offsets = TimezoneOffsets(pytz.timezone('America/Chicago'))
+        timestamps = list(range(1583650000, 1583670000, 97))
+        assert offsets.offsets_at(timestamps) == [offsets.offset(timestamp) for timestamp in timestamps]
+
+    @pytest.mark.parametrize('value', [
+        '2020-03-08T07:59:59.999999+00:00',     # Daylight saving time starts
+        '2020-03-08T08:00:00+00:00',
+        '2020-11-01T06:59:30+00:00',            # Daylight saving time ends
+        '2020-11-01T07:00:00.5+00:00',
+        '2020-10-08T04:59:59.5+00:00',          # Local midnight
+        '2020-10-08T05:00:00+00:00',
+        '1883-11-18T12:00:00+00:00',            # Local mean time
+    ])
+    def test_localize(self, value):
+        # Converts as astimezone and the index minute rounding
+        timezone_info = pytz.timezone('America/Chicago')
+        instant = datetime.fromisoformat(value)
+        local = instant.astimezone(timezone_info)
+        microseconds = epoch_microseconds(instant)
+        expected = (day_number(local), start_minute(local), day_number(local), end_minute(local))
+        offsets = TimezoneOffsets(timezone_info)
+        assert offsets.localize(microseconds, microseconds) == expected
+        assert offsets.localize_boundaries([microseconds - 1, microseconds])[1] == expected
+
+    def test_shared(self):
+        offsets = timezone_offsets(pytz.timezone('America/Chicago'))
+        assert timezone_offsets(pytz.timezone('America/Chicago')) is offsets
+        assert timezone_offsets(pytz.timezone('America/New_York')) is not offsets
@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 
 import pytest
@@ -15,7 +15,8 @@ rates_file_path = 'tests/data/rates.json'
     ('2015-07-01T07:00:00+02:00', '2015-07-01T12:00:00+03:00'),  # different timezones
     ('2015-07-01T07:00:00-05:00', '2015-07-01T06:00:00-08:00'),
     ('2015-07-01T00:00:00-05:00', '2015-07-01T23:59:59-05:00'),  # full 24 hours
-    ('2015-07-01T07:00:00-05:00', '2015-07-02T12:00:00-05:00')   # multiple days
+    ('2015-07-01T07:00:00-05:00', '2015-07-02T12:00:00-05:00'),  # multiple days
+    ('2015-07-01T07:00:00.5-05:00', '2015-07-01T12:00:00.25-05:00')
 ])
 def test_validate_get_parking(start, end):
     start_dt, end_dt = validator.validate_get_parking(start, end)
@@ -37,6 +38,50 @@ def test_validate_get_parking_invalid(start, end):
         validator.validate_get_parking(start, end)
 
 
+@pytest.mark.parametrize('start,end,expected_start,expected_end', [
+    # A + left unescaped in a query string arrives as a space
+    ('2015-07-01T07:00:00 05:00', '2015-07-01T12:00:00 05:00',
+            '2015-07-01T07:00:00+05:00', '2015-07-01T12:00:00+05:00'),
+    ('2015-07-01T07:00:00Z', '2015-07-01 12:00Z',
+            '2015-07-01T07:00:00+00:00', '2015-07-01T12:00:00+00:00'),
+])
+def test_validate_get_parking_client_forms(start, end, expected_start, expected_end):
+    start_dt, end_dt = validator.validate_get_parking(start, end)
+    assert start_dt == datetime.fromisoformat(expected_start)
+    assert end_dt == datetime.fromisoformat(expected_end)
+
+
+def test_validate_get_parking_timestamps():
+    start, end = validator.validate_get_parking_timestamps(
+            '2015-07-01T07:00:00-05:00', '2015-07-01T07:00:00.001-05:00')
+    assert (start.seconds, start.microsecond) == (1435752000, 0)
+    assert start.parsed == datetime.fromisoformat('2015-07-01T07:00:00-05:00')
+    assert (end.seconds, end.microsecond) == (1435752000, 1000)
+    with pytest.raises(ValueError):
+        validator.validate_get_parking_timestamps(
+                '2015-07-01T07:00:00.001-05:00', '2015-07-01T07:00:00.001-05:00')
+
+
+def test_validate_get_parking_range():
+    start, end, slot = validator.validate_get_parking_range(
+            '2015-07-01T07:00:00-05:00', '2015-07-01T12:00:00-05:00', '15', 20)
+    assert (start.seconds, end.seconds) == (1435752000, 1435770000)
+    assert slot == timedelta(minutes=15)
+
+
+@pytest.mark.parametrize('start,end,slot', [
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T12:00:00-05:00', '0'),
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T12:00:00-05:00', '-15'),
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T12:00:00-05:00', '1.5'),
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T12:00:00-05:00', '9' * 30),
+    ('2015-07-01T07:00:00-05:00', '2015-07-01T12:00:01-05:00', '15'),   # 21 slots
+    ('2015-07-01T12:00:00-05:00', '2015-07-01T07:00:00-05:00', '15'),
+])
+def test_validate_get_parking_range_invalid(start, end, slot):
+    with pytest.raises(ValueError):
+        validator.validate_get_parking_range(start, end, slot, 20)
+
+
 def test_validate_put_parking():
     rates_str = open(rates_file_path).read()
     rates_dict = validator.validate_put_parking(rates_str)
@@ -51,3 +96,82 @@ def test_validate_put_parking():
 def test_validate_put_parking_invalid(bad_json):
     with pytest.raises(ValueError):
         validator.validate_put_parking(bad_json)
+
+
+def test_validate_patch_parking():
+    assert validator.validate_patch_parking('{"delete": ["a"]}') == {'delete': ['a']}
+
+
+@pytest.mark.parametrize('bad_json', ['', '[]', '{"delete":'])
+def test_validate_patch_parking_invalid(bad_json):
+    with pytest.raises(ValueError):
+        validator.validate_patch_parking(bad_json)
+
+
+def test_validate_post_batch():
+    items = validator.validate_post_batch(
+            '[{"start": "2015-07-01T07:00:00-05:00", "end": "2015-07-01T12:00:00-05:00"}, {}]',
+            2
+    )
+    assert items == [{"start": "2015-07-01T07:00:00-05:00", "end": "2015-07-01T12:00:00-05:00"}, {}]
+
+
+@pytest.mark.parametrize('bad_json', [
+    '',
+    '{"start": "2015-07-01T07:00:00-05:00", "end": "2015-07-01T12:00:00-05:00"}',  # not an array
+    '["2015-07-01T07:00:00-05:00"]',  # item not an object
+    '[{"start":',
+    '[{}, {}, {}]'  # too many items
+])
+def test_validate_post_batch_invalid(bad_json):
+    with pytest.raises(ValueError):
+        validator.validate_post_batch(bad_json, 2)
+
+
+@pytest.mark.parametrize('mode', ['single', 'sum'])
+def test_validate_query_mode(mode):
+    assert validator.validate_query_mode(mode) == mode
+
+
+@pytest.mark.parametrize('bad_mode', ['', 'SUM', 'total'])
+def test_validate_query_mode_invalid(bad_mode):
+    with pytest.raises(ValueError):
+        validator.validate_query_mode(bad_mode)
+
+
+@pytest.mark.parametrize('value,expected', [('true', True), ('1', True), ('false', False), ('0', False), (True, True)])
+def test_validate_flag(value, expected):
+    assert validator.validate_flag('strict', value) == expected
+
+
+@pytest.mark.parametrize('bad_value', ['', 'yes', 'True'])
+def test_validate_flag_invalid(bad_value):
+    with pytest.raises(ValueError):
+        validator.validate_flag('strict', bad_value)
+
+
+def test_validate_get_availability():
+    start, end, duration = validator.validate_get_availability('2020-03-07', '2020-03-08', '180', 'America/Chicago')
+    assert start.isoformat() == '2020-03-07T00:00:00-06:00'
+    assert end.isoformat() == '2020-03-09T00:00:00-05:00'
+    assert duration == timedelta(hours=3)
+
+
+@pytest.mark.parametrize('start,end,duration,tz', [
+    ('2020-03-07T00:00', '2020-03-08', '180', 'UTC'),     # not a date
+    ('2020-03-08', '2020-03-07', '180', 'UTC'),           # end precedes start
+    ('2020-03-01', '2020-04-01', '180', 'UTC'),           # more than 31 days
+    ('2020-03-07', '2020-03-08', '0', 'UTC'),             # invalid duration
+    ('2020-03-07', '2020-03-08', '1.5', 'UTC'),
+    ('2020-03-07', '2020-03-08', '10081', 'UTC'),
+    ('2020-03-07', '2020-03-08', '180', 'Mars/Olympus'),  # unknown timezone
+])
+def test_validate_get_availability_invalid(start, end, duration, tz):
+    with pytest.raises(ValueError):
+        validator.validate_get_availability(start, end, duration, tz)
+
+
+@pytest.mark.parametrize('limit,offset', [('0', '0'), ('101', '0'), ('10', '-1'), ('10', '10001'), ('ten', '0')])
+def test_validate_page_invalid(limit, offset):
+    with pytest.raises(ValueError):
+        validator.validate_page(limit, offset)
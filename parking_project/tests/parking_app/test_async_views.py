@@ -0,0 +1,79 @@
+import asyncio
+import json
+import threading
+
+from django.test import RequestFactory
+import pytest
+
+from parking_app import async_views
+from parking_app.lib.facilities import facilities
+from parking_app.lib.rates import ParkingRates, RateRecord
+from parking_app.lib.ratetable import RateTableFile
+
+
+rates = {'rates': [
+    {'id': 'weekdays', 'days': 'mon,tues,thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+]}
+
+query = {'start': '2020-10-08T12:00:00-05:00', 'end': '2020-10-08T18:00:00-05:00'}
+
+
+@pytest.fixture(autouse=True)
+def reset_rates():
+    ParkingRates.snapshot = None
+    facilities.rate_sets.clear()
+    facilities.compiled.clear()
+    yield
+    ParkingRates.snapshot = None
+    ParkingRates.table_file = None
+    facilities.rate_sets.clear()
+    facilities.compiled.clear()
+
+
+def serve(view, request, **kwargs):
+    return asyncio.run(asyncio.wait_for(view(request, **kwargs), 5))
+
+
+def test_query():
+    ParkingRates.load_rates(rates)
+    response = serve(async_views.ParkingQueryView.as_view(), RequestFactory().get('/park/query', query))
+    assert response.status_code == 200
+    assert json.loads(response.content) == {'rate': 1500}
+
+
+def test_put():
+    request = RequestFactory().put('/park/north/rates', json.dumps(rates), content_type='application/json')
+    response = serve(async_views.ParkingRatesView.as_view(), request, facility='north')
+    assert response.status_code == 201
+
+    request = RequestFactory().get('/park/north/query', query)
+    assert json.loads(serve(async_views.ParkingQueryView.as_view(), request, facility='north').content) == {
+        'rate': 1500
+    }
+
+
+def test_sync_during_update(tmp_path):
+    path = tmp_path / 'rates.table'
+    ParkingRates.use_table_file(path)
+    ParkingRates.load_rates(rates)
+    RateTableFile(path).write((RateRecord(0b0001000, 540, 1260, 'America/Chicago', 2500),))
+
+    # Rates published by another worker are compiled for a query even while
+    # a rates update is being compiled
+    updating = threading.Event()
+    update = async_views.rates_executor.submit(updating.wait)
+    try:
+        response = serve(async_views.ParkingQueryView.as_view(), RequestFactory().get('/park/query', query))
+        assert json.loads(response.content) == {'rate': 2500}
+    finally:
+        updating.set()
+        update.result()
+
+
+def test_ready_health_metrics():
+    request = RequestFactory().get('/park/health')
+    assert serve(async_views.ready, request).status_code == 200
+    assert serve(async_views.health, request).status_code == 503
+    ParkingRates.load_rates(rates)
+    assert serve(async_views.health, request).status_code == 200
+    assert b'\nparking_rates 1\n' in serve(async_views.metrics, request).content
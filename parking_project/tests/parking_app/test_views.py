@@ -0,0 +1,460 @@
+import gzip
+import json
+
+from django.test import Client
+import pytest
+
+from parking_app import views
+from parking_app.lib.facilities import facilities
+from parking_app.lib.rates import ParkingRates
+
+
+rates = {'rates': [
+    {'id': 'weekdays', 'days': 'mon,tues,thurs', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+    {'id': 'weekend', 'days': 'sat,sun', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2000},
+]}
+
+# Priced at 1500 by the weekdays rate
+start = '2020-10-08T12:00:00-05:00'
+end = '2020-10-08T18:00:00-05:00'
+
+
+@pytest.fixture(autouse=True)
+def reset_rates():
+    ParkingRates.snapshot = None
+    facilities.rate_sets.clear()
+    facilities.compiled.clear()
+    yield
+    ParkingRates.snapshot = None
+    facilities.rate_sets.clear()
+    facilities.compiled.clear()
+
+
+@pytest.fixture
+def client():
+    return Client()
+
+
+@pytest.fixture
+def loaded():
+    ParkingRates.load_rates(rates)
+
+
+class TestParkingBatchQueryView:
+    def post(self, client, items, path='/park/query/batch'):
+        return client.post(path, json.dumps(items), content_type='application/json')
+
+    def test_batch(self, client, loaded):
+        response = self.post(client, [
+            {'start': start, 'end': end},
+            {'start': '2020-10-09T12:00:00-05:00', 'end': '2020-10-09T18:00:00-05:00'},
+            {'start': end, 'end': start},
+            {'start': start},
+        ])
+        assert response.status_code == 200
+        results = response.json()['results']
+        assert results[:2] == [{'rate': 1500}, {'rate': 'unavailable'}]
+        assert results[2]['error'].startswith('Invalid start/end dates: ')
+        assert results[3] == {'error': 'start and end fields missing'}
+
+    def test_not_loaded(self, client):
+        response = self.post(client, [{'start': start, 'end': end}])
+        assert response.status_code == 503
+        assert response.json() == {'error': 'Parking rates not yet loaded'}
+
+    @pytest.mark.parametrize('body', ['[{"start":', '{"start": "2020-10-08T12:00:00-05:00"}', '["start"]'])
+    def test_invalid_body(self, client, loaded, body):
+        response = client.post('/park/query/batch', body, content_type='application/json')
+        assert response.status_code == 400
+        assert response.json()['error'].startswith('Invalid JSON in body: ')
+
+    def test_too_many_items(self, client, loaded):
+        response = self.post(client, [{'start': start, 'end': end}] * (views.max_batch_items + 1))
+        assert response.status_code == 400
+        assert response.json() == {'error': 'Invalid JSON in body: Batch has 1001 items, must have at most 1000'}
+
+        response = self.post(client, [{'start': start, 'end': end}] * views.max_batch_items)
+        assert response.status_code == 200
+        assert len(response.json()['results']) == views.max_batch_items
+
+    def test_invalid_mode(self, client, loaded):
+        response = self.post(client, [{'start': start, 'end': end}], '/park/query/batch?mode=total')
+        assert response.status_code == 400
+        assert 'error' in response.json()
+
+    def test_unknown_facility(self, client, loaded):
+        response = self.post(client, [{'start': start, 'end': end}], '/park/north/query/batch')
+        assert response.status_code == 404
+        assert response.json() == {'error': 'Unknown facility north'}
+
+
+class TestParkingRatesViewPatch:
+    def patch(self, client, changes, path='/park/rates'):
+        return client.patch(path, json.dumps(changes), content_type='application/json')
+
+    def test_patch(self, client, loaded):
+        response = self.patch(client, {'update': [dict(rates['rates'][0], price=1750)], 'delete': ['weekend']})
+        assert response.status_code == 200
+        assert client.get('/park/query', {'start': start, 'end': end}).json() == {'rate': 1750}
+        assert [rate.price for rate in ParkingRates.snapshot.rates] == [1750]
+
+    def test_not_loaded(self, client):
+        response = self.patch(client, {'delete': ['weekend']})
+        assert response.status_code == 503
+        assert response.json() == {'error': 'Parking rates not yet loaded'}
+
+    @pytest.mark.parametrize('body', ['{"delete":', '[]', '{"rename": []}'])
+    def test_invalid_body(self, client, loaded, body):
+        published = ParkingRates.snapshot
+        response = client.patch('/park/rates', body, content_type='application/json')
+        assert response.status_code == 400
+        assert response.json()['error'].endswith('Parking rates not updated.')
+        assert ParkingRates.snapshot is published
+
+    def test_invalid_change(self, client, loaded):
+        published = ParkingRates.snapshot
+        response = self.patch(client, {'delete': ['weekend', 'holidays']})
+        assert response.status_code == 400
+        assert response.json()['errors'] == [{'change': 'delete', 'rate': 1, 'error': 'No rate with id holidays'}]
+        assert ParkingRates.snapshot is published
+
+    def test_unknown_facility(self, client, loaded):
+        response = self.patch(client, {'delete': ['weekend']}, '/park/north/rates')
+        assert response.status_code == 404
+        assert response.json() == {'error': 'Unknown facility north'}
+
+
+class TestFacilityViews:
+    def put(self, client, document, facility='north'):
+        return client.put(f'/park/{facility}/rates', json.dumps(document), content_type='application/json')
+
+    def test_facility(self, client, loaded):
+        response = self.put(client, {'rates': [dict(rates['rates'][0], price=900)]})
+        assert response.status_code == 201
+        assert self.put(client, {'rates': [dict(rates['rates'][0], price=950)]}).status_code == 200
+
+        # Each facility is priced with its own rates
+        query = {'start': start, 'end': end}
+        assert client.get('/park/north/query', query).json() == {'rate': 950}
+        assert client.get('/park/query', query).json() == {'rate': 1500}
+
+        response = client.patch(
+                '/park/north/rates',
+                json.dumps({'update': [dict(rates['rates'][0], price=975)]}),
+                content_type='application/json'
+        )
+        assert response.status_code == 200
+        assert client.get('/park/north/query', query).json() == {'rate': 975}
+
+    def test_unknown_facility(self, client, loaded):
+        response = client.get('/park/north/query', {'start': start, 'end': end})
+        assert response.status_code == 404
+        assert response.json() == {'error': 'Unknown facility north'}
+
+    def test_invalid_facility(self, client):
+        response = self.put(client, rates, 'x' * 65)
+        assert response.status_code == 400
+        assert response.json()['error'].startswith('Invalid facility ')
+
+    def test_invalid_rates(self, client):
+        # A facility is only created once its rates compile
+        response = self.put(client, {'rates': [dict(rates['rates'][0], price=-1)]})
+        assert response.status_code == 400
+        assert response.json()['errors'][0]['rate'] == 0
+        assert 'north' not in facilities.rate_sets
+        assert client.get('/park/north/query', {'start': start, 'end': end}).status_code == 404
+
+
+class TestStatusViews:
+    def test_ready(self, client):
+        response = client.get('/park/ready')
+        assert response.status_code == 200
+        assert response.content == b'OK'
+
+    def test_health(self, client):
+        response = client.get('/park/health')
+        assert response.status_code == 503
+        assert response.json() == {'status': 'Unhealthy', 'details': 'parking rates not available'}
+
+        ParkingRates.load_rates(rates)
+        response = client.get('/park/health')
+        assert response.status_code == 200
+        assert response.json()['status'] == 'Healthy'
+        assert response.json()['cache']['generation'] == ParkingRates.snapshot.generation
+
+    def test_metrics(self, client, loaded):
+        client.get('/park/query', {'start': start, 'end': end})
+        response = client.get('/park/metrics')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'text/plain; version=0.0.4; charset=utf-8'
+        assert b'\nparking_rates 2\n' in response.content
+        assert b'\nparking_queries_total ' in response.content
+
+
+class TestParkingQueryView:
+    path = '/park/query'
+    query = {'start': start, 'end': end}
+
+    def test_query(self, client, loaded):
+        response = client.get(self.path, self.query)
+        assert response.status_code == 200
+        assert response.json() == {'rate': 1500}
+        assert response['Cache-Control'] == 'public, max-age=0'
+        # Each worker loads the rates at its own time, so only the ETag is
+        # the same whichever worker answers
+        assert 'Last-Modified' not in response
+
+    def test_not_modified(self, client, loaded):
+        etag = client.get(self.path, self.query)['ETag']
+        response = client.get(self.path, self.query, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        assert response.content == b''
+
+        ParkingRates.load_rates({'rates': rates['rates'][:1] + [
+            {'id': 'weekend', 'days': 'sat,sun', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 2500},
+        ]})
+        response = client.get(self.path, self.query, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+        assert response['ETag'] != etag
+
+    def test_one_snapshot(self, client, loaded, monkeypatch):
+        etag = client.get(self.path, self.query)['ETag']
+
+        # Rates published while a query is priced change neither its price
+        # nor its tag
+        get_rate_price = ParkingRates.get_rate_price
+
+        def publishing(*args):
+            ParkingRates.load_rates({'rates': [dict(rates['rates'][0], price=2500)]})
+            return get_rate_price(*args)
+
+        monkeypatch.setattr(ParkingRates, 'get_rate_price', publishing)
+        response = client.get(self.path, self.query)
+        assert response.json() == {'rate': 1500}
+        assert response['ETag'] == etag
+
+        monkeypatch.undo()
+        response = client.get(self.path, self.query, HTTP_IF_NONE_MATCH=etag)
+        assert response.json() == {'rate': 2500}
+        assert response['ETag'] != etag
+
+    def test_not_loaded(self, client):
+        response = client.get(self.path, self.query)
+        assert response.status_code == 503
+
+
+class TestParkingRangeQueryView:
+    path = '/park/query/range'
+    query = {'start': '2020-10-08T08:00:00-05:00', 'end': '2020-10-08T11:00:00-05:00', 'slot': '60'}
+    slots = [
+        {'start': '2020-10-08T08:00:00-05:00', 'end': '2020-10-08T09:00:00-05:00', 'rate': 'unavailable'},
+        {'start': '2020-10-08T09:00:00-05:00', 'end': '2020-10-08T10:00:00-05:00', 'rate': 1500},
+        {'start': '2020-10-08T10:00:00-05:00', 'end': '2020-10-08T11:00:00-05:00', 'rate': 1500},
+    ]
+
+    def test_range(self, client, loaded):
+        response = client.get(self.path, self.query)
+        assert response.status_code == 200
+        assert response.json() == {'slots': self.slots}
+
+    def test_not_modified(self, client, loaded):
+        etag = client.get(self.path, self.query)['ETag']
+        response = client.get(self.path, self.query, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        assert response['Vary'] == 'Accept'
+        # The stream is tagged apart from the JSON response
+        response = client.get(self.path, self.query, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='application/x-ndjson')
+        assert response.status_code == 200
+
+    def test_stream(self, client, loaded):
+        response = client.get(self.path, self.query, HTTP_ACCEPT='application/x-ndjson')
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/x-ndjson'
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert [json.loads(line) for line in lines] == self.slots
+
+    def test_slot_caps(self, client, loaded):
+        # A minute past the most slots of a JSON response, and of a stream
+        end = '2020-10-15T06:41:00-05:00'
+        response = client.get(self.path, dict(self.query, end=end, slot='1'))
+        assert response.status_code == 400
+        assert response.json() == {
+            'error': 'Invalid start/end dates or slot: Time range has 10001 slots, must have at most 10000'
+        }
+        response = client.get(self.path, dict(self.query, end=end, slot='1'), HTTP_ACCEPT='application/x-ndjson')
+        assert response.status_code == 200
+        assert len(b''.join(response.streaming_content).splitlines()) == 10001
+
+        end = '2020-12-16T18:41:00-05:00'
+        response = client.get(self.path, dict(self.query, end=end, slot='1'), HTTP_ACCEPT='application/x-ndjson')
+        assert response.status_code == 400
+        assert response.json()['error'].endswith('Time range has 100001 slots, must have at most 100000')
+
+    @pytest.mark.parametrize('query', [
+        {'start': '2020-10-08T08:00:00-05:00', 'end': '2020-10-08T11:00:00-05:00'},
+        {'start': '2020-10-08T08:00:00-05:00', 'end': '2020-10-08T11:00:00-05:00', 'slot': '0'},
+        {'start': '2020-10-08T11:00:00-05:00', 'end': '2020-10-08T08:00:00-05:00', 'slot': '60'},
+    ])
+    def test_invalid(self, client, loaded, query):
+        response = client.get(self.path, query)
+        assert response.status_code == 400
+        assert 'error' in response.json()
+
+    def test_not_loaded(self, client):
+        response = client.get(self.path, self.query)
+        assert response.status_code == 503
+        assert response.json() == {'error': 'Parking rates not yet loaded'}
+
+    def test_unknown_facility(self, client, loaded):
+        response = client.get('/park/north/query/range', self.query)
+        assert response.status_code == 404
+
+
+class TestParkingAvailabilityView:
+    path = '/park/availability'
+    query = {'start': '2020-10-08', 'end': '2020-10-11', 'duration': '360', 'tz': 'America/Chicago', 'limit': '2'}
+
+    def test_availability(self, client, loaded):
+        response = client.get(self.path, self.query)
+        assert response.status_code == 200
+        assert response.json() == {
+            'windows': [
+                {
+                    'earliest_start': '2020-10-08T09:00:00-05:00',
+                    'latest_start': '2020-10-08T15:00:00-05:00',
+                    'rate': 1500
+                },
+                {
+                    'earliest_start': '2020-10-10T09:00:00-05:00',
+                    'latest_start': '2020-10-10T15:00:00-05:00',
+                    'rate': 2000
+                },
+            ],
+            'total': 3,
+            'offset': 0,
+            'limit': 2
+        }
+
+        response = client.get(self.path, dict(self.query, offset='2'))
+        assert [window['earliest_start'] for window in response.json()['windows']] == ['2020-10-11T09:00:00-05:00']
+
+    def test_not_modified(self, client, loaded):
+        etag = client.get(self.path, self.query)['ETag']
+        response = client.get(self.path, self.query, HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        assert response['ETag'] == etag
+        # Each page is tagged apart
+        response = client.get(self.path, dict(self.query, offset='2'), HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 200
+
+    @pytest.mark.parametrize('query', [
+        {'start': '2020-10-08', 'end': '2020-10-11', 'duration': '360'},
+        {'start': '2020-10-08', 'end': '2020-10-11', 'duration': '360', 'tz': 'Mars/Olympus'},
+        {'start': '2020-10-11', 'end': '2020-10-08', 'duration': '360', 'tz': 'America/Chicago'},
+        {'start': '2020-10-08', 'end': '2020-10-11', 'duration': '0', 'tz': 'America/Chicago'},
+        {'start': '2020-10-08', 'end': '2020-10-11', 'duration': '360', 'tz': 'America/Chicago', 'limit': '0'},
+        {'start': '2020-10-08', 'end': '2020-10-11', 'duration': '360', 'tz': 'America/Chicago', 'mode': 'fast'},
+    ])
+    def test_invalid(self, client, loaded, query):
+        response = client.get(self.path, query)
+        assert response.status_code == 400
+        assert 'error' in response.json()
+
+    def test_not_loaded(self, client):
+        response = client.get(self.path, self.query)
+        assert response.status_code == 503
+        assert response.json() == {'error': 'Parking rates not yet loaded'}
+
+    def test_unknown_facility(self, client, loaded):
+        response = client.get('/park/north/availability', self.query)
+        assert response.status_code == 404
+
+    def test_facility(self, client):
+        client.put('/park/north/rates', json.dumps(rates), content_type='application/json')
+        response = client.get('/park/north/availability', self.query)
+        assert response.status_code == 200
+        assert response.json()['total'] == 3
+
+
+class TestParkingRatesViewPut:
+    def put(self, client, body, content_type='application/json', path='/park/rates', **headers):
+        return client.put(path, body, content_type=content_type, **headers)
+
+    def test_put(self, client):
+        response = self.put(client, json.dumps(rates))
+        assert response.status_code == 201
+        assert response.json() == {'overlaps': {'overlaps': 0, 'conflicts': 0, 'details': []}}
+        assert self.put(client, json.dumps(rates)).status_code == 200
+        assert client.get('/park/query', {'start': start, 'end': end}).json() == {'rate': 1500}
+
+    def test_ndjson(self, client):
+        body = ''.join(json.dumps(rate) + '\n' for rate in rates['rates'])
+        response = self.put(client, body, 'application/x-ndjson')
+        assert response.status_code == 201
+        assert [rate.id for rate in ParkingRates.snapshot.rates] == ['weekdays', 'weekend']
+
+    def test_gzip(self, client):
+        response = self.put(client, gzip.compress(json.dumps(rates).encode()), HTTP_CONTENT_ENCODING='gzip')
+        assert response.status_code == 201
+        assert len(ParkingRates.snapshot.rates) == 2
+
+    @pytest.mark.parametrize('body,headers', [
+        ('{"rates": [', {}),
+        ('{"rates": [{"days": "mon"', {}),
+        (json.dumps(rates), {'HTTP_CONTENT_ENCODING': 'br'}),
+        (json.dumps(rates), {'HTTP_CONTENT_ENCODING': 'gzip'}),
+    ])
+    def test_invalid_body(self, client, loaded, body, headers):
+        published = ParkingRates.snapshot
+        response = self.put(client, body, **headers)
+        assert response.status_code == 400
+        assert response.json()['error'].startswith('Invalid JSON in body: ')
+        assert ParkingRates.snapshot is published
+
+    def test_invalid_rates(self, client, loaded):
+        published = ParkingRates.snapshot
+        document = {'rates': [rates['rates'][0], dict(rates['rates'][1], price=-1), dict(rates['rates'][1], tz='Mars')]}
+        response = self.put(client, json.dumps(document))
+        assert response.status_code == 400
+        assert [error['rate'] for error in response.json()['errors']] == [1, 2]
+        assert ParkingRates.snapshot is published
+
+
+class TestParkingRatesViewOverlaps:
+    overlapping = {'rates': [
+        {'days': 'mon', 'times': '0900-2100', 'tz': 'America/Chicago', 'price': 1500},
+        {'days': 'mon,tues', 'times': '1200-1300', 'tz': 'America/Chicago', 'price': 500},
+    ]}
+    overlaps = {'overlaps': 1, 'conflicts': 1, 'details': [
+        {'day': 'mon', 'times': '1200-1300', 'tz': 'America/Chicago', 'rates': [0, 1], 'prices': [1500, 500]},
+    ]}
+
+    def put(self, client, path):
+        return client.put(path, json.dumps(self.overlapping), content_type='application/json')
+
+    def test_overlaps(self, client):
+        response = self.put(client, '/park/rates')
+        assert response.status_code == 201
+        assert response.json() == {'overlaps': self.overlaps}
+
+    def test_strict(self, client, loaded):
+        published = ParkingRates.snapshot
+        response = self.put(client, '/park/rates?strict=true')
+        assert response.status_code == 409
+        assert response.json() == {
+            'error': 'Conflicting rates: rates 0 and 1 overlap on mon 1200-1300 America/Chicago with different '
+                     'prices. Parking rates not updated.',
+            'overlaps': self.overlaps
+        }
+        assert ParkingRates.snapshot is published
+
+    def test_strict_facility(self, client):
+        assert self.put(client, '/park/north/rates?strict=1').status_code == 409
+        assert 'north' not in facilities.rate_sets
+
+    def test_invalid_strict(self, client):
+        response = self.put(client, '/park/rates?strict=maybe')
+        assert response.status_code == 400
+        assert response.json() == {'error': 'Invalid strict maybe, must be one of: true, 1, false, 0'}